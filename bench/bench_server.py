@@ -0,0 +1,52 @@
+# 基准测试用的 webui 服务：与 serve.py 相同（gevent），但缓存 / 训练脚本换成 bench/emitter.py。
+# 在基准工作目录中运行（src/config.yaml 与 .webui 均相对于当前目录）；没有 gevent 或指定 --dev 时使用 Flask 多线程开发服务器
+# 用法：python bench/bench_server.py --port 5000 [--dev]
+import importlib.util
+import os
+import sys
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+EMITTER = os.path.join(BENCH_DIR, 'emitter.py')
+sys.path.insert(0, ROOT)
+
+
+def patch_scripts(t):
+    # 训练命令是 accelerate launch <TRAIN_SCRIPT>，换成直接用当前解释器运行发射器
+    t.LATENTS_SCRIPT = EMITTER
+    t.TEXT_ENC_SCRIPT = EMITTER
+    t.TRAIN_SCRIPT = EMITTER
+    build_commands = t.build_commands
+
+    def bench_build_commands(config, task_name, action, resume_path=None):
+        commands = build_commands(config, task_name, action, resume_path)
+        return [(name, [sys.executable, '-u', *argv[argv.index(EMITTER):]] if argv[0] == 'accelerate' else argv)
+                for name, argv in commands]
+
+    t.build_commands = bench_build_commands
+
+
+def main():
+    dev = '--dev' in sys.argv
+    if dev: sys.argv.remove('--dev')
+    if not dev and importlib.util.find_spec('gevent') is None: dev = True
+    if dev:
+        import argparse
+        import t
+        parser = argparse.ArgumentParser()
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=5000)
+        args, _ = parser.parse_known_args()
+        patch_scripts(t)
+        t.JOB_QUEUE.start()
+        print(f"Serving (dev) on http://{args.host}:{args.port}")
+        t.app.run(host=args.host, port=args.port, threaded=True, debug=False, use_reloader=False)
+        return
+    # serve 在导入时打 gevent 补丁，必须先于 t 导入
+    import serve
+    patch_scripts(serve.t)
+    serve.main()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+# 对比两份 run_bench.py 的结果 JSON，逐项输出变化比例；超过阈值的退化以非零状态退出
+# 用法：python bench/compare.py before.json after.json [--threshold 0.2]
+import argparse
+import json
+import sys
+
+# 列表项按这些字段区分
+ITEM_KEYS = ('scenario', 'tasks', 'viewers')
+HIGHER_IS_BETTER = ('per_sec', 'rps', 'delivery_ratio')
+LOWER_IS_BETTER = ('_ms', 'seconds', 'cpu_us_per_line')
+SKIP = ('meta', 'config', 'count', 'statuses', 'file_bytes', 'logged_lines', 'exit_code')
+
+
+def flatten(value, prefix=''):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if key in SKIP: continue
+            yield from flatten(item, f"{prefix}.{key}" if prefix else key)
+    elif isinstance(value, list):
+        for item in value:
+            if not isinstance(item, dict): continue
+            label = next((f"{k}={item[k]}" for k in ITEM_KEYS if k in item), None)
+            if label: yield from flatten({k: v for k, v in item.items() if k not in ITEM_KEYS}, f"{prefix}[{label}]")
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        yield prefix, value
+
+
+def direction(path):
+    # 1：越大越好，-1：越小越好，0：不参与判断
+    if any(part in path for part in HIGHER_IS_BETTER): return 1
+    if any(part in path for part in LOWER_IS_BETTER): return -1
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="compare two benchmark result files")
+    parser.add_argument('before')
+    parser.add_argument('after')
+    parser.add_argument('--threshold', type=float, default=0.2, help="相对变化超过该比例视为退化")
+    args = parser.parse_args()
+
+    with open(args.before, 'r', encoding='utf-8') as f: before = dict(flatten(json.load(f)))
+    with open(args.after, 'r', encoding='utf-8') as f: after = dict(flatten(json.load(f)))
+    regressions = []
+    rows = []
+    for path in sorted(set(before) & set(after)):
+        old, new = before[path], after[path]
+        sign = direction(path)
+        change = (new - old) / old if old else None
+        worse = change is not None and sign and change * sign < -args.threshold
+        rows.append({"metric": path, "before": old, "after": new,
+                     "change": round(change, 4) if change is not None else None, "regression": bool(worse)})
+        if worse: regressions.append(path)
+    print(json.dumps({"threshold": args.threshold, "regressions": regressions, "metrics": rows}, indent=2))
+    if regressions: sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+# 合成的训练 / 缓存脚本：按配置的速率输出普通日志行和 tqdm 风格的 \r 进度刷新，基准测试时替换真实脚本
+# 接受并忽略任意命令行参数；配置来自环境变量 BENCH_EMITTER（JSON），其次是工作目录下的 bench_emitter.json：
+#   lines        普通行数
+#   rate         每秒普通行数，0 表示不限速
+#   cr_per_line  每两行之间的 \r 进度刷新次数（tqdm 刷屏）
+#   width        每行的大致字节数
+#   stamp        行内写入发送时刻 BENCH:<time_ns>，用于测端到端延迟
+#   exit_code    退出码
+import json
+import os
+import sys
+import time
+
+DEFAULTS = {"lines": 1000, "rate": 0, "cr_per_line": 0, "width": 80, "stamp": False, "exit_code": 0}
+STAMP = "BENCH:"
+
+
+def load_config():
+    raw = os.environ.get('BENCH_EMITTER')
+    if raw: return {**DEFAULTS, **json.loads(raw)}
+    try:
+        with open('bench_emitter.json', 'r', encoding='utf-8') as f: return {**DEFAULTS, **json.load(f)}
+    except (OSError, ValueError):
+        return dict(DEFAULTS)
+
+
+def main():
+    config = load_config()
+    out = sys.stdout.buffer
+    lines, rate, crs = int(config['lines']), float(config['rate']), int(config['cr_per_line'])
+    pad = 'x' * max(0, int(config['width']) - 40)
+    start = time.perf_counter()
+    for i in range(1, lines + 1):
+        if rate:
+            delay = start + i / rate - time.perf_counter()
+            if delay > 0: time.sleep(delay)
+        for j in range(1, crs + 1):
+            out.write(f"\r{j}/{crs} [00:01<00:02, {j * 7.5:.2f}it/s, avr_loss=0.{i % 1000:03d}]".encode())
+            out.flush()
+        # 与 tqdm 一样，进度刷新之后以 \r 回到行首再输出完整的一行
+        prefix = "\r" if crs else ""
+        stamp = f" {STAMP}{time.time_ns()}" if config['stamp'] else ""
+        out.write(f"{prefix}steps: {i}/{lines} [00:01<00:02, 1.00it/s, avr_loss=0.1]{stamp} {pad}\n".encode())
+        out.flush()
+    sys.exit(int(config['exit_code']))
+
+
+if __name__ == '__main__':
+    main()
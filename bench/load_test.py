@@ -0,0 +1,202 @@
+# 负载测试：N 个并发日志观看者（SSE /stream_logs）+ API 请求流量，统计端到端日志延迟与各接口延迟，结果输出为 JSON
+# 用法：
+#   python bench/load_test.py --spawn                      # 自动以生产模式（serve.py）启动服务再压测
+#   python bench/load_test.py --url http://127.0.0.1:5000  # 压测已在运行的服务
+# 注意：日志延迟通过 /console_input 写入标记行来测量，压测期间服务端不应有任务在运行
+import argparse
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MARKER = "LOADTEST:"
+
+
+def percentiles(values):
+    if not values: return {"count": 0}
+    values = sorted(values)
+    pick = lambda q: values[min(len(values) - 1, int(q * len(values)))]
+    return {"count": len(values), "p50": round(pick(0.50), 2), "p95": round(pick(0.95), 2),
+            "p99": round(pick(0.99), 2), "max": round(values[-1], 2)}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def spawn_server(port, server_args=()):
+    cmd = [sys.executable, os.path.join(ROOT, 'serve.py'), '--port', str(port), *server_args]
+    proc = subprocess.Popen(cmd, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/task_status')
+            conn.getresponse().read()
+            return proc
+        except OSError:
+            time.sleep(0.2)
+    proc.kill()
+    raise SystemExit("server did not start")
+
+
+class LoadTest:
+    def __init__(self, url, viewers, duration, api_workers, api_rps, marker_interval):
+        parsed = urllib.parse.urlparse(url)
+        self.host, self.port = parsed.hostname, parsed.port or 80
+        self.viewers = viewers
+        self.duration = duration
+        self.api_workers = api_workers
+        self.api_rps = api_rps
+        self.marker_interval = marker_interval
+        self.stop = threading.Event()
+        self.lock = threading.Lock()
+        self.connected = 0
+        self.viewer_errors = 0
+        self.marker_latency = []
+        self.api_latency = {}
+        self.api_errors = {}
+        self.markers_sent = 0
+
+    def request(self, method, path, body=None, timeout=30):
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=timeout)
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        conn.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+        resp = conn.getresponse()
+        data = resp.read()
+        conn.close()
+        return resp.status, data
+
+    def viewer(self, ready):
+        try:
+            conn = http.client.HTTPConnection(self.host, self.port, timeout=self.duration + 30)
+            conn.request('GET', '/stream_logs?format=sse')
+            resp = conn.getresponse()
+            with self.lock: self.connected += 1
+            ready.release()
+            seen = set()
+            while not self.stop.is_set():
+                line = resp.readline()
+                if not line: break
+                if not line.startswith(b'data: '): continue
+                now = time.monotonic_ns()
+                text = json.loads(line[6:])
+                for part in text.split(MARKER)[1:]:
+                    stamp = part.split(None, 1)[0] if part.strip() else ''
+                    if not stamp.isdigit() or stamp in seen: continue
+                    seen.add(stamp)
+                    with self.lock: self.marker_latency.append((now - int(stamp)) / 1e6)
+            conn.close()
+        except (OSError, ValueError):
+            with self.lock: self.viewer_errors += 1
+            ready.release()
+
+    def marker_producer(self):
+        while not self.stop.wait(self.marker_interval):
+            try:
+                self.request('POST', '/console_input', {"cmd": f"echo {MARKER}{time.monotonic_ns()}"})
+                self.markers_sent += 1
+            except OSError:
+                pass
+
+    def api_worker(self, paths):
+        interval = self.api_workers / self.api_rps if self.api_rps else 0
+        i = 0
+        while not self.stop.is_set():
+            path = paths[i % len(paths)]
+            i += 1
+            start = time.perf_counter()
+            try:
+                status, _ = self.request('GET', path)
+                ok = status < 500
+            except OSError:
+                ok = False
+            elapsed = (time.perf_counter() - start) * 1000
+            route = path.split('?')[0]
+            with self.lock:
+                self.api_latency.setdefault(route, []).append(elapsed)
+                if not ok: self.api_errors[route] = self.api_errors.get(route, 0) + 1
+            if interval: self.stop.wait(max(0.0, interval - elapsed / 1000))
+
+    def run(self):
+        _, data = self.request('GET', '/get_tasks')
+        tasks = json.loads(data).get('tasks', [])
+        paths = ['/get_tasks', '/task_status', '/get_queue']
+        if tasks: paths.append(f"/load_task?task={urllib.parse.quote(tasks[0])}")
+
+        ready = threading.Semaphore(0)
+        threads = [threading.Thread(target=self.viewer, args=(ready,), daemon=True) for _ in range(self.viewers)]
+        for th in threads: th.start()
+        for _ in threads: ready.acquire(timeout=30)
+
+        workers = [threading.Thread(target=self.api_worker, args=(paths,), daemon=True)
+                   for _ in range(self.api_workers)]
+        workers.append(threading.Thread(target=self.marker_producer, daemon=True))
+        started = time.time()
+        for th in workers: th.start()
+        time.sleep(self.duration)
+        # 留出时间让最后的标记送达
+        time.sleep(1)
+        self.stop.set()
+        elapsed = time.time() - started
+
+        expected = self.markers_sent * self.connected
+        return {
+            "config": {"viewers": self.viewers, "duration": self.duration, "api_workers": self.api_workers,
+                       "api_rps": self.api_rps, "marker_interval": self.marker_interval},
+            "viewers": {"connected": self.connected, "errors": self.viewer_errors,
+                        "markers_sent": self.markers_sent,
+                        "delivery_ratio": round(len(self.marker_latency) / expected, 4) if expected else None,
+                        "latency_ms": percentiles(self.marker_latency)},
+            "api": {route: {**percentiles(values), "errors": self.api_errors.get(route, 0),
+                            "rps": round(len(values) / elapsed, 1)}
+                    for route, values in sorted(self.api_latency.items())},
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="webui load test: concurrent log viewers + API traffic")
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--spawn', action='store_true', help="启动 serve.py（生产模式）并压测它")
+    parser.add_argument('--viewers', type=int, default=300)
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--api-workers', type=int, default=8)
+    parser.add_argument('--api-rps', type=float, default=100, help="API 请求总速率，0 表示不限速")
+    parser.add_argument('--marker-interval', type=float, default=0.5)
+    parser.add_argument('--max-p99-ms', type=float, default=None, help="任一 p99 延迟超过该值时以非零状态退出")
+    parser.add_argument('--output', default=None, help="结果 JSON 写入文件（默认输出到 stdout）")
+    args = parser.parse_args()
+
+    proc = None
+    url = args.url
+    if args.spawn:
+        port = free_port()
+        proc = spawn_server(port)
+        url = f"http://127.0.0.1:{port}"
+    try:
+        result = LoadTest(url, args.viewers, args.duration, args.api_workers, args.api_rps,
+                          args.marker_interval).run()
+    finally:
+        if proc:
+            proc.terminate()
+            proc.wait(timeout=10)
+
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f: f.write(text)
+    print(text)
+    if args.max_p99_ms is not None:
+        p99s = [result['viewers']['latency_ms'].get('p99', 0)] + [r.get('p99', 0) for r in result['api'].values()]
+        if max(p99s) > args.max_p99_ms: sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
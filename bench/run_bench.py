@@ -0,0 +1,368 @@
+# webui 热路径基准测试，结果输出为 JSON，便于不同版本之间对比（对比用 bench/compare.py）
+#   capture  run_background_process 捕获发射器输出的吞吐（普通行 / tqdm \r 刷屏），以及 webui 进程的 CPU 开销
+#   stream   N 个 SSE 观看者下，发射器写出一行到 /stream_logs 送达的端到端延迟
+#   yaml     load_full_yaml / save_full_yaml / 冷解析 / 单任务 commit 的耗时随任务数的变化
+#   api      /get_tasks、/load_task、/save 的并发请求吞吐与延迟
+# 缓存 / 训练脚本替换为 bench/emitter.py，所有文件写在临时工作目录中，不触碰仓库内的配置
+# 用法：
+#   python bench/run_bench.py --output before.json
+#   python bench/run_bench.py --only capture,yaml --quick
+import argparse
+import http.client
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+from load_test import free_port, percentiles
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+EMITTER = os.path.join(BENCH_DIR, 'emitter.py')
+STAMP = b"BENCH:"
+SUITES = ('capture', 'stream', 'yaml', 'api')
+
+# 与 src/config.yaml 中的任务结构一致
+TASK_TEMPLATE = {
+    "output_name": None, "output_dir": None, "max_train_epochs": 40, "save_every_n_epochs": 2,
+    "sample_every_n_epochs": 2, "dim_from_weights": False, "dit": "./models/dit.safetensors",
+    "vae": "./models/vae.safetensors", "text_encoder": "./models/te.safetensors", "gradient_checkpointing": True,
+    "gradient_checkpointing_cpu_offload": False, "optimizer_type": "adamw", "learning_rate": "0.0001",
+    "timestep_sampling": "qwen_shift", "loraplus_lr_ratio": "4", "network_dim": 32, "network_alpha": 16,
+    "blocks_to_swap": 16, "lora": "Qwen-Image-Edit-2509", "model_version": "edit-2509",
+    "dataset_config": "./src/bench.json", "sample_prompts": "./src/bench.json",
+}
+DATASET = {"general": {"enable_bucket": True, "batch_size": 1, "caption_extension": ".txt", "num_repeats": 1},
+           "datasets": [{"resolution": [1024, 1024], "image_directory": "./dataset/bench",
+                         "cache_directory": "./dataset/bench/cache"}]}
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True,
+                              timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def write_config(path, tasks):
+    # 直接写 YAML 文本：生成过程不依赖被测代码
+    lines = ["qwen:", "  global_config:", "    mixed_precision: bf16", "    sdpa: true", "  cache:",
+             "    vae_tiling: true", "    vae_chunk_size: 32", "    batch_size: 16"]
+    for i in range(tasks):
+        name = f"bench_{i}"
+        lines.append(f"  {name}:")
+        for key, value in {**TASK_TEMPLATE, "output_name": name, "output_dir": f"./output/{name}"}.items():
+            lines.append(f"    {key}: {json.dumps(value)}")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f: f.write('\n'.join(lines) + '\n')
+
+
+def prepare_workdir(folder, tasks):
+    write_config(os.path.join(folder, 'src', 'config.yaml'), tasks)
+    with open(os.path.join(folder, 'src', 'bench.json'), 'w', encoding='utf-8') as f: json.dump(DATASET, f)
+    os.makedirs(os.path.join(folder, 'dataset', 'bench'), exist_ok=True)
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return percentiles(samples)
+
+
+# --- capture ---
+def bench_capture(t, scenarios):
+    results = []
+    for name, config in scenarios.items():
+        job = {"id": f"capture-{name}", "task": "bench", "action": "cache"}
+        run = t.JobRun(job, {"index": 0, "device": None, "job_id": job['id'], "worker": None})
+        run.is_running = True
+        step = {"name": name, "kind": "latents", "argv": [sys.executable, '-u', EMITTER],
+                "env": {"BENCH_EMITTER": json.dumps(config)}}
+        t.CONSOLE_LOGS.clear()
+        cpu, children = time.process_time(), os.times()
+        start = time.perf_counter()
+        rc = t.run_background_process(run, [step])
+        elapsed = time.perf_counter() - start
+        cpu = time.process_time() - cpu
+        child_cpu = sum(os.times()[2:4]) - sum(children[2:4])
+        lines = config['lines']
+        # 日志缓冲只保留最近的行，字节数按发射器的行宽估算
+        payload = lines * (config['width'] + config['cr_per_line'] * 50)
+        results.append({"scenario": name, "config": config, "exit_code": rc, "seconds": round(elapsed, 3),
+                        "logged_lines": run.logs.last_seq, "lines_per_sec": round(lines / elapsed, 1),
+                        "progress_updates_per_sec": round(lines * config['cr_per_line'] / elapsed, 1),
+                        "approx_mb_per_sec": round(payload / elapsed / 1e6, 3),
+                        "webui_cpu_seconds": round(cpu, 3), "emitter_cpu_seconds": round(child_cpu, 3),
+                        "webui_cpu_us_per_line": round(cpu / lines * 1e6, 2)})
+    return results
+
+
+# --- HTTP 工具 ---
+class Server:
+    def __init__(self, workdir, dev=False):
+        self.workdir = workdir
+        self.port = free_port()
+        cmd = [sys.executable, os.path.join(BENCH_DIR, 'bench_server.py'), '--port', str(self.port)]
+        if dev: cmd.append('--dev')
+        self.proc = subprocess.Popen(cmd, cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        deadline = time.time() + 30
+        while time.time() < deadline:
+            try:
+                self.request('GET', '/task_status', timeout=1)
+                return
+            except OSError:
+                time.sleep(0.2)
+        self.close()
+        raise SystemExit("bench server did not start")
+
+    def request(self, method, path, body=None, timeout=30):
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=timeout)
+        try:
+            headers = {"Content-Type": "application/json"} if body is not None else {}
+            conn.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+            resp = conn.getresponse()
+            return resp.status, resp.read()
+        finally:
+            conn.close()
+
+    def wait_job(self, job_id, timeout=600):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            _, data = self.request('GET', '/get_queue')
+            job = next((j for j in json.loads(data)['jobs'] if j['id'] == job_id), None)
+            if job and job['state'] not in ('queued', 'running'): return job
+            time.sleep(0.2)
+        return None
+
+    def close(self):
+        self.proc.terminate()
+        try:
+            self.proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+
+
+# --- stream ---
+class Viewer(threading.Thread):
+    # 订阅全局控制台（任务输出也会汇入），解析行内的发送时间戳；连接前已有的日志（上一轮的输出）不计入
+    def __init__(self, server, ready):
+        super().__init__(daemon=True)
+        self.server, self.ready = server, ready
+        self.latency = []
+        self.seen = set()
+        self.error = None
+        self.conn = None
+        self.stop = threading.Event()
+
+    def close(self):
+        self.stop.set()
+        try:
+            self.conn.sock.shutdown(socket.SHUT_RDWR)
+        except (AttributeError, OSError):
+            pass
+
+    def run(self):
+        try:
+            self.conn = conn = http.client.HTTPConnection('127.0.0.1', self.server.port, timeout=120)
+            conn.request('GET', '/stream_logs?format=sse')
+            resp = conn.getresponse()
+            start_seq = int(resp.getheader('X-Log-Seq') or 0)
+            event_id = 0
+            self.ready.release()
+            while not self.stop.is_set():
+                line = resp.readline()
+                if not line: break
+                if line.startswith(b'id: '): event_id = int(line[4:])
+                if not line.startswith(b'data: ') or STAMP not in line or event_id <= start_seq: continue
+                now = time.time_ns()
+                for part in json.loads(line[6:]).encode().split(STAMP)[1:]:
+                    stamp = part.split(None, 1)[0] if part.strip() else b''
+                    if not stamp.isdigit() or stamp in self.seen: continue
+                    self.seen.add(stamp)
+                    self.latency.append((now - int(stamp)) / 1e6)
+            conn.close()
+        except (OSError, ValueError) as e:
+            if self.stop.is_set(): return
+            self.error = str(e)
+            self.ready.release()
+
+
+def bench_stream(server, viewer_counts, config):
+    results = []
+    for count in viewer_counts:
+        ready = threading.Semaphore(0)
+        viewers = [Viewer(server, ready) for _ in range(count)]
+        for v in viewers: v.start()
+        for _ in viewers: ready.acquire(timeout=30)
+        with open(os.path.join(server.workdir, 'bench_emitter.json'), 'w', encoding='utf-8') as f:
+            json.dump({**config, "stamp": True}, f)
+        _, data = server.request('GET', '/execute_task?task=bench_0&action=cache&force=1')
+        job = server.wait_job(json.loads(data)['job_id'])
+        time.sleep(1)
+        for v in viewers: v.close()
+        for v in viewers: v.join(timeout=10)
+        # 缓存任务有两个步骤，每步输出 lines 行
+        expected = config['lines'] * 2 * count
+        latency = [ms for v in viewers for ms in v.latency]
+        results.append({"viewers": count, "config": config, "job_state": job and job['state'],
+                        "errors": sum(1 for v in viewers if v.error),
+                        "delivery_ratio": round(len(latency) / expected, 4) if expected else None,
+                        "latency_ms": percentiles(latency)})
+    return results
+
+
+# --- yaml ---
+def bench_yaml(t, workdir, task_counts, repeat):
+    results = []
+    path = os.path.join(workdir, 'src', 'config.yaml')
+    for count in task_counts:
+        write_config(path, count)
+        doc = t.load_full_yaml()
+        task = 'bench_0'
+
+        def commit():
+            value = t.plain_value(t.CONFIG_STORE.snapshot()['qwen'][task])
+            value['learning_rate'] = str(time.perf_counter_ns())
+            t.CONFIG_STORE.commit({task: value}, note='bench')
+
+        results.append({
+            "tasks": count, "file_bytes": os.path.getsize(path),
+            "parse_ms": timed(lambda: t.ConfigStore(path).snapshot(), repeat),
+            "load_full_yaml_ms": timed(t.load_full_yaml, repeat),
+            "save_full_yaml_ms": timed(lambda: t.save_full_yaml(doc), repeat),
+            # 至少跑满一轮压实阈值，p99/max 反映压实写入 config.yaml 的开销
+            "commit_ms": timed(commit, max(repeat, t.CONFIG_COMPACT_ENTRIES)),
+        })
+    return results
+
+
+# --- api ---
+def api_worker(server, endpoint, index, stop, samples, statuses, lock):
+    name = f"bench_{index}"
+    version = None
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            if endpoint == '/get_tasks':
+                status, _ = server.request('GET', '/get_tasks')
+            elif endpoint == '/load_task':
+                status, _ = server.request('GET', f"/load_task?task={urllib.parse.quote(name)}")
+            else:
+                if version is None:
+                    _, data = server.request('GET', f"/load_task?task={urllib.parse.quote(name)}")
+                    version = json.loads(data).get('version')
+                body = {"task_name": name, "version": version, "json_data": DATASET,
+                        "yaml_updates": {"qwen.output_name": name, "qwen.max_train_epochs": str(index + len(samples))}}
+                status, data = server.request('POST', '/save', body)
+                version = json.loads(data).get('version') if status == 200 else None
+        except OSError:
+            status = 'error'
+        elapsed = (time.perf_counter() - start) * 1000
+        with lock:
+            samples.append(elapsed)
+            statuses[status] = statuses.get(status, 0) + 1
+
+
+def bench_api(server, endpoints, workers, duration):
+    results = {}
+    for endpoint in endpoints:
+        stop, lock = threading.Event(), threading.Lock()
+        samples, statuses = [], {}
+        # /save 每个并发客户端各写一个任务，避免版本冲突
+        threads = [threading.Thread(target=api_worker, args=(server, endpoint, i, stop, samples, statuses, lock),
+                                    daemon=True) for i in range(workers)]
+        start = time.perf_counter()
+        for th in threads: th.start()
+        time.sleep(duration)
+        stop.set()
+        for th in threads: th.join(timeout=30)
+        elapsed = time.perf_counter() - start
+        results[endpoint] = {**percentiles(samples), "rps": round(len(samples) / elapsed, 1),
+                             "statuses": {str(k): v for k, v in statuses.items()}}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="webui hot path benchmarks")
+    parser.add_argument('--only', default=','.join(SUITES), help=f"逗号分隔，可选 {', '.join(SUITES)}")
+    parser.add_argument('--quick', action='store_true', help="缩小规模，用于冒烟测试")
+    parser.add_argument('--viewers', default='1,50,300', help="stream 测试的观看者数量")
+    parser.add_argument('--stream-rate', type=float, default=200, help="stream 测试中发射器每秒行数")
+    parser.add_argument('--tasks', default='10,100,500,1000', help="yaml 测试的任务数")
+    parser.add_argument('--api-tasks', type=int, default=100, help="stream / api 测试时配置中的任务数")
+    parser.add_argument('--api-workers', type=int, default=8)
+    parser.add_argument('--api-duration', type=float, default=10)
+    parser.add_argument('--dev', action='store_true', help="服务端使用 Flask 开发服务器而不是 gevent")
+    parser.add_argument('--keep', action='store_true', help="保留临时工作目录")
+    parser.add_argument('--output', default=None, help="结果 JSON 写入文件（默认输出到 stdout）")
+    args = parser.parse_args()
+
+    suites = [s.strip() for s in args.only.split(',') if s.strip()]
+    unknown = set(suites) - set(SUITES)
+    if unknown: parser.error(f"unknown suite: {', '.join(sorted(unknown))}")
+    scale = 10 if args.quick else 1
+    viewer_counts = [max(1, int(v) // scale) for v in args.viewers.split(',') if v.strip()]
+    task_counts = [max(1, int(v) // scale) for v in args.tasks.split(',') if v.strip()]
+    api_tasks = max(args.api_workers, args.api_tasks // scale)
+
+    workdir = tempfile.mkdtemp(prefix='webui-bench-')
+    result = {"meta": {"revision": git_revision(), "python": platform.python_version(),
+                       "platform": platform.platform(), "cpus": os.cpu_count(), "started_at": time.time(),
+                       "quick": args.quick, "server": "dev" if args.dev else "gevent"}}
+    cwd = os.getcwd()
+    try:
+        prepare_workdir(workdir, api_tasks)
+        if 'capture' in suites or 'yaml' in suites:
+            # t 的路径都相对于工作目录，导入前切换
+            os.chdir(workdir)
+            sys.path.insert(0, ROOT)
+            import t
+            if 'capture' in suites:
+                result['capture'] = bench_capture(t, {
+                    "plain_lines": {"lines": 200000 // scale, "rate": 0, "cr_per_line": 0, "width": 120},
+                    "tqdm_flood": {"lines": 2000 // scale, "rate": 0, "cr_per_line": 100, "width": 80},
+                    "long_lines": {"lines": 20000 // scale, "rate": 0, "cr_per_line": 0, "width": 4000},
+                })
+            if 'yaml' in suites:
+                result['yaml'] = bench_yaml(t, workdir, task_counts, 20 if not args.quick else 5)
+                write_config(os.path.join(workdir, 'src', 'config.yaml'), api_tasks)
+            os.chdir(cwd)
+        if 'stream' in suites or 'api' in suites:
+            server = Server(workdir, args.dev)
+            try:
+                if 'stream' in suites:
+                    result['stream'] = bench_stream(server, viewer_counts, {
+                        "lines": int(args.stream_rate * (2 if args.quick else 10)), "rate": args.stream_rate,
+                        "cr_per_line": 5, "width": 100})
+                if 'api' in suites:
+                    result['api'] = bench_api(server, ['/get_tasks', '/load_task', '/save'], args.api_workers,
+                                              args.api_duration / (5 if args.quick else 1))
+            finally:
+                server.close()
+    finally:
+        os.chdir(cwd)
+        if args.keep:
+            print(f"workdir: {workdir}", file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    result['meta']['finished_at'] = time.time()
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f: f.write(text)
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+# 生产模式入口：gevent 协程服务器（无 debug、无 reloader），日志流等长连接以协程方式处理，不再各自占用一个线程
+# 用法：python serve.py --host 0.0.0.0 --port 5000
+try:
+    from gevent import monkey
+except ImportError:
+    raise SystemExit("gevent is required for production mode: pip install gevent")
+
+# 必须在导入 t（以及 threading / subprocess）之前打补丁
+monkey.patch_all()
+
+import argparse
+
+import gevent
+from gevent.pool import Pool
+from gevent.pywsgi import WSGIServer
+
+import t
+
+
+def main():
+    parser = argparse.ArgumentParser(description="musubi-tuner-webui production server")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--max-connections', type=int, default=2000, help="并发连接上限（含日志流）")
+    parser.add_argument('--access-log', action='store_true', help="输出每个请求的访问日志")
+    args = parser.parse_args()
+
+    # 哈希、图片扫描在 hub 的原生线程池中执行（t.pool_map），按 t 中的并发度放大线程池
+    gevent.get_hub().threadpool.maxsize = max(t.HASH_WORKERS, t.SCAN_WORKERS)
+    t.JOB_QUEUE.start()
+    server = WSGIServer((args.host, args.port), t.app, spawn=Pool(args.max_connections),
+                        log='default' if args.access_log else None)
+    print(f"Serving on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
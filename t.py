@@ -1,17 +1,43 @@
+import array
 import base64
+import codecs
+import collections
+import itertools
 import os
 import copy
+import gzip
+import hashlib
+import hmac
 import json
+import math
+import random
+import mmap
+import platform
+import queue
+import re
+import shutil
+import struct
 import sys
 import subprocess
+import tempfile
 import textwrap
 import threading
 import time
-from flask import Flask, render_template, request, jsonify, send_from_directory, Response, stream_with_context
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from flask import (Flask, render_template, request, jsonify, send_from_directory, Response, stream_with_context,
+                   url_for, g)
 from ruamel.yaml import YAML
 
+try:
+    from PIL import Image
+except ImportError:  # 缩略图为可选功能
+    Image = None
+
 app = Flask(__name__)
 CONFIG_FILE = './src/config.yaml'
+# webui 自身的运行状态（队列、清单、缓存等）
+STATE_DIR = './.webui'
 
 # --- 脚本路径配置 ---
 LATENTS_SCRIPT = "src/musubi_tuner/qwen_image_cache_latents.py"
@@ -58,19 +84,460 @@ VISIBLE_TASK_KEYS = {
     'loraplus_lr_ratio', 'network_dim', 'network_alpha', 'blocks_to_swap'
 }
 
-IGNORED_SECTIONS = {'global_config', 'golbal_config', 'cache', 'qwen'}
+IGNORED_SECTIONS = {'global_config', 'golbal_config', 'cache', 'qwen', 'retry', 'autotune'}
+
+# --- 日志缓冲上限 ---
+LOG_MAX_LINES = int(os.environ.get('MUSUBI_LOG_MAX_LINES', 20000))
+LOG_MAX_BYTES = int(os.environ.get('MUSUBI_LOG_MAX_BYTES', 8 * 1024 * 1024))
+# 推送合并：攒够行数或等满时间窗口后一次性发送；空闲时按心跳间隔探测断开的客户端
+LOG_FLUSH_LINES = 256
+LOG_FLUSH_INTERVAL = 0.05
+LOG_HEARTBEAT_INTERVAL = 15
+
+
+class LogBuffer:
+    # 定长环形日志：每行带单调递增的序号，超出行数/字节上限时丢弃最旧的行
+    def __init__(self, max_lines=LOG_MAX_LINES, max_bytes=LOG_MAX_BYTES):
+        self.max_lines = max_lines
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._items = collections.deque()
+        self._bytes = 0
+        self._seq = 0
+        self.subscribers = 0
+        # 进度行（\r 刷新）单独存放，每个来源只保留最新一份，不进入历史；live 为各来源进度行按行拼接的结果
+        self._lives = {}
+        self.live = ""
+        self.live_version = 0
+
+    def append(self, line):
+        return self.extend([line])
+
+    def extend(self, lines):
+        # 一次加锁、一次唤醒写入多行
+        sized = [(line, len(line.encode('utf-8', 'replace'))) for line in lines]
+        with self._cond:
+            for line, size in sized:
+                self._seq += 1
+                self._items.append((self._seq, line, size))
+                self._bytes += size
+            while self._items and (len(self._items) > self.max_lines or self._bytes > self.max_bytes):
+                self._bytes -= self._items.popleft()[2]
+            self._cond.notify_all()
+            return self._seq
+
+    def set_live(self, text, key=None):
+        # key 区分同时写入的来源（全局控制台中的各个任务），空文本表示该来源的进度行结束
+        with self._cond:
+            if self._lives.get(key, "") == text: return
+            if text:
+                self._lives[key] = text
+            else:
+                self._lives.pop(key, None)
+            self.live = '\n'.join(self._lives.values())
+            self.live_version += 1
+            self._cond.notify_all()
+
+    def _normalize(self, seq):
+        return 0 if seq is None or seq < 0 or seq > self._seq else seq
+
+    def wait_for(self, seq, timeout, live_version=None):
+        # 阻塞直到出现序号大于 seq 的新行（或进度行版本不同于 live_version）或超时；返回是否有更新
+        with self._cond:
+            seq = self._normalize(seq)
+            changed = lambda: self._seq > seq or (live_version is not None and self.live_version != live_version)
+            if not changed(): self._cond.wait(timeout)
+            return changed()
+
+    def pending(self, seq):
+        with self._lock: return self._seq - self._normalize(seq)
+
+    def subscribe(self):
+        with self._lock: self.subscribers += 1
+
+    def unsubscribe(self):
+        with self._lock: self.subscribers -= 1
+
+    def clear(self):
+        # 序号不归零，旧游标在新一轮任务中依然有效
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+    @property
+    def last_seq(self):
+        return self._seq
+
+    def since(self, seq):
+        # 返回序号大于 seq 的 (seq, line)；只遍历新增部分
+        with self._lock:
+            seq = self._normalize(seq)
+            count = min(self._seq - seq, len(self._items))
+            if count <= 0: return []
+            return [(s, line) for s, line, _ in itertools.islice(reversed(self._items), count)][::-1]
+
+    def __len__(self):
+        return len(self._items)
+
+
+# 全局控制台：汇总所有任务输出与 shell 命令回显，各任务另有独立日志流
+CONSOLE_LOGS = LogBuffer()
+
+READ_CHUNK_SIZE = 64 * 1024
+
+
+class StreamSplitter:
+    # 增量解码子进程的二进制输出：以 \n 结束的行进入历史，\r 刷新的内容只作为"当前进度"覆盖保存
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self._pending = ""
+
+    @staticmethod
+    def _last_segment(text):
+        segments = [seg for seg in text.split('\r') if seg]
+        return segments[-1] if segments else ""
+
+    def feed(self, data, final=False):
+        # 返回 (新提交的行, 最新进度行或 None)
+        text = self._pending + self._decoder.decode(data, final)
+        hold = ""
+        if text.endswith('\r') and not final:
+            # 可能是被分块截断的 \r\n
+            text, hold = text[:-1], '\r'
+        parts = text.replace('\r\n', '\n').split('\n')
+        tail = parts.pop()
+        lines = [self._last_segment(part) + '\n' for part in parts]
+        progress = None
+        if '\r' in tail:
+            progress = self._last_segment(tail)
+            tail = tail.rsplit('\r', 1)[1]
+        elif lines:
+            progress = ""
+        if final and (tail or hold):
+            lines.append(tail + '\n')
+            tail, hold, progress = "", "", ""
+        self._pending = tail + hold
+        return lines, progress
+
+
+# --- 配置缓存 ---
+# 任务级写入只追加到变更日志（每行一个任务修改前后的完整值）并更新内存中的文档；日志条目数或大小达到阈值、
+# 或调用 /config_compact 时才把整份文档写入 config.yaml，并把条目追加到历史文件供查询与回滚。
+# 重新解析 config.yaml（启动或文件被手动修改）时按任务三方合并重放日志：手动修改与日志改动了不同的键时两者都保留，
+# 同一个键改得不同时保留磁盘内容，条目标记为冲突。
+# 每个任务的版本号是其内容的哈希，保存时携带的版本与当前不一致即视为过期写入
+CONFIG_JOURNAL_FILE = os.path.join(STATE_DIR, 'config_journal.jsonl')
+CONFIG_HISTORY_FILE = os.path.join(STATE_DIR, 'config_history.jsonl')
+CONFIG_HISTORY_LIMIT = 2000
+CONFIG_COMPACT_ENTRIES = 50
+CONFIG_COMPACT_BYTES = 1024 * 1024
+
+
+class StaleVersion(Exception):
+    def __init__(self, task, current):
+        super().__init__(f"STALE VERSION: {task}")
+        self.task = task
+        self.current = current
+
+
+def plain_value(value):
+    # 转为纯 JSON 类型，与 ruamel 对象脱钩
+    return None if value is None else json.loads(json.dumps(value, default=str))
+
+
+def task_version(value):
+    if value is None: return None
+    return hashlib.sha1(json.dumps(value, sort_keys=True, default=str).encode()).hexdigest()[:12]
+
+
+def same_value(a, b):
+    return a == b and isinstance(a, bool) == isinstance(b, bool)
+
+
+MISSING = object()
+MERGE_CONFLICT = object()
+
+
+def merge_task_value(current, before, after):
+    # 三方合并：日志条目（before -> after）与磁盘上的当前值，同一个键改得不同时返回 MERGE_CONFLICT
+    if current == before: return after
+    if current == after: return current
+    if not all(isinstance(v, dict) for v in (current, before, after)): return MERGE_CONFLICT
+    merged = dict(current)
+    for key in set(before) | set(after):
+        b, a, c = before.get(key, MISSING), after.get(key, MISSING), current.get(key, MISSING)
+        if a == b or c == a: continue
+        if c != b: return MERGE_CONFLICT
+        if a is MISSING:
+            del merged[key]
+        else:
+            merged[key] = a
+    return merged
+
+
+def apply_task_value(qwen, task, value):
+    # 原地更新已有映射，未变化的键保留原对象（引号风格、注释）
+    if value is None:
+        qwen.pop(task, None)
+        return
+    current = qwen.get(task)
+    if not isinstance(current, dict):
+        qwen[task] = copy.deepcopy(value)
+        return
+    for key in [k for k in current if k not in value]: del current[key]
+    for key, v in value.items():
+        if key not in current or not same_value(plain_value(current[key]), v): current[key] = copy.deepcopy(v)
+
+
+class ConfigJournal:
+    def __init__(self, path, history_path):
+        self.path = path
+        self.history_path = history_path
+        self.pending = self._read(path)
+        history = self._read(history_path)
+        # 崩溃时写了一半的末行会与之后追加的条目粘在一起，先重写为完整的条目
+        if self._torn(path): write_lines_atomic(path, self.pending)
+        if self._torn(history_path): write_lines_atomic(history_path, history)
+        self.size = os.path.getsize(path) if self.pending else 0
+        self.history_count = len(history)
+        self.seq = max([e['seq'] for e in self.pending + history], default=0)
+
+    @staticmethod
+    def _torn(path):
+        try:
+            with open(path, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                return f.read(1) != b'\n'
+        except OSError:
+            # 文件不存在或为空
+            return False
+
+    @staticmethod
+    def _read(path):
+        # 忽略崩溃时写了一半的末行
+        entries = []
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        continue
+        except FileNotFoundError:
+            pass
+        return entries
+
+    @staticmethod
+    def _append(path, entries):
+        # 返回追加后的文件大小
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'a', encoding='utf-8') as f:
+            for entry in entries: f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+            return f.tell()
+
+    def append(self, entries):
+        self.size = self._append(self.path, entries)
+        self.pending.extend(entries)
+
+    def due(self):
+        return len(self.pending) >= CONFIG_COMPACT_ENTRIES or self.size >= CONFIG_COMPACT_BYTES
+
+    def flush_to_history(self):
+        # config.yaml 已包含全部待压实条目之后调用。先追加到历史再清空日志：中途崩溃时条目会被再次追加，读取时按 seq 去重
+        if not self.pending: return
+        self._append(self.history_path, self.pending)
+        self.history_count += len(self.pending)
+        if self.history_count > 2 * CONFIG_HISTORY_LIMIT:
+            # 超出上限一倍时才整体重写一次，保留最近的条目
+            history = {e['seq']: e for e in self._read(self.history_path)}
+            entries = [history[k] for k in sorted(history)][-CONFIG_HISTORY_LIMIT:]
+            write_lines_atomic(self.history_path, entries)
+            self.history_count = len(entries)
+        write_lines_atomic(self.path, [])
+        self.pending, self.size = [], 0
+
+    def entries(self, task=None):
+        merged = {e['seq']: e for e in self._read(self.history_path)}
+        for entry in self.pending: merged[entry['seq']] = entry
+        return [merged[k] for k in sorted(merged) if task is None or merged[k]['task'] == task]
+
+
+def write_lines_atomic(path, entries):
+    folder = os.path.dirname(os.path.abspath(path))
+    os.makedirs(folder, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix='.tmp.', dir=folder)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            for entry in entries: f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+class ConfigStore:
+    # 解析结果常驻内存，仅当文件 mtime/size 变化时重新解析；写入走临时文件 + rename
+    def __init__(self, path, journal=None):
+        self.path = path
+        self.journal = journal
+        # 所有写入（含读-改-写流程）都应持有该锁
+        self.lock = threading.RLock()
+        self._doc = None
+        self._stamp = None
+        # 解析耗时统计，供 /metrics 使用
+        self.load_count = 0
+        self.load_seconds = 0.0
+        self.last_load_seconds = 0.0
+
+    def _file_stamp(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def version_stamp(self):
+        # 文件与日志任一变化都会改变
+        return (self._file_stamp(), self.journal.seq if self.journal else None)
+
+    def _refresh(self):
+        stamp = self._file_stamp()
+        if self._doc is None or stamp != self._stamp:
+            doc = {}
+            if stamp is not None:
+                start = time.perf_counter()
+                with open(self.path, 'r', encoding='utf-8') as f: doc = yaml.load(f)
+                self.last_load_seconds = time.perf_counter() - start
+                self.load_seconds += self.last_load_seconds
+                self.load_count += 1
+            doc = doc if doc is not None else {}
+            self._doc, self._stamp = doc, stamp
+            if self.journal and self.journal.pending: self._replay(doc)
+        return self._doc
+
+    def _replay(self, doc):
+        # 重新解析后按顺序重放尚未压实的条目，随即压实，使 config.yaml 与日志重新一致
+        qwen = doc.setdefault('qwen', {})
+        for entry in self.journal.pending:
+            current = plain_value(qwen.get(entry['task']))
+            merged = merge_task_value(current, entry['before'], entry['after'])
+            if merged is MERGE_CONFLICT:
+                entry['conflict'] = True
+                CONSOLE_LOGS.append(f"⚠️ CONFIG: journal entry {entry['seq']} for {entry['task']} dropped, "
+                                    f"config.yaml was modified\n")
+            elif merged != current:
+                apply_task_value(qwen, entry['task'], merged)
+        self.save(doc)
+
+    @staticmethod
+    def _patched(doc, entries):
+        # 写时复制：只复制顶层、qwen 与被修改的任务，其余对象与旧快照共享，已返回的快照不受影响
+        doc = copy.copy(doc)
+        qwen = doc['qwen'] = copy.copy(doc.get('qwen', {}))
+        for task in {entry['task'] for entry in entries}:
+            if isinstance(qwen.get(task), dict): qwen[task] = copy.deepcopy(qwen[task])
+        for entry in entries: apply_task_value(qwen, entry['task'], entry['after'])
+        return doc
 
-TASK_STATE = {"process": None, "is_running": False, "logs": [], "current_task": None, "action": None}
+    def snapshot(self):
+        # 只读快照：直接返回缓存对象，调用方不得修改
+        with self.lock: return self._refresh()
+
+    def load(self):
+        # 可修改副本：供 load-modify-save 流程使用
+        with self.lock: return copy.deepcopy(self._refresh())
+
+    def versions(self, tasks):
+        with self.lock:
+            qwen = self._refresh().get('qwen', {})
+            return {task: task_version(plain_value(qwen.get(task))) for task in tasks}
+
+    def check(self, expect):
+        with self.lock:
+            for task, current in self.versions(list(expect or {})).items():
+                if current != expect[task]: raise StaleVersion(task, current)
+
+    def commit(self, changes, expect=None, note=None):
+        # changes: {任务名: 新值（None 表示删除）}；expect: {任务名: 版本}，版本为 None 表示任务必须不存在。
+        # 版本不符时抛出 StaleVersion；返回各任务的新版本
+        with self.lock:
+            self.check(expect)
+            doc = self._refresh()
+            qwen = doc.get('qwen', {})
+            entries, now = [], time.time()
+            txn = uuid.uuid4().hex[:8]
+            for task, value in changes.items():
+                before, after = plain_value(qwen.get(task)), plain_value(value)
+                if before == after: continue
+                self.journal.seq += 1
+                entries.append({"seq": self.journal.seq, "ts": now, "txn": txn, "task": task, "note": note,
+                                "before": before, "after": after})
+            if entries:
+                self.journal.append(entries)
+                self._doc = self._patched(doc, entries)
+                if self.journal.due(): self.compact()
+            return {task: task_version(plain_value(value)) for task, value in changes.items()}
+
+    def compact(self):
+        # 把内存中的文档（磁盘内容加上日志条目）写入 config.yaml，条目移入历史；返回压实的条目数
+        with self.lock:
+            doc = self._refresh()
+            pending = len(self.journal.pending) if self.journal else 0
+            if pending: self.save(doc)
+            return pending
+
+    def save(self, data):
+        with self.lock:
+            folder = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(folder, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(prefix='.config.', suffix='.tmp', dir=folder)
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    yaml.dump(data, f)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+                raise
+            # 整份文档已写入 config.yaml，其中已包含全部日志条目
+            if self.journal: self.journal.flush_to_history()
+            self._doc, self._stamp = copy.deepcopy(data), self._file_stamp()
+
+
+CONFIG_STORE = ConfigStore(CONFIG_FILE, ConfigJournal(CONFIG_JOURNAL_FILE, CONFIG_HISTORY_FILE))
 
 
 # --- 辅助函数 ---
+# 任务名同时用作 YAML 键、./src/<名称>.json 与 ./output/<名称>，只允许字母数字（含中文）、下划线、点和连字符
+TASK_NAME_RE = re.compile(r'\w[\w.-]{0,127}')
+
+
+def valid_task_name(name):
+    return isinstance(name, str) and bool(TASK_NAME_RE.fullmatch(name)) and '..' not in name \
+        and name not in IGNORED_SECTIONS and name != '__NEW__'
+
+
+def stale_response(error):
+    return jsonify({"status": "error", "message": "STALE: modified elsewhere, reload and retry",
+                    "task": error.task, "version": error.current}), 409
+
+
 def load_full_yaml():
-    if not os.path.exists(CONFIG_FILE): return {}
-    with open(CONFIG_FILE, 'r', encoding='utf-8') as f: return yaml.load(f)
+    return CONFIG_STORE.load()
 
 
 def save_full_yaml(data):
-    with open(CONFIG_FILE, 'w', encoding='utf-8') as f: yaml.dump(data, f)
+    CONFIG_STORE.save(data)
 
 
 # --- 路由 ---
@@ -268,12 +735,29 @@ def open_file_dialog_powershell(title, filter_pattern="*.*"):
 
 def open_folder_dialog_powershell(title):
     return run_powershell_dialog_robust(None, 'folder', title)
+def normalize_selected_path(path):
+    # 统一为正斜杠；位于工作目录下的路径转为 ./ 开头的相对路径
+    if not path: return path
+    path = path.replace('\\', '/')
+    current_cwd = os.getcwd().replace('\\', '/')
+    if path == current_cwd or path.startswith(current_cwd.rstrip('/') + '/'):
+        try:
+            rel_path = os.path.relpath(path, current_cwd)
+            path = "./" if rel_path == '.' else f"./{rel_path.replace(os.sep, '/')}"
+        except:
+            pass
+    return path
+
+
 @app.route('/select_path', methods=['POST'])
 def select_path():
     data = request.json
     select_type = data.get('type')
     extensions = data.get('extensions', [])
 
+    # 目录浏览器选中的路径只做规范化，不弹出对话框
+    if data.get('path'): return jsonify({"path": normalize_selected_path(data['path'])})
+
     path = ""
     if select_type == 'folder':
         path = open_folder_dialog_powershell("Select Directory")
@@ -282,23 +766,143 @@ def select_path():
         if extensions: ext_pattern = ";".join([f"*{ext}" for ext in extensions])
         path = open_file_dialog_powershell("Select File", ext_pattern)
 
-    if path:
-        path = path.replace('\\', '/')
-        current_cwd = os.getcwd().replace('\\', '/')
-        if path.startswith(current_cwd):
-            try:
-                rel_path = os.path.relpath(path, current_cwd)
-                path = f"./{rel_path.replace(os.sep, '/')}"
-            except:
-                pass
+    return jsonify({"path": normalize_selected_path(path)})
+
+
+# --- 目录浏览 ---
+# 跨平台的服务端目录浏览：列表按目录 mtime 缓存，分页返回；选中的路径与 select_path 使用同样的规范化。
+# 只能浏览工作目录、任务配置中引用的目录（输出、数据集、模型所在目录）以及 MUSUBI_BROWSE_ROOTS（os.pathsep 分隔）
+BROWSE_PAGE_SIZE = 200
+BROWSE_MAX_PAGE_SIZE = 1000
+BROWSE_CACHE_LIMIT = 512
+BROWSE_EXTRA_ROOTS = [p.strip() for p in os.environ.get('MUSUBI_BROWSE_ROOTS', '').split(os.pathsep) if p.strip()]
+BROWSE_MODEL_KEYS = ('dit', 'vae', 'text_encoder', 'network_weights')
+
+
+class DirectoryListingCache:
+    # {目录: (mtime, [(名称, 是否目录, size, mtime)])}，超出上限时淘汰最久未用的目录
+    def __init__(self, limit=BROWSE_CACHE_LIMIT):
+        self.limit = limit
+        self._lock = threading.Lock()
+        self._dirs = collections.OrderedDict()
+
+    def list(self, folder):
+        dir_mtime = os.stat(folder).st_mtime_ns
+        with self._lock:
+            cached = self._dirs.get(folder)
+            if cached and cached[0] == dir_mtime:
+                self._dirs.move_to_end(folder)
+                return cached[1]
+        entries = []
+        with os.scandir(folder) as it:
+            for e in it:
+                try:
+                    is_dir = e.is_dir()
+                    st = e.stat()
+                except OSError:
+                    continue
+                entries.append((e.name, is_dir, 0 if is_dir else st.st_size, st.st_mtime))
+        entries.sort(key=lambda x: (not x[1], x[0].lower()))
+        with self._lock:
+            self._dirs[folder] = (dir_mtime, entries)
+            self._dirs.move_to_end(folder)
+            while len(self._dirs) > self.limit: self._dirs.popitem(last=False)
+        return entries
+
+
+LISTING_CACHE = DirectoryListingCache()
 
-    return jsonify({"path": path})
+
+def image_count(folder):
+    try:
+        return sum(1 for name, is_dir, _, _ in LISTING_CACHE.list(folder)
+                   if not is_dir and os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS)
+    except OSError:
+        return None
+
+
+def browse_roots():
+    # [{"name", "path"}]，只包含存在的目录，按绝对路径去重
+    qwen_root = CONFIG_STORE.snapshot().get('qwen', {})
+    candidates = [("CWD", '.')]
+    for task_name, task_data in qwen_root.items():
+        if not isinstance(task_data, dict): continue
+        if task_name not in IGNORED_SECTIONS and task_data.get('output_dir'):
+            candidates.append((f"{task_name} output", task_data['output_dir']))
+        for key in BROWSE_MODEL_KEYS:
+            if isinstance(task_data.get(key), str) and task_data[key]:
+                candidates.append((key, os.path.dirname(task_data[key])))
+        if task_name in IGNORED_SECTIONS: continue
+        try:
+            dataset = load_dataset_json(task_data.get('dataset_config'))
+        except (OSError, ValueError):
+            dataset = None
+        for ds in (dataset or {}).get('datasets', []):
+            for key in ('image_directory', 'control_directory', 'cache_directory'):
+                if ds.get(key): candidates.append((f"{task_name} {key.split('_')[0]}", ds[key]))
+    candidates += [(path, path) for path in BROWSE_EXTRA_ROOTS]
+    roots, seen = [], set()
+    for name, path in candidates:
+        full = os.path.realpath(os.path.expanduser(path))
+        if full in seen or not os.path.isdir(full): continue
+        seen.add(full)
+        roots.append({"name": name, "path": normalize_selected_path(full), "abs_path": full})
+    return roots
+
+
+def within_roots(folder, roots):
+    for root in roots:
+        try:
+            if os.path.commonpath([folder, root['abs_path']]) == root['abs_path']: return True
+        except ValueError:  # Windows 上不同盘符
+            continue
+    return False
+
+
+@app.route('/browse')
+def browse():
+    # type=folder 只列目录；ext=.safetensors,.pt 过滤文件；images=1 为子目录统计图片数量
+    folder = os.path.realpath(os.path.expanduser(request.args.get('path') or '.'))
+    roots = browse_roots()
+    if not within_roots(folder, roots): return jsonify({"status": "error", "message": "Outside browse roots"}), 403
+    try:
+        page = max(1, int(request.args.get('page', 1)))
+        per_page = max(1, min(int(request.args.get('per_page', BROWSE_PAGE_SIZE)), BROWSE_MAX_PAGE_SIZE))
+    except ValueError:
+        return jsonify({"status": "error", "message": "Bad page"}), 400
+    folders_only = request.args.get('type') == 'folder'
+    extensions = {e.strip().lower() for e in request.args.get('ext', '').split(',') if e.strip()}
+    show_hidden = request.args.get('hidden') in ('1', 'true')
+    try:
+        entries = LISTING_CACHE.list(folder)
+    except FileNotFoundError:
+        return jsonify({"status": "error", "message": "Not found"}), 404
+    except NotADirectoryError:
+        return jsonify({"status": "error", "message": "Not a directory"}), 400
+    except PermissionError:
+        return jsonify({"status": "error", "message": "Permission denied"}), 403
+
+    visible = [e for e in entries if (show_hidden or not e[0].startswith('.'))
+               and (e[1] or (not folders_only and (not extensions or os.path.splitext(e[0])[1].lower() in extensions)))]
+    items = []
+    for name, is_dir, size, mtime in visible[(page - 1) * per_page:page * per_page]:
+        full = os.path.join(folder, name)
+        item = {"name": name, "path": normalize_selected_path(full), "type": "dir" if is_dir else "file",
+                "size": size, "mtime": mtime}
+        if is_dir and request.args.get('images') in ('1', 'true'): item["images"] = image_count(full)
+        items.append(item)
+    parent = os.path.dirname(folder)
+    return jsonify({"status": "success", "path": normalize_selected_path(folder), "abs_path": folder,
+                    "parent": normalize_selected_path(parent) if parent != folder and within_roots(parent, roots)
+                    else None,
+                    "page": page, "per_page": per_page, "total": len(visible), "entries": items,
+                    "roots": [{"name": r['name'], "path": r['path']} for r in roots] if page == 1 else None})
 
 
 # --- 任务 API ---
 @app.route('/get_tasks')
 def get_tasks():
-    config = load_full_yaml()
+    config = CONFIG_STORE.snapshot()
     qwen_root = config.get('qwen', {})
     tasks = [k for k in qwen_root.keys() if k not in IGNORED_SECTIONS]
     return jsonify({"status": "success", "tasks": tasks})
@@ -307,7 +911,7 @@ def get_tasks():
 @app.route('/load_task')
 def load_task():
     task_name = request.args.get('task')
-    config = load_full_yaml()
+    config = CONFIG_STORE.snapshot()
     qwen_root = config.get('qwen', {})
 
     task_data = {}
@@ -325,136 +929,111 @@ def load_task():
     flat_data = {}
     for k, v in task_data.items():
         if k in VISIBLE_TASK_KEYS: flat_data[f"qwen.{k}"] = v
-    return jsonify({"status": "success", "config": flat_data})
+    version = task_version(plain_value(task_data)) if task_name != '__NEW__' else None
+    return jsonify({"status": "success", "config": flat_data, "version": version})
 
 
 @app.route('/create_task', methods=['POST'])
 def create_task():
-    try:
-        source_name = request.json.get('source_task_name')
-        config = load_full_yaml()
-        qwen = config.get('qwen', {})
-        if not source_name or source_name not in qwen: return jsonify(
-            {"status": "error", "message": "Source missing"}), 400
-
-        base_name = f"{source_name}_copy"
-        new_name = base_name
-        counter = 1
-        while new_name in qwen: new_name = f"{base_name}_{counter}"; counter += 1
-
-        source_data = copy.deepcopy(qwen[source_name])
-        source_data['output_name'] = new_name
-        source_data['output_dir'] = f"./output/{new_name}"
-
-        # 复制 JSON
-        src_json = f"./src/{source_name}.json"
-        dst_json = f"./src/{new_name}.json"
-        if os.path.exists(src_json):
-            with open(src_json, 'r', encoding='utf-8') as f: content = json.load(f)
-            with open(dst_json, 'w', encoding='utf-8') as f: json.dump(content, f, indent=2, ensure_ascii=False)
-            source_data['dataset_config'] = dst_json
-            source_data['sample_prompts'] = dst_json
-
-        qwen[new_name] = source_data
-        save_full_yaml(config)
-        return jsonify({"status": "success", "task_name": new_name})
-    except Exception as e:
-        return jsonify({"status": "error", "message": str(e)}), 500
+    with CONFIG_STORE.lock:
+        try:
+            source_name = request.json.get('source_task_name')
+            qwen = CONFIG_STORE.snapshot().get('qwen', {})
+            if not source_name or source_name not in qwen: return jsonify(
+                {"status": "error", "message": "Source missing"}), 400
+
+            base_name = f"{source_name}_copy"
+            new_name = base_name
+            counter = 1
+            while new_name in qwen: new_name = f"{base_name}_{counter}"; counter += 1
+
+            source_data = copy.deepcopy(qwen[source_name])
+            source_data['output_name'] = new_name
+            source_data['output_dir'] = f"./output/{new_name}"
+
+            # 复制 JSON
+            src_json = f"./src/{source_name}.json"
+            dst_json = f"./src/{new_name}.json"
+            if os.path.exists(src_json):
+                with open(src_json, 'r', encoding='utf-8') as f: content = json.load(f)
+                with open(dst_json, 'w', encoding='utf-8') as f: json.dump(content, f, indent=2, ensure_ascii=False)
+                source_data['dataset_config'] = dst_json
+                source_data['sample_prompts'] = dst_json
+
+            versions = CONFIG_STORE.commit({new_name: source_data}, expect={new_name: None}, note='create')
+            return jsonify({"status": "success", "task_name": new_name, "version": versions[new_name]})
+        except Exception as e:
+            return jsonify({"status": "error", "message": str(e)}), 500
 
 
 @app.route('/delete_task', methods=['POST'])
 def delete_task():
-    try:
-        task_name = request.json.get('task_name')
-        config = load_full_yaml()
-        qwen = config.get('qwen', {})
-        if task_name in qwen and task_name not in IGNORED_SECTIONS:
-            path = f"./src/{task_name}.json"
-            if os.path.exists(path):
-                try:
-                    os.remove(path)
-                except:
-                    pass
-            del qwen[task_name]
-            save_full_yaml(config)
-            return jsonify({"status": "success"})
-        return jsonify({"status": "error", "message": "Err"}), 400
-    except Exception as e:
-        return jsonify({"status": "error", "message": str(e)}), 500
+    with CONFIG_STORE.lock:
+        try:
+            task_name = request.json.get('task_name')
+            qwen = CONFIG_STORE.snapshot().get('qwen', {})
+            if task_name in qwen and task_name not in IGNORED_SECTIONS:
+                expect = {task_name: request.json['version']} if request.json.get('version') else None
+                CONFIG_STORE.commit({task_name: None}, expect=expect, note='delete')
+                path = f"./src/{task_name}.json"
+                # 扫描派生的任务共用基础任务的 JSON，仍被引用时保留
+                in_use = any(os.path.abspath(str(v.get(key) or '')) == os.path.abspath(path)
+                             for v in CONFIG_STORE.snapshot().get('qwen', {}).values() if isinstance(v, dict)
+                             for key in ('dataset_config', 'sample_prompts'))
+                if os.path.exists(path) and not in_use:
+                    try:
+                        os.remove(path)
+                    except:
+                        pass
+                return jsonify({"status": "success"})
+            return jsonify({"status": "error", "message": "Err"}), 400
+        except StaleVersion as e:
+            return stale_response(e)
+        except Exception as e:
+            return jsonify({"status": "error", "message": str(e)}), 500
 
 
 # --- 执行接口 ---
-def run_background_process(commands):
-    total = len(commands)
-    # [回退] 使用稳健的文本缓冲模式
-    env = os.environ.copy()
-    env["PYTHONUNBUFFERED"] = "1"
-
-    for idx, (name, cmd_list) in enumerate(commands):
-        if not TASK_STATE["is_running"]: break
-        msg = f"\n{'=' * 40}\n🚀 {name} ({idx + 1}/{total})\n📂 CMD: {' '.join(cmd_list)}\n{'=' * 40}\n"
-        TASK_STATE["logs"].append(msg)
-        try:
-            process = subprocess.Popen(
-                cmd_list, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, stdin=subprocess.PIPE,
-                text=True, bufsize=1, encoding='utf-8', errors='replace', env=env
-            )
-            TASK_STATE["process"] = process
-            for line in iter(process.stdout.readline, ''):
-                TASK_STATE["logs"].append(line)
-            process.stdout.close()
-            rc = process.wait()
-            if rc != 0:
-                if TASK_STATE["is_running"]:
-                    TASK_STATE["logs"].append(f"\n❌ FAILED (CODE {rc}).\n")
-                else:
-                    TASK_STATE["logs"].append(f"\n🛑 STOPPED BY USER.\n")
-                break
-            else:
-                TASK_STATE["logs"].append(f"\n✅ COMPLETED.\n")
-        except Exception as e:
-            TASK_STATE["logs"].append(f"\n❌ SYSTEM ERROR: {str(e)}\n")
-            break
-    TASK_STATE["is_running"] = False
-    TASK_STATE["process"] = None
-    TASK_STATE["logs"].append("\n✨ ALL TASKS FINISHED.\n")
+def cache_settings(qwen_root, task_data):
+    # cache 段为全局缓存参数，任务的 cache_overrides 覆盖其中的项
+    return {**qwen_root.get('cache', {}), **((task_data or {}).get('cache_overrides') or {})}
 
 
-@app.route('/execute_task')
-def execute_task():
-    if TASK_STATE["is_running"]: return jsonify({"status": "error", "message": "Busy"}), 400
-    task_name = request.args.get('task');
-    action = request.args.get('action')
-    if not task_name: return "Error", 400
-    config = load_full_yaml()
-    if task_name not in config.get('qwen', {}): return "Error", 404
-    task_data = config['qwen'][task_name]
-    cache_data = config['qwen'].get('cache', {})
-    global_config = config['qwen'].get('global_config', config['qwen'].get('golbal_config', {}))
+def build_cache_commands(task_data, cache_data):
+    commands = []
+    cmd1 = [sys.executable, '-u', LATENTS_SCRIPT]
+    for key in ['dataset_config', 'vae', 'model_version']:
+        if task_data.get(key): cmd1.extend([f'--{key}={task_data[key]}'])
+    if cache_data.get('vae_tiling'): cmd1.append('--vae_tiling')
+    for key in ['vae_chunk_size', 'vae_spatial_tile_sample_min_size']:
+        if cache_data.get(key): cmd1.extend([f'--{key}={cache_data[key]}'])
+    commands.append(("STEP 1: CACHE LATENTS", cmd1))
+
+    cmd2 = [sys.executable, '-u', TEXT_ENC_SCRIPT]
+    for key in ['dataset_config', 'text_encoder', 'model_version']:
+        if task_data.get(key): cmd2.extend([f'--{key}={task_data[key]}'])
+    if cache_data.get('batch_size'): cmd2.extend([f'--batch_size={cache_data["batch_size"]}'])
+    if cache_data.get('fp8_vl'): cmd2.append('--fp8_vl')
+    commands.append(("STEP 2: CACHE TEXT ENCODER", cmd2))
+    return commands
+
+
+def build_commands(config, task_name, action, resume_path=None):
+    qwen_root = config.get('qwen', {})
+    task_data = qwen_root[task_name]
+    cache_data = cache_settings(qwen_root, task_data)
+    global_config = qwen_root.get('global_config', qwen_root.get('golbal_config', {}))
     commands = []
 
     if action == 'cache':
-        cmd1 = [sys.executable, '-u', LATENTS_SCRIPT]
-        for key in ['dataset_config', 'vae', 'model_version']:
-            if task_data.get(key): cmd1.extend([f'--{key}={task_data[key]}'])
-        if cache_data.get('vae_tiling'): cmd1.append('--vae_tiling')
-        for key in ['vae_chunk_size', 'vae_spatial_tile_sample_min_size']:
-            if cache_data.get(key): cmd1.extend([f'--{key}={cache_data[key]}'])
-        commands.append(("STEP 1: CACHE LATENTS", cmd1))
-
-        cmd2 = [sys.executable, '-u', TEXT_ENC_SCRIPT]
-        for key in ['dataset_config', 'text_encoder', 'model_version']:
-            if task_data.get(key): cmd2.extend([f'--{key}={task_data[key]}'])
-        if cache_data.get('batch_size'): cmd2.extend([f'--batch_size={cache_data["batch_size"]}'])
-        if cache_data.get('fp8_vl'): cmd2.append('--fp8_vl')
-        commands.append(("STEP 2: CACHE TEXT ENCODER", cmd2))
+        commands.extend(build_cache_commands(task_data, cache_data))
 
     elif action == 'train':
         cmd = ['accelerate', 'launch', '--num_cpu_threads_per_process', '8']
         if 'mixed_precision' in global_config: cmd.extend(['--mixed_precision', str(global_config['mixed_precision'])])
         cmd.append(TRAIN_SCRIPT)
         combined_args = {**global_config, **task_data}
-        blacklist_keys = ['lora', 'network_args', 'mixed_precision']
+        blacklist_keys = ['lora', 'network_args', 'mixed_precision', 'cache_overrides']
         for key, value in combined_args.items():
             if value is None or value == "": continue
             if key in blacklist_keys: continue
@@ -465,165 +1044,3376 @@ def execute_task():
                 if value is True: cmd.append(f'--{key}')
             else:
                 cmd.extend([f'--{key}={value}'])  # [修改] 恢复使用 = 连接
+        if resume_path: cmd.append(f'--resume={resume_path}')
         commands.append(("TRAINING SEQUENCE", cmd))
 
-    TASK_STATE["is_running"] = True;
-    TASK_STATE["logs"] = [];
-    TASK_STATE["current_task"] = task_name;
-    TASK_STATE["action"] = action
-    thread = threading.Thread(target=run_background_process, args=(commands,));
-    thread.start()
-    return jsonify({"status": "success", "message": "Started"})
+    return commands
 
 
-@app.route('/stop_task', methods=['POST'])
-def stop_task():
-    if TASK_STATE["process"] and TASK_STATE["is_running"]:
-        TASK_STATE["is_running"] = False
-        try:
-            pid = TASK_STATE["process"].pid
-            if os.name == 'nt':
-                subprocess.call(['taskkill', '/F', '/T', '/PID', str(pid)])
-            else:
-                import signal; os.killpg(os.getpgid(pid), signal.SIGTERM)
-            TASK_STATE["logs"].append("\n🛑 KILLED.\n")
-            return jsonify({"status": "success"})
-        except:
-            return jsonify({"status": "error"}), 500
-    return jsonify({"status": "error"}), 400
+# --- 缓存清单 ---
+# 每个数据集的 cache_directory 下保存一份清单，记录上次缓存成功时输入文件的指纹；输入未变化时跳过对应步骤
+CACHE_MANIFEST_NAME = '.webui_cache_manifest.json'
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.webp', '.bmp'}
+HASH_WORKERS = min(32, (os.cpu_count() or 4) * 2)
+STALE_REPORT_LIMIT = 50
 
+# 步骤 -> (输入类别, 影响输出的参数, 缓存文件名格式)；格式的第一组为图片主文件名：
+# latents 为 <主文件名>_<宽>x<高>_<架构>.safetensors，text_encoder 为 <主文件名>_<架构>_te.safetensors
+CACHE_STEPS = {
+    'latents': (('image', 'control'), ('vae', 'model_version', 'vae_tiling', 'vae_chunk_size',
+                                       'vae_spatial_tile_sample_min_size'),
+                re.compile(r'(.+)_\d+x\d+_[A-Za-z0-9]+\.safetensors')),
+    'text_encoder': (('caption', 'control'), ('text_encoder', 'model_version', 'fp8_vl'),
+                     re.compile(r'(.+)_[A-Za-z0-9]+_te\.safetensors')),
+}
+CACHE_STEP_ORDER = ('latents', 'text_encoder')
 
-@app.route('/stream_logs')
-def stream_logs():
-    def generate():
-        curr = 0
-        while True:
-            if curr < len(TASK_STATE["logs"]):
-                yield TASK_STATE["logs"][curr]; curr += 1
+
+def load_dataset_json(path):
+    if not path or not os.path.exists(path): return None
+    with open(path, 'r', encoding='utf-8') as f: return json.load(f)
+
+
+def list_images(folder):
+    if not folder or not os.path.isdir(folder): return []
+    with os.scandir(folder) as it:
+        return sorted(e.name for e in it if e.is_file() and os.path.splitext(e.name)[1].lower() in IMAGE_EXTENSIONS)
+
+
+def dataset_inputs(ds, general):
+    # 返回 {"类别:文件名": 路径}，以及图片主文件名列表
+    image_dir = ds.get('image_directory')
+    control_dir = ds.get('control_directory')
+    caption_ext = ds.get('caption_extension', general.get('caption_extension', '.txt'))
+    files = {}
+    stems = []
+    for name in list_images(image_dir):
+        stem = os.path.splitext(name)[0]
+        stems.append(stem)
+        files[f"image:{name}"] = os.path.join(image_dir, name)
+        caption = os.path.join(image_dir, stem + caption_ext)
+        if os.path.exists(caption): files[f"caption:{stem + caption_ext}"] = caption
+    for name in list_images(control_dir):
+        files[f"control:{name}"] = os.path.join(control_dir, name)
+    return files, stems
+
+
+def threads_patched():
+    # serve.py 用 gevent 打补丁后，threading 线程实际上是同一个系统线程上的协程
+    if 'gevent' not in sys.modules: return False
+    from gevent import monkey
+    return monkey.is_module_patched('threading')
+
+
+def pool_map(fn, items, max_workers):
+    # 并行执行哈希、读图片头等 CPU / 磁盘密集的工作。gevent 模式下 ThreadPoolExecutor 的工作会跑在事件循环上，
+    # 阻塞所有日志流和长轮询连接，因此改用 gevent hub 的原生线程池
+    if threads_patched():
+        import gevent
+        return list(gevent.get_hub().threadpool.imap(fn, items))
+    with ThreadPoolExecutor(max_workers=max_workers) as pool: return list(pool.map(fn, items))
+
+
+def file_sha1(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''): h.update(block)
+    return h.hexdigest()
+
+
+def fingerprint_files(files, use_hash=False, previous=None):
+    # size+mtime 为快速路径；开启哈希时仅对 size/mtime 变化的文件重新计算内容哈希
+    previous = previous or {}
+
+    def one(item):
+        key, path = item
+        st = os.stat(path)
+        fp = {"size": st.st_size, "mtime": st.st_mtime_ns}
+        if use_hash:
+            old = previous.get(key)
+            if old and old.get('sha1') and old['size'] == fp['size'] and old['mtime'] == fp['mtime']:
+                fp['sha1'] = old['sha1']
             else:
-                time.sleep(0.5)
+                fp['sha1'] = file_sha1(path)
+        return key, fp
 
-    return Response(stream_with_context(generate()), mimetype='text/plain')
+    return dict(pool_map(one, list(files.items()), HASH_WORKERS))
 
 
-@app.route('/task_status')
-def task_status():
-    return jsonify(
-        {"is_running": TASK_STATE["is_running"], "task": TASK_STATE["current_task"], "action": TASK_STATE["action"]})
+def same_fingerprint(old, new):
+    if not old: return False
+    if old.get('sha1') and new.get('sha1'): return old['sha1'] == new['sha1']
+    return old.get('size') == new['size'] and old.get('mtime') == new['mtime']
 
 
-@app.route('/console_input', methods=['POST'])
-def console_input():
-    cmd = request.json.get('cmd')
-    if not cmd: return jsonify({"status": "error"}), 400
-    if TASK_STATE["is_running"] and TASK_STATE["process"]:
+def check_cache_step(task_data, cache_data, step, dataset=None):
+    # 检查某个缓存步骤在所有数据集上是否需要重跑，返回报告（含待写入的新清单）
+    categories, setting_keys, cache_name_re = CACHE_STEPS[step]
+    settings = {k: task_data.get(k, cache_data.get(k)) for k in setting_keys}
+    settings_key = hashlib.sha1(json.dumps(settings, sort_keys=True, default=str).encode()).hexdigest()
+    use_hash = bool(cache_data.get('manifest_hash'))
+    dataset = dataset if dataset is not None else load_dataset_json(task_data.get('dataset_config'))
+    report = {"step": step, "fresh": dataset is not None, "datasets": []}
+    if dataset is None:
+        report['error'] = "dataset_config not found"
+        return report
+
+    general = dataset.get('general', {})
+    for idx, ds in enumerate(dataset.get('datasets', [])):
+        cache_dir = ds.get('cache_directory') or ds.get('image_directory')
+        entry = {"index": idx, "cache_directory": cache_dir, "fresh": False, "reason": None,
+                 "stale": [], "removed": [], "missing_cache": []}
+        report['datasets'].append(entry)
+        if not ds.get('image_directory') or not cache_dir:
+            entry['reason'] = "unsupported dataset (no image_directory)"
+            report['fresh'] = False
+            continue
+        files, stems = dataset_inputs(ds, general)
+        files = {k: v for k, v in files.items() if k.split(':', 1)[0] in categories}
+        manifest_path = os.path.join(cache_dir, CACHE_MANIFEST_NAME)
         try:
-            if TASK_STATE["process"].stdin:
-                TASK_STATE["process"].stdin.write(cmd + "\n");
-                TASK_STATE["process"].stdin.flush()
-                TASK_STATE["logs"].append(f"> {cmd}\n")
-                return jsonify({"status": "success"})
-        except:
-            return jsonify({"status": "error"}), 500
-    else:
-        TASK_STATE["logs"].append(f"\n> {cmd}\n")
+            manifest = load_dataset_json(manifest_path) or {}
+        except (OSError, ValueError):
+            manifest = {}
+        old = manifest.get(step, {})
+        fingerprints = fingerprint_files(files, use_hash, old.get('files'))
+        old_files = old.get('files', {})
+        entry['stale'] = [k for k, fp in fingerprints.items() if not same_fingerprint(old_files.get(k), fp)]
+        entry['removed'] = [k for k in old_files if k not in fingerprints]
+        cached = os.listdir(cache_dir) if os.path.isdir(cache_dir) else []
+        # 从文件名解析出主文件名再比较，a1 不会误认 a1_x 的缓存
+        cached_stems = {m.group(1) for m in map(cache_name_re.fullmatch, cached) if m}
+        entry['missing_cache'] = [s for s in stems if s not in cached_stems]
+        if old.get('settings') != settings_key:
+            entry['reason'] = "settings changed" if old else "no manifest"
+        elif entry['stale'] or entry['removed'] or entry['missing_cache']:
+            entry['reason'] = "inputs changed"
+        else:
+            entry['fresh'] = True
+        entry['_manifest'] = (manifest_path, {"settings": settings_key, "files": fingerprints,
+                                              "updated_at": time.time()})
+        report['fresh'] = report['fresh'] and entry['fresh']
+    return report
+
+
+def public_cache_report(report):
+    out = {k: v for k, v in report.items() if k != 'datasets'}
+    out['datasets'] = []
+    for entry in report['datasets']:
+        item = {k: v for k, v in entry.items() if not k.startswith('_')}
+        for key in ('stale', 'removed', 'missing_cache'):
+            item[f"{key}_count"] = len(entry[key])
+            item[key] = entry[key][:STALE_REPORT_LIMIT]
+        out['datasets'].append(item)
+    return out
+
+
+def record_cache_step(report):
+    for entry in report['datasets']:
+        if '_manifest' not in entry: continue
+        path, step_manifest = entry['_manifest']
         try:
-            out = subprocess.check_output(cmd, shell=True, stderr=subprocess.STDOUT, text=True, encoding='utf-8',
-                                          errors='replace')
-            TASK_STATE["logs"].append(out)
-        except subprocess.CalledProcessError as e:
-            TASK_STATE["logs"].append(e.output)
-        except Exception as e:
-            TASK_STATE["logs"].append(str(e) + "\n")
-    return jsonify({"status": "success"})
+            # 重新读取，避免覆盖其他步骤在此期间写入的记录
+            manifest = load_dataset_json(path) or {}
+        except (OSError, ValueError):
+            manifest = {}
+        manifest[report['step']] = step_manifest
+        try:
+            write_json_atomic(path, manifest)
+        except OSError as e:
+            print(f"Manifest Write Error: {e}")
 
 
-# --- JSON 读写 ---
-@app.route('/get_json_config')
-def get_json_config():
-    task_name = request.args.get('task')
-    if not task_name: return jsonify({"status": "error"}), 400
-    json_path = f"./src/{task_name}.json"
-    if not os.path.exists(json_path): return jsonify({"status": "error", "message": "Not found"}), 404
+def log_cache_report(run, name, report):
+    for entry in report['datasets']:
+        if entry['fresh']: continue
+        run.log(f"\n🔎 {name} / dataset {entry['index']}: {entry['reason'] or report.get('error')} "
+                f"(stale {len(entry['stale'])}, removed {len(entry['removed'])}, "
+                f"missing cache {len(entry['missing_cache'])})\n")
+    if report.get('error'): run.log(f"\n⚠️ {name}: {report['error']}\n")
+
+
+# --- 断点续训 ---
+# musubi 开启 save_state 后每次保存检查点都会写出 <output_name>-<epoch>-state（或 -step<N>-state、训练结束时的
+# <output_name>-state）目录，其中 train_state.json 记录 current_epoch/current_step；--resume 从该目录恢复
+# 优化器、随机数与 epoch 计数，剩余 epoch 由训练脚本自行接续
+RESUME_AUTO = ('1', 'true', 'auto')
+RESUME_OFF = (None, '', '0', 'false', False)
+TRAIN_STATE_FILE = 'train_state.json'
+
+
+def find_resume_states(task_data):
+    # 返回可恢复的状态目录列表，最新的在前
+    output_dir, output_name = task_data.get('output_dir'), task_data.get('output_name')
+    if not output_dir or not output_name or not os.path.isdir(output_dir): return []
+    pattern = re.compile(rf'^{re.escape(output_name)}(?:-(\d+)|-step(\d+))?-state$')
+    states = []
+    with os.scandir(output_dir) as it:
+        for e in it:
+            match = pattern.match(e.name)
+            if not match or not e.is_dir(): continue
+            state = {"name": e.name, "path": e.path, "mtime": e.stat().st_mtime,
+                     "epoch": int(match.group(1)) if match.group(1) else None,
+                     "step": int(match.group(2)) if match.group(2) else None}
+            try:
+                with open(os.path.join(e.path, TRAIN_STATE_FILE), 'r', encoding='utf-8') as f: saved = json.load(f)
+                state['epoch'] = saved.get('current_epoch', state['epoch'])
+                state['step'] = saved.get('current_step', state['step'])
+            except (OSError, ValueError):
+                pass
+            states.append(state)
+    states.sort(key=lambda st: (st['mtime'], st['epoch'] or 0, st['step'] or 0), reverse=True)
+    return states
+
+
+def resolve_resume(task_data, resume):
+    # resume 为 auto/true/1 时取最新状态（没有则从头训练），为状态目录名时使用该目录，不存在时抛出 ValueError
+    if resume in RESUME_OFF: return None
+    states = find_resume_states(task_data)
+    if str(resume).lower() in RESUME_AUTO: return states[0] if states else None
+    for state in states:
+        if state['name'] == resume: return state
+    raise ValueError(f"RESUME STATE NOT FOUND: {resume}")
+
+
+def epoch_progress(task_data, run=None):
+    # 已完成 epoch 以最新的可恢复状态为准（崩溃时未保存的 epoch 需要重跑），running 记录日志中最后看到的 epoch
+    total = int_or(task_data.get('max_train_epochs'), None)
+    states = find_resume_states(task_data)
+    completed = max((st['epoch'] for st in states if st['epoch'] is not None), default=0)
+    if run and run.exit_code == 0 and total: completed = total
+    result = {"total": total, "completed": completed, "remaining": max(0, total - completed) if total else None}
+    if run: result['reached'] = run.metrics.progress.get('epoch')
+    return result
+
+
+# --- 命令规划 ---
+# 把任务/动作展开为有序步骤（argv、env、声明的输入与输出），以 argv + 输入指纹的哈希作为步骤键；
+# 相同键的步骤成功完成过且输出仍在时，再次执行会被跳过。缓存步骤是否可跳过只以缓存清单为准，
+# 规划时的清单检查结果随步骤一起保存（cache_report）
+STEP_MEMO_FILE = os.path.join(STATE_DIR, 'step_memo.json')
+STEP_MEMO_LIMIT = 1000
+MODEL_INPUT_KEYS = {
+    'latents': ('vae',),
+    'text_encoder': ('text_encoder',),
+    'train': ('dit', 'vae', 'text_encoder', 'network_weights', 'dataset_config', 'sample_prompts'),
+}
+
+
+def path_fingerprint(path):
+    if not path: return None
     try:
-        with open(json_path, 'r', encoding='utf-8') as f:
-            return jsonify({"status": "success", "data": json.load(f)})
-    except Exception as e:
-        return jsonify({"status": "error", "message": str(e)}), 500
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
 
 
-@app.route('/save', methods=['POST'])
-def save():
+def digest(obj):
+    return hashlib.sha1(json.dumps(obj, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def cache_dirs(dataset):
+    return sorted({ds.get('cache_directory') or ds.get('image_directory') for ds in (dataset or {}).get('datasets', [])
+                   if ds.get('cache_directory') or ds.get('image_directory')})
+
+
+def output_matches(name, match):
+    if not name.endswith('.safetensors'): return False
+    if match == 'text_encoder': return name.endswith('_te.safetensors')
+    if match == 'latents': return not name.endswith('_te.safetensors')
+    return True
+
+
+def outputs_fingerprint(outputs):
+    # 目录按匹配规则汇总其中 .safetensors 的 (名称, 大小)；任何输出缺失时返回 None
+    result = []
+    for out in outputs:
+        if out['match'] == 'file':
+            fp = path_fingerprint(out['path'])
+            if fp is None: return None
+            result.append(fp[0])
+            continue
+        if not os.path.isdir(out['path']): return None
+        with os.scandir(out['path']) as it:
+            files = sorted((e.name, e.stat().st_size) for e in it if e.is_file() and output_matches(e.name, out['match']))
+        if not files: return None
+        result.append(digest(files))
+    return digest(result)
+
+
+def step_inputs(kind, task_data, dataset, report=None):
+    # 缓存步骤的数据集指纹取自清单检查（report）算出的文件指纹，不再单独遍历一次
+    inputs = [{"path": task_data.get(k), "kind": "file", "fingerprint": path_fingerprint(task_data.get(k))}
+              for k in MODEL_INPUT_KEYS[kind] if task_data.get(k)]
+    if dataset is None: return inputs
+    if kind in CACHE_STEPS:
+        datasets = dataset.get('datasets', [])
+        for entry in report['datasets']:
+            fps = entry['_manifest'][1]['files'] if '_manifest' in entry else {}
+            inputs.append({"path": datasets[entry['index']].get('image_directory'), "kind": "dataset",
+                           "count": len(fps),
+                           "fingerprint": digest(sorted((k, fp['size'], fp['mtime']) for k, fp in fps.items()))})
+    else:
+        for folder in cache_dirs(dataset):
+            inputs.append({"path": folder, "kind": "cache",
+                           "fingerprint": outputs_fingerprint([{"path": folder, "match": "any"}])})
+    return inputs
+
+
+def step_outputs(kind, task_data, dataset):
+    if kind in CACHE_STEPS: return [{"path": folder, "match": kind} for folder in cache_dirs(dataset)]
+    output_dir, output_name = task_data.get('output_dir'), task_data.get('output_name')
+    if not output_dir or not output_name: return []
+    return [{"path": os.path.join(output_dir, f"{output_name}.safetensors"), "match": "file"}]
+
+
+def plan_steps(config, job, device=None):
+    # 返回 (步骤列表, 任务配置)；任务不存在时抛出 KeyError
+    qwen_root = config.get('qwen', {})
+    if job['action'] == 'cache_group':
+        task_data = prepare_group_cache(qwen_root, job)
+        commands = build_cache_commands(task_data, cache_settings(qwen_root, task_data))
+    else:
+        if job['task'] not in qwen_root or job['task'] in IGNORED_SECTIONS:
+            raise KeyError(f"TASK NOT FOUND: {job['task']}")
+        task_data = qwen_root[job['task']]
+        resume_state = resolve_resume(task_data, job.get('resume')) if job['action'] == 'train' else None
+        commands = build_commands(config, job['task'], job['action'], resume_state and resume_state['path'])
+    kinds = CACHE_STEP_ORDER if job['action'] in ('cache', 'cache_group') else ('train',)
     try:
-        data = request.json
-        current_task_id = data.get('task_name')
-        full_config = load_full_yaml()
+        dataset = load_dataset_json(task_data.get('dataset_config'))
+    except ValueError:
+        dataset = None
+    env = {"PYTHONUNBUFFERED": "1"}
+    if device is not None: env["CUDA_VISIBLE_DEVICES"] = str(device)
+    cache_data = cache_settings(qwen_root, task_data) if kinds == CACHE_STEP_ORDER else None
 
-        if current_task_id == '__NEW__':
-            task_config = {}
-        else:
-            if 'qwen' not in full_config or current_task_id not in full_config['qwen']: return jsonify(
-                {"status": "error"}), 404
-            task_config = full_config['qwen'][current_task_id]
-
-        new_output_name = None
-
-        # 1. 更新 YAML
-        for flat_key, value in data.get('yaml_updates', {}).items():
-            key = flat_key.split('.')[-1]
-            if key not in VISIBLE_TASK_KEYS: continue
-            if key == 'output_name': new_output_name = value
-            orig_val = task_config.get(key)
-            if value == "" and orig_val is None: continue
-            if isinstance(orig_val, bool) or (current_task_id == '__NEW__' and value in [True, False]):
-                task_config[key] = bool(value)
-            elif (isinstance(orig_val, int) and not isinstance(orig_val, bool)) or (
-                    current_task_id == '__NEW__' and isinstance(value, int)):
-                try:
-                    task_config[key] = int(value)
-                except:
-                    task_config[key] = value
-            elif isinstance(orig_val, float):
-                try:
-                    task_config[key] = float(value)
-                except:
-                    task_config[key] = value
-            else:
-                if isinstance(value, str): value = value.replace('\\', '/')
-                task_config[key] = value
-
-        if not new_output_name: return jsonify({"status": "error"}), 400
-
-        if current_task_id == '__NEW__': task_config['output_dir'] = f"./output/{new_output_name}"
-
-        # 2. 保存 JSON 文件
-        if not os.path.exists("./src"): os.makedirs("./src")
-        json_path = f"./src/{new_output_name}.json"
-
-        json_data = data.get('json_data', {})
-        with open(json_path, 'w', encoding='utf-8') as f:
-            json.dump(json_data, f, indent=2, ensure_ascii=False)
-
-        task_config['dataset_config'] = json_path
-        task_config['sample_prompts'] = json_path
-
-        # 3. 更新 Task ID
-        final_task_id = current_task_id
-        if current_task_id == '__NEW__':
-            if new_output_name in full_config['qwen']: return jsonify({"status": "error", "message": "Exists"}), 400
-            full_config['qwen'][new_output_name] = task_config
-            final_task_id = new_output_name
-        elif new_output_name != current_task_id:
-            if new_output_name not in full_config['qwen']:
-                full_config['qwen'][new_output_name] = task_config
-                del full_config['qwen'][current_task_id]
-                final_task_id = new_output_name
+    steps = []
+    for (name, argv), kind in zip(commands, kinds):
+        report = check_cache_step(task_data, cache_data, kind, dataset) if kind in CACHE_STEPS else None
+        inputs = step_inputs(kind, task_data, dataset, report)
+        steps.append({"name": name, "kind": kind, "argv": argv, "env": dict(env), "inputs": inputs,
+                      "outputs": step_outputs(kind, task_data, dataset),
+                      "key": digest({"argv": argv, "inputs": [[i['path'], i['fingerprint']] for i in inputs]})})
+        if report is not None: steps[-1]['cache_report'] = report
+        if kind == 'train' and job['action'] == 'train': steps[-1]['resume_from'] = resume_state
+    return steps, task_data
 
-        save_full_yaml(full_config)
-        return jsonify({"status": "success", "message": "SAVED", "new_task_id": final_task_id})
-    except Exception as e:
-        return jsonify({"status": "error", "message": str(e)}), 500
+
+class StepMemo:
+    # 非缓存步骤的完成记录；缓存步骤的 hit / record 转而读取、写入数据集目录下的缓存清单
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = None
+
+    def _load(self):
+        if self._entries is None:
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f: self._entries = json.load(f)
+            except (OSError, ValueError):
+                self._entries = {}
+        return self._entries
+
+    def hit(self, step):
+        # 输入未变（键相同）且输出仍与完成时一致
+        if step.get('cache_report') is not None: return step['cache_report']['fresh']
+        with self._lock: entry = self._load().get(step['key'])
+        if not entry or not step['outputs']: return False
+        return entry.get('outputs') == outputs_fingerprint(step['outputs'])
+
+    def record(self, step, job_id):
+        if step.get('cache_report') is not None:
+            record_cache_step(step['cache_report'])
+            return
+        outputs = outputs_fingerprint(step['outputs']) if step['outputs'] else None
+        with self._lock:
+            entries = self._load()
+            entries[step['key']] = {"name": step['name'], "job_id": job_id, "completed_at": time.time(),
+                                    "outputs": outputs}
+            if len(entries) > STEP_MEMO_LIMIT:
+                for key in sorted(entries, key=lambda k: entries[k]['completed_at'])[:len(entries) - STEP_MEMO_LIMIT]:
+                    del entries[key]
+            write_json_atomic(self.path, entries)
+
+
+STEP_MEMO = StepMemo(STEP_MEMO_FILE)
+
+
+def skip_memoized_steps(run, steps, force=False):
+    if force:
+        if any('cache_report' in step for step in steps): run.log("\n♻️ FORCE: manifest check skipped.\n")
+        return steps
+    kept = []
+    for step in steps:
+        report = step.get('cache_report')
+        if STEP_MEMO.hit(step):
+            reason = "inputs unchanged" if report is not None else \
+                f"already completed with identical inputs ({step['key'][:12]})"
+            run.log(f"\n⏭️ SKIP {step['name']}: {reason}.\n")
+            continue
+        if report is not None: log_cache_report(run, step['name'], report)
+        kept.append(step)
+    return kept
+
+
+# --- 数据集统计 ---
+# 只读取图片文件头获取尺寸；按目录缓存结果，目录 mtime 变化时增量重扫（size/mtime 未变的文件沿用旧结果）
+SCAN_WORKERS = min(32, (os.cpu_count() or 4) * 4)
+BUCKET_RESO_STEPS = 16
+DEFAULT_RESOLUTION = [960, 544]
+
+
+def image_size(path):
+    with open(path, 'rb') as f:
+        head = f.read(32)
+        if head.startswith(b'\x89PNG\r\n\x1a\n'):
+            return struct.unpack('>II', head[16:24])
+        if head[:2] == b'BM':
+            w, h = struct.unpack('<ii', head[18:26])
+            return w, abs(h)
+        if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+            chunk = head[12:16]
+            if chunk == b'VP8X':
+                return 1 + int.from_bytes(head[24:27], 'little'), 1 + int.from_bytes(head[27:30], 'little')
+            if chunk == b'VP8 ':
+                f.seek(26)
+                w, h = struct.unpack('<HH', f.read(4))
+                return w & 0x3fff, h & 0x3fff
+            if chunk == b'VP8L':
+                bits = int.from_bytes(head[21:25], 'little')
+                return (bits & 0x3fff) + 1, ((bits >> 14) & 0x3fff) + 1
+            return None
+        if head[:2] == b'\xff\xd8':
+            f.seek(2)
+            while True:
+                marker = f.read(2)
+                if len(marker) < 2 or marker[0] != 0xff: return None
+                while marker[1] == 0xff: marker = marker[:1] + f.read(1)
+                code = marker[1]
+                if code in (0xd8, 0x01) or 0xd0 <= code <= 0xd7: continue
+                length = struct.unpack('>H', f.read(2))[0]
+                if 0xc0 <= code <= 0xcf and code not in (0xc4, 0xc8, 0xcc):
+                    h, w = struct.unpack('>HH', f.read(5)[1:5])
+                    return w, h
+                f.seek(length - 2, 1)
+    return None
+
+
+class DirectoryScanCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._dirs = {}
+
+    def scan(self, folder):
+        # 返回 {文件名: (size, mtime, 宽, 高)}，无法解析的图片宽高为 None。
+        # 每次都重新列目录并按文件自身的 (size, mtime) 复用上次的宽高：原地覆盖同名文件不会改变目录的 mtime
+        folder = os.path.abspath(folder)
+        entries = {}
+        try:
+            with os.scandir(folder) as it:
+                for e in it:
+                    if not e.is_file() or os.path.splitext(e.name)[1].lower() not in IMAGE_EXTENSIONS: continue
+                    st = e.stat()
+                    entries[e.name] = (st.st_size, st.st_mtime_ns)
+        except OSError:
+            return {}
+        with self._lock: old = self._dirs.get(folder, {})
+        changed = [name for name, stamp in entries.items() if old.get(name, ())[:2] != stamp]
+        if not changed and len(old) == len(entries): return old
+
+        def one(name):
+            try:
+                dims = image_size(os.path.join(folder, name))
+            except (OSError, struct.error):
+                dims = None
+            return name, entries[name] + (tuple(dims) if dims else (None, None))
+
+        result = {name: old[name] for name in entries if name in old}
+        result.update(pool_map(one, changed, SCAN_WORKERS))
+        with self._lock: self._dirs[folder] = result
+        return result
+
+
+SCAN_CACHE = DirectoryScanCache()
+
+
+def bucket_resolutions(resolution, enable_bucket, steps=BUCKET_RESO_STEPS):
+    # 与 musubi BucketSelector 相同的桶生成方式：固定面积，宽度按 steps 递增
+    w, h = int(resolution[0]), int(resolution[1])
+    if not enable_bucket: return [(w, h)]
+    area = w * h
+    sqrt_size = int(math.sqrt(area))
+    min_size = (sqrt_size // 2) // steps * steps
+    buckets = set()
+    for bw in range(min_size, sqrt_size + steps, steps):
+        bh = (area // bw) // steps * steps
+        buckets.add((bw, bh))
+        buckets.add((bh, bw))
+    return sorted(buckets)
+
+
+def select_bucket(size, buckets, no_upscale, steps=BUCKET_RESO_STEPS):
+    iw, ih = size
+    if no_upscale:
+        bucket_area = buckets[0][0] * buckets[0][1]
+        if iw * ih < bucket_area: return (iw // steps * steps, ih // steps * steps)
+    ratio = iw / ih
+    return min(buckets, key=lambda b: abs(b[0] / b[1] - ratio))
+
+
+def dataset_stats(dataset, max_train_epochs=None):
+    general = dataset.get('general', {})
+    result = {"datasets": [], "steps_per_epoch": 0}
+    for idx, ds in enumerate(dataset.get('datasets', [])):
+        opt = lambda key, default=None: ds.get(key, general.get(key, default))
+        image_dir = ds.get('image_directory')
+        control_dir = ds.get('control_directory')
+        caption_ext = opt('caption_extension', '.txt')
+        batch_size = int(opt('batch_size', 1) or 1)
+        num_repeats = int(opt('num_repeats', 1) or 1)
+        resolution = opt('resolution', DEFAULT_RESOLUTION)
+        buckets = bucket_resolutions(resolution, opt('enable_bucket', False))
+        entry = {"index": idx, "image_directory": image_dir, "control_directory": control_dir,
+                 "resolution": list(resolution), "batch_size": batch_size, "num_repeats": num_repeats}
+        result['datasets'].append(entry)
+        if not image_dir or not os.path.isdir(image_dir):
+            entry['error'] = "image_directory not found"
+            continue
+
+        images = SCAN_CACHE.scan(image_dir)
+        controls = SCAN_CACHE.scan(control_dir) if control_dir and os.path.isdir(control_dir) else {}
+        # 控制图为 <主文件名>.<扩展名> 或 <主文件名>_<序号>.<扩展名>（多张控制图）
+        control_stems = {re.sub(r'_\d+$', '', os.path.splitext(n)[0]) for n in controls} | \
+                        {os.path.splitext(n)[0] for n in controls}
+        histogram = collections.Counter()
+        unreadable, missing_caption, missing_control = [], [], []
+        for name, (_, _, w, h) in sorted(images.items()):
+            stem = os.path.splitext(name)[0]
+            if w is None or not h:
+                unreadable.append(name)
+                continue
+            histogram[select_bucket((w, h), buckets, opt('bucket_no_upscale', False))] += 1
+            if not os.path.exists(os.path.join(image_dir, stem + caption_ext)): missing_caption.append(name)
+            if control_dir and stem not in control_stems:
+                missing_control.append(name)
+
+        steps = sum(math.ceil(count * num_repeats / batch_size) for count in histogram.values())
+        result['steps_per_epoch'] += steps
+        entry.update({
+            "image_count": len(images), "unreadable": unreadable[:STALE_REPORT_LIMIT],
+            "caption_extension": caption_ext,
+            "captioned": len(images) - len(unreadable) - len(missing_caption),
+            "missing_caption": missing_caption[:STALE_REPORT_LIMIT], "missing_caption_count": len(missing_caption),
+            "control_count": len(controls), "missing_control": missing_control[:STALE_REPORT_LIMIT],
+            "missing_control_count": len(missing_control),
+            "buckets": [{"resolution": list(b), "count": n} for b, n in sorted(histogram.items())],
+            "steps_per_epoch": steps,
+        })
+    if max_train_epochs:
+        try:
+            result['total_steps'] = result['steps_per_epoch'] * int(max_train_epochs)
+        except (TypeError, ValueError):
+            pass
+    return result
+
+
+# --- 训练指标 ---
+# 从 tqdm / musubi 输出中增量解析进度与 loss，按 step 写入定长数组列；查询时在服务端用 LTTB 降采样
+TQDM_RE = re.compile(r'(\d+)/(\d+) \[([\d:]+)<([\d:?]+)(?:,\s*([\d.]+)\s*(it/s|s/it))?')
+# 只从单词开头匹配，避免在很长的单词串上逐位置回溯（平方复杂度）
+LOSS_RE = re.compile(r'(?<!\w)(\w*loss\w*)=\s*(-?[\d.]+(?:[eE][-+]?\d+)?|nan|inf)')
+EPOCH_RE = re.compile(r'\bepoch (\d+)/(\d+)', re.I)
+METRICS_DEFAULT_POINTS = 500
+METRICS_MAX_POINTS = 5000
+
+
+def parse_clock(text):
+    if not text or '?' in text: return None
+    seconds = 0
+    for part in text.split(':'): seconds = seconds * 60 + int(part)
+    return seconds
+
+
+class RunMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._t0 = time.time()
+        self.step = array.array('l')
+        self.time = array.array('d')
+        self.loss = array.array('d')
+        self.rate = array.array('d')
+        self.progress = {}
+
+    def feed(self, text):
+        for segment in re.split(r'[\r\n]+', text):
+            if segment: self._parse(segment)
+
+    def _parse(self, segment):
+        epoch = EPOCH_RE.search(segment)
+        if epoch:
+            with self._lock: self.progress.update(epoch=int(epoch.group(1)), epochs=int(epoch.group(2)))
+        bar = TQDM_RE.search(segment)
+        if not bar: return
+        step, total = int(bar.group(1)), int(bar.group(2))
+        rate = float(bar.group(5)) if bar.group(5) else math.nan
+        if bar.group(6) == 's/it' and rate: rate = 1.0 / rate
+        losses = dict(LOSS_RE.findall(segment))
+        loss_key = 'avr_loss' if 'avr_loss' in losses else next(iter(losses), None)
+        loss = float(losses[loss_key]) if loss_key else math.nan
+        with self._lock:
+            if self.progress.get('total') not in (None, total) and step < (self.step[-1] if self.step else 0):
+                # 进度条总数变化且 step 回退：新的一段进度（例如下一个缓存步骤），重新计数
+                self.step, self.time = array.array('l'), array.array('d')
+                self.loss, self.rate = array.array('d'), array.array('d')
+            self.progress.update(step=step, total=total, elapsed=parse_clock(bar.group(3)),
+                                 eta=parse_clock(bar.group(4)), rate=None if math.isnan(rate) else rate)
+            if not math.isnan(loss): self.progress['loss'] = loss
+            if self.step and self.step[-1] == step:
+                # 同一步的重绘只更新最后一个点
+                if not math.isnan(loss): self.loss[-1] = loss
+                if not math.isnan(rate): self.rate[-1] = rate
+                return
+            self.step.append(step)
+            self.time.append(time.time() - self._t0)
+            self.loss.append(loss)
+            self.rate.append(rate)
+
+    def snapshot(self, points=METRICS_DEFAULT_POINTS):
+        with self._lock:
+            count = len(self.step)
+            ys = self.loss if any(not math.isnan(v) for v in self.loss) else self.rate
+            idx = lttb_indices(self.step, ys, points)
+            clean = lambda v: None if math.isnan(v) else v
+            return {
+                "count": count,
+                "progress": dict(self.progress),
+                "series": {
+                    "step": [self.step[i] for i in idx],
+                    "time": [round(self.time[i], 3) for i in idx],
+                    "loss": [clean(self.loss[i]) for i in idx],
+                    "rate": [clean(self.rate[i]) for i in idx],
+                },
+            }
+
+
+def lttb_indices(xs, ys, threshold):
+    # Largest-Triangle-Three-Buckets：保留首尾点，每个桶选出与相邻桶构成面积最大三角形的点
+    n = len(xs)
+    if threshold >= n or threshold < 3: return list(range(n))
+    y = [0.0 if math.isnan(v) else v for v in ys]
+    every = (n - 2) / (threshold - 2)
+    picked = [0]
+    a = 0
+    for i in range(threshold - 2):
+        start = int(i * every) + 1
+        end = min(int((i + 1) * every) + 1, n - 1)
+        next_start, next_end = end, min(int((i + 2) * every) + 1, n)
+        span = max(next_end - next_start, 1)
+        avg_x = sum(xs[j] for j in range(next_start, next_end)) / span if next_end > next_start else xs[n - 1]
+        avg_y = sum(y[j] for j in range(next_start, next_end)) / span if next_end > next_start else y[n - 1]
+        best, best_area = start, -1.0
+        for j in range(start, end):
+            area = abs((xs[a] - avg_x) * (y[j] - y[a]) - (xs[a] - xs[j]) * (avg_y - y[a]))
+            if area > best_area: best, best_area = j, area
+        picked.append(best)
+        a = best
+    picked.append(n - 1)
+    return picked
+
+
+# --- 运行日志归档 ---
+# 每次运行的输出按段写入磁盘，超过大小后切换新段并在后台 gzip 压缩旧段；读取时按逻辑偏移定位到段内 seek/mmap。
+# 压缩段由每 RUN_LOG_GZIP_BLOCK 字节一个独立的 gzip 成员拼接而成，旁边的 .gz.json 记录各成员的原始偏移与压缩后偏移，
+# 读取时从所在成员开始解压，分页读取旧段不必每次从头解压
+RUN_LOG_SEGMENT_BYTES = 32 * 1024 * 1024
+RUN_LOG_MAX_READ = 1024 * 1024
+RUN_LOG_GZIP_BLOCK = 1024 * 1024
+RUN_LOG_INDEX = 'index.json'
+
+
+def run_log_dir(qwen_root, task_name, job_id):
+    task = qwen_root.get(task_name) or {}
+    global_config = qwen_root.get('global_config', qwen_root.get('golbal_config', {})) or {}
+    base = task.get('logging_dir') or global_config.get('logging_dir') or task.get('output_dir') or STATE_DIR
+    return os.path.join(base, 'webui_runs', f"{task_name}_{job_id}")
+
+
+def compress_segment(path):
+    # 拼接的多个 gzip 成员仍是合法的 .gz 文件，可以直接用 gunzip / zcat 查看
+    tmp_path = path + '.gz.tmp'
+    blocks, start = [], 0
+    with open(path, 'rb') as src, open(tmp_path, 'wb') as dst:
+        for block in iter(lambda: src.read(RUN_LOG_GZIP_BLOCK), b''):
+            blocks.append([start, dst.tell()])
+            dst.write(gzip.compress(block))
+            start += len(block)
+    write_json_atomic(path + '.gz.json', {"blocks": blocks})
+    os.replace(tmp_path, path + '.gz')
+    os.remove(path)
+
+
+def read_gzip_range(path, lo, hi):
+    # 从包含 lo 的成员开始解压；没有偏移表（旧版本压缩的段）时从头解压
+    try:
+        with open(path + '.json', 'r', encoding='utf-8') as f: blocks = json.load(f)['blocks']
+    except (OSError, ValueError, KeyError):
+        blocks = []
+    start, pos = max((b for b in blocks if b[0] <= lo), default=(0, 0), key=lambda b: b[0])
+    with open(path, 'rb') as raw:
+        raw.seek(pos)
+        with gzip.GzipFile(fileobj=raw, mode='rb') as f:
+            f.seek(lo - start)
+            return f.read(hi - lo)
+
+
+class RunLogArchive:
+    def __init__(self, folder, segment_bytes=RUN_LOG_SEGMENT_BYTES):
+        self.folder = folder
+        self.segment_bytes = segment_bytes
+        self._lock = threading.Lock()
+        self._segments = []
+        self._file = None
+        self._size = 0
+        self._compressors = []
+        os.makedirs(folder, exist_ok=True)
+        self._open_segment()
+
+    def _open_segment(self):
+        start = sum(seg['length'] for seg in self._segments)
+        name = f"segment-{len(self._segments) + 1:05d}.log"
+        self._segments.append({"name": name, "start": start, "length": 0})
+        self._file = open(os.path.join(self.folder, name), 'ab')
+        self._size = 0
+        self._save_index(finished=False)
+
+    def _save_index(self, finished):
+        write_json_atomic(os.path.join(self.folder, RUN_LOG_INDEX), {"segments": self._segments, "finished": finished})
+
+    def _finish_segment(self):
+        self._file.close()
+        self._segments[-1]['length'] = self._size
+        path = os.path.join(self.folder, self._segments[-1]['name'])
+        thread = threading.Thread(target=compress_segment, args=(path,), daemon=True)
+        thread.start()
+        self._compressors.append(thread)
+
+    def write(self, text):
+        data = text.encode('utf-8', 'replace')
+        with self._lock:
+            if self._file is None: return
+            if self._size and self._size + len(data) > self.segment_bytes:
+                self._finish_segment()
+                self._open_segment()
+            self._file.write(data)
+            self._file.flush()
+            self._size += len(data)
+            self._segments[-1]['length'] = self._size
+
+    def close(self):
+        with self._lock:
+            if self._file is None: return
+            self._finish_segment()
+            self._file = None
+            self._save_index(finished=True)
+        for thread in self._compressors: thread.join()
+
+
+def read_run_log(folder, offset=None, length=RUN_LOG_MAX_READ, tail=None):
+    # 返回 (数据, 起始偏移, 总长度)；offset 为负数时从末尾倒数
+    with open(os.path.join(folder, RUN_LOG_INDEX), 'r', encoding='utf-8') as f: index = json.load(f)
+    segments = index['segments']
+    for seg in segments:
+        # 正在写入的段以磁盘上的实际大小为准
+        path = os.path.join(folder, seg['name'])
+        if os.path.exists(path) and not index.get('finished'): seg['length'] = os.path.getsize(path)
+    total = sum(seg['length'] for seg in segments)
+    length = max(0, min(int(length), RUN_LOG_MAX_READ))
+    if tail is not None:
+        length = min(int(tail), RUN_LOG_MAX_READ)
+        offset = max(0, total - length)
+    offset = int(offset or 0)
+    if offset < 0: offset = max(0, total + offset)
+    end = min(total, offset + length)
+
+    chunks = []
+    pos = 0
+    for seg in segments:
+        seg_start, seg_end = pos, pos + seg['length']
+        pos = seg_end
+        if seg_end <= offset or seg_start >= end or not seg['length']: continue
+        lo, hi = max(offset, seg_start) - seg_start, min(end, seg_end) - seg_start
+        path = os.path.join(folder, seg['name'])
+        try:
+            with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                chunks.append(mm[lo:hi])
+        except FileNotFoundError:
+            # 已压缩的段
+            chunks.append(read_gzip_range(path + '.gz', lo, hi))
+    return b''.join(chunks), offset, total
+
+
+# --- 执行槽位 ---
+# MUSUBI_DEVICES=0,1 表示两个并发槽位，分别通过 CUDA_VISIBLE_DEVICES 绑定 GPU 0 / 1；未设置时为单槽位且不注入；
+# MUSUBI_DEVICES=none 表示本机不运行任务，只调度到远程工作节点
+EXECUTOR_DEVICES = [] if os.environ.get('MUSUBI_DEVICES', '').strip().lower() == 'none' else \
+    [d.strip() for d in os.environ.get('MUSUBI_DEVICES', '').split(',') if d.strip()] or [None]
+RUN_HISTORY_LIMIT = 20
+
+
+class JobRun:
+    # 单个任务的运行时状态：独立的日志流、停止句柄与 stdin 通道
+    def __init__(self, job, slot):
+        self.job_id = job['id']
+        self.task = job['task']
+        self.action = job['action']
+        self.slot = slot
+        self.logs = LogBuffer()
+        self.metrics = RunMetrics()
+        self.archive = None
+        self.process = None
+        self.is_running = False
+        self.exit_code = None
+        self.failed_step = None
+        # 资源采样结果：rss/peak_rss（字节）、cpu_percent、threads、read_bytes/write_bytes、pids
+        self.resources = {}
+        self.started_at = time.time()
+        self.finished_at = None
+
+    @property
+    def device(self):
+        return self.slot['device']
+
+    def log(self, text):
+        self.logs.append(text)
+        CONSOLE_LOGS.append(text)
+        if self.archive: self.archive.write(text)
+
+    def log_lines(self, lines):
+        self.logs.extend(lines)
+        CONSOLE_LOGS.extend(lines)
+        if self.archive: self.archive.write(''.join(lines))
+
+    def set_progress(self, text):
+        self.logs.set_live(text)
+        CONSOLE_LOGS.set_live(f"[{self.task}] {text}" if text else "", key=self.job_id)
+
+    def stop(self):
+        if not self.is_running: return False
+        self.is_running = False
+        if not self.process: return True
+        try:
+            kill_process_tree(self.process)
+            self.log("\n🛑 KILLED.\n")
+        except:
+            # 进程已在步骤之间退出：is_running 已清除，后续步骤不会再启动
+            pass
+        return True
+
+    def send_input(self, cmd):
+        if not (self.is_running and self.process and self.process.stdin): return False
+        self.process.stdin.write((cmd + "\n").encode('utf-8'))
+        self.process.stdin.flush()
+        self.log(f"> {cmd}\n")
+        return True
+
+    def status(self):
+        return {"job_id": self.job_id, "task": self.task, "action": self.action, "is_running": self.is_running,
+                "slot": self.slot['index'], "device": self.device, "worker": self.slot.get('worker'),
+                "exit_code": self.exit_code,
+                "started_at": self.started_at, "finished_at": self.finished_at,
+                "progress": dict(self.metrics.progress), "live": self.logs.live, "resources": dict(self.resources)}
+
+
+class Executor:
+    # 执行槽位：本机槽位固定，远程工作节点注册时加入各自的槽位（worker 字段为节点 id），每个槽位同一时间只运行一个任务
+    def __init__(self, devices):
+        self._lock = threading.Lock()
+        self.slots = [{"index": i, "device": d, "job_id": None, "worker": None} for i, d in enumerate(devices)]
+        self._next_index = len(self.slots)
+        self.runs = collections.OrderedDict()
+
+    def add_worker(self, worker_id, devices):
+        with self._lock:
+            for device in devices:
+                self.slots.append({"index": self._next_index, "device": device, "job_id": None, "worker": worker_id})
+                self._next_index += 1
+
+    def remove_worker(self, worker_id):
+        # 空闲槽位立即移除，运行中的槽位在任务结束释放时移除
+        with self._lock:
+            for slot in self.slots:
+                if slot['worker'] == worker_id: slot['removed'] = True
+            self.slots = [slot for slot in self.slots if not (slot.get('removed') and slot['job_id'] is None)]
+
+    def _free_slots(self):
+        return [slot for slot in self.slots if slot['job_id'] is None and not slot.get('removed')]
+
+    def has_free_slot(self):
+        with self._lock: return bool(self._free_slots())
+
+    def _load(self, worker):
+        slots = [slot for slot in self.slots if slot['worker'] == worker and not slot.get('removed')]
+        return sum(1 for slot in slots if slot['job_id']) / len(slots) if slots else 1.0
+
+    def claim(self, job):
+        with self._lock:
+            free = self._free_slots()
+            if not free: return None
+            # 放到负载（占用槽位比例）最低的节点上，本机与远程节点同等对待
+            slot = min(free, key=lambda slot: (self._load(slot['worker']), slot['index']))
+            slot['job_id'] = job['id']
+            RESOURCE_SAMPLER.start()
+            run = JobRun(job, slot)
+            # 领取即视为运行中：规划、指纹、启动前检查等准备阶段同样可以停止
+            run.is_running = True
+            self.runs[run.job_id] = run
+            finished = [k for k, r in self.runs.items() if r.finished_at is not None]
+            for k in finished[:max(0, len(finished) - RUN_HISTORY_LIMIT)]: del self.runs[k]
+            return run
+
+    def release(self, run):
+        if run.archive:
+            try:
+                run.archive.close()
+            except OSError as e:
+                print(f"Log Archive Error: {e}")
+        CONSOLE_LOGS.set_live("", key=run.job_id)
+        with self._lock:
+            run.finished_at = time.time()
+            if run.slot['job_id'] == run.job_id: run.slot['job_id'] = None
+            if run.slot.get('removed') and run.slot in self.slots: self.slots.remove(run.slot)
+        JOB_QUEUE.wake()
+
+    def get(self, job_id):
+        with self._lock: return self.runs.get(job_id)
+
+    def active(self):
+        with self._lock: return [r for r in self.runs.values() if r.is_running]
+
+    def latest(self, running_only=False):
+        with self._lock:
+            for run in reversed(self.runs.values()):
+                if run.is_running or not running_only: return run
+        return None
+
+    def slot_status(self):
+        with self._lock: return [dict(slot) for slot in self.slots]
+
+
+EXECUTOR = Executor(EXECUTOR_DEVICES)
+
+
+def run_step(run, step, title):
+    # 运行单个步骤，输出写入 run 的日志与指标；返回退出码。启动失败时抛出异常
+    cmd_list = step['argv']
+    env = os.environ.copy()
+    env.update(step.get('env', {}))
+    device = f"🎯 DEVICE: {run.device}\n" if run.device is not None else ""
+    if run.slot.get('worker'): device += f"🖥️ WORKER: {WORKERS.name(run.slot['worker'])}\n"
+    run.log(f"\n{'=' * 40}\n🚀 {title}\n{device}📂 CMD: {' '.join(cmd_list)}\n{'=' * 40}\n")
+    if run.slot.get('worker'):
+        process = WORKERS.start_process(run.slot['worker'], remote_spec(run, step))
+    else:
+        # 独立进程组，停止时只结束子进程树，不会波及 webui 本身
+        process = subprocess.Popen(
+            cmd_list, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, stdin=subprocess.PIPE,
+            bufsize=0, env=env, start_new_session=(os.name != 'nt')
+        )
+    run.process = process
+    # 按块读取二进制输出，tqdm 的 \r 刷新只更新进度行，不写入历史
+    # bufsize=0 时 read(n) 等价于单次 os.read；gevent 模式下它是协作式的，不会阻塞事件循环
+    splitter = StreamSplitter()
+    while True:
+        data = process.stdout.read(READ_CHUNK_SIZE)
+        lines, progress = splitter.feed(data, final=not data)
+        if lines:
+            run.log_lines(lines)
+            for line in lines: run.metrics.feed(line)
+        if progress is not None:
+            run.set_progress(progress)
+            if progress: run.metrics.feed(progress)
+        if not data: break
+    process.stdout.close()
+    return process.wait()
+
+
+def run_background_process(run, steps, after_step=None):
+    # steps 为 plan_steps 生成的步骤；返回最后一步的退出码，0 表示全部成功。after_step(idx) 在每一步成功后调用
+    total = len(steps)
+    rc = 0
+
+    for idx, step in enumerate(steps):
+        if not run.is_running:
+            # 准备阶段或上一步结束后收到停止请求，不再启动后续步骤
+            run.log(f"\n🛑 STOPPED BY USER.\n")
+            rc = -1
+            break
+        try:
+            rc = run_step(run, step, f"{step['name']} ({idx + 1}/{total})")
+            if rc != 0:
+                if run.is_running:
+                    run.failed_step = step['kind']
+                    run.log(f"\n❌ FAILED (CODE {rc}).\n")
+                else:
+                    run.log(f"\n🛑 STOPPED BY USER.\n")
+                break
+            else:
+                run.log(f"\n✅ COMPLETED.\n")
+                if after_step: after_step(idx)
+        except Exception as e:
+            run.log(f"\n❌ SYSTEM ERROR: {str(e)}\n")
+            rc = -1
+            break
+    run.log("\n✨ ALL TASKS FINISHED.\n")
+    run.exit_code = rc
+    run.process = None
+    return rc
+
+
+def kill_process_tree(process):
+    if isinstance(process, RemoteProcess): return process.kill()
+    pid = process.pid
+    if os.name == 'nt':
+        subprocess.call(['taskkill', '/F', '/T', '/PID', str(pid)])
+    else:
+        import signal; os.killpg(os.getpgid(pid), signal.SIGTERM)
+
+
+# --- 远程工作节点 ---
+# 其他机器运行 worker.py 注册到 webui，注册的设备作为额外的执行槽位参与调度。节点通过长轮询领取消息
+# （run/stop/stdin），把输出分块 POST 回来，结束时回报退出码。任务的脚本与模型需在节点的工作目录下可用，
+# 命令中引用的本地 JSON（数据集配置、样例提示词）随任务一起下发。
+# 节点会拿到任务的命令行、环境变量与数据集配置，因此必须设置 MUSUBI_WORKER_TOKEN 才启用远程调度，
+# 节点请求需带相同的 X-Worker-Token 头
+WORKER_TOKEN = os.environ.get('MUSUBI_WORKER_TOKEN') or None
+# 超过该时间没有轮询或回传的节点视为掉线，其槽位移除、正在运行的步骤以 -1 结束
+WORKER_TIMEOUT = 30
+WORKER_POLL_SECONDS = 20
+REMOTE_PYTHON = "{python}"
+
+
+class RemoteStream:
+    # 远程步骤的输出：/worker/log 收到的数据块按顺序排队，read 阻塞到有数据，b'' 表示输出结束
+    def __init__(self):
+        self._chunks = queue.Queue()
+
+    def put(self, data):
+        self._chunks.put(data)
+
+    def read(self, size=-1):
+        return self._chunks.get()
+
+    def close(self):
+        pass
+
+
+class RemoteStdin:
+    def __init__(self, process):
+        self._process = process
+        self._buffer = b""
+
+    def write(self, data):
+        self._buffer += data
+
+    def flush(self):
+        data, self._buffer = self._buffer, b""
+        if data: WORKERS.send(self._process.worker_id, self._process.message('stdin', data=data.decode('utf-8', 'replace')))
+
+
+class RemoteProcess:
+    # 在远程节点上运行的步骤；提供 run_background_process / JobRun 用到的那部分 Popen 接口
+    pid = None
+
+    def __init__(self, worker_id, process_id):
+        self.worker_id = worker_id
+        self.id = process_id
+        self.stdout = RemoteStream()
+        self.stdin = RemoteStdin(self)
+        self.returncode = None
+        self._done = threading.Event()
+
+    def message(self, kind, **fields):
+        return {"type": kind, "id": self.id, **fields}
+
+    def kill(self):
+        WORKERS.send(self.worker_id, self.message('stop'))
+
+    def finish(self, rc):
+        if self._done.is_set(): return
+        self.returncode = rc
+        self.stdout.put(b"")
+        self._done.set()
+
+    def wait(self):
+        self._done.wait()
+        return self.returncode
+
+
+def remote_spec(run, step):
+    # 下发给节点的步骤：argv 中的本机解释器换成占位符，由节点替换成自己的解释器
+    argv = [REMOTE_PYTHON if arg == sys.executable else arg for arg in step['argv']]
+    files = {}
+    for arg in argv:
+        value = arg.split('=', 1)[1] if arg.startswith('--') and '=' in arg else ''
+        if value in files or not value.lower().endswith('.json') or os.path.isabs(value): continue
+        try:
+            with open(value, 'r', encoding='utf-8') as f: files[value] = f.read()
+        except OSError:
+            pass
+    return {"id": uuid.uuid4().hex[:12], "job": run.job_id, "task": run.task, "step": step['name'],
+            "argv": argv, "env": step.get('env', {}), "files": files}
+
+
+class WorkerRegistry:
+    def __init__(self, timeout=WORKER_TIMEOUT):
+        self.timeout = timeout
+        self._cond = threading.Condition()
+        self._workers = {}
+        self._processes = {}
+        self._thread = None
+
+    def register(self, name, devices, host):
+        worker_id = uuid.uuid4().hex[:12]
+        now = time.time()
+        with self._cond:
+            self._workers[worker_id] = {"id": worker_id, "name": name, "host": host, "devices": devices,
+                                        "registered_at": now, "last_seen": now, "mailbox": []}
+            if not (self._thread and self._thread.is_alive()):
+                self._thread = threading.Thread(target=self._reap, name='worker-reaper', daemon=True)
+                self._thread.start()
+        EXECUTOR.add_worker(worker_id, devices)
+        JOB_QUEUE.wake()
+        JOB_QUEUE.start()
+        return worker_id
+
+    def name(self, worker_id):
+        with self._cond:
+            worker = self._workers.get(worker_id)
+            return worker['name'] if worker else None
+
+    def touch(self, worker_id):
+        with self._cond:
+            worker = self._workers.get(worker_id)
+            if worker: worker['last_seen'] = time.time()
+            return worker is not None
+
+    def poll(self, worker_id, timeout=WORKER_POLL_SECONDS):
+        # 长轮询：有消息立即返回，否则等到超时返回空列表；节点未注册时返回 None
+        deadline = time.time() + timeout
+        with self._cond:
+            # 只在请求到达时更新心跳：等待中被唤醒不代表节点还活着
+            if worker_id in self._workers: self._workers[worker_id]['last_seen'] = time.time()
+            while True:
+                worker = self._workers.get(worker_id)
+                if worker is None: return None
+                if worker['mailbox']:
+                    messages, worker['mailbox'] = worker['mailbox'], []
+                    return messages
+                remaining = deadline - time.time()
+                if remaining <= 0: return []
+                self._cond.wait(remaining)
+
+    def send(self, worker_id, message):
+        with self._cond:
+            worker = self._workers.get(worker_id)
+            if worker is None: return False
+            worker['mailbox'].append(message)
+            self._cond.notify_all()
+            return True
+
+    def start_process(self, worker_id, spec):
+        process = RemoteProcess(worker_id, spec['id'])
+        with self._cond:
+            worker = self._workers.get(worker_id)
+            if worker is None: raise RuntimeError(f"WORKER NOT AVAILABLE: {worker_id}")
+            self._processes[process.id] = process
+            worker['mailbox'].append({"type": "run", **spec})
+            self._cond.notify_all()
+        return process
+
+    def process(self, worker_id, process_id):
+        with self._cond:
+            process = self._processes.get(process_id)
+            return process if process and process.worker_id == worker_id else None
+
+    def finish(self, worker_id, process_id, rc):
+        with self._cond:
+            process = self._processes.get(process_id)
+            if not process or process.worker_id != worker_id: return False
+            del self._processes[process_id]
+        process.finish(rc)
+        return True
+
+    def remove(self, worker_id, reason="WORKER LOST"):
+        with self._cond:
+            worker = self._workers.pop(worker_id, None)
+            lost = [p for p in self._processes.values() if p.worker_id == worker_id]
+            for process in lost: del self._processes[process.id]
+            self._cond.notify_all()
+        if worker is None: return False
+        EXECUTOR.remove_worker(worker_id)
+        for process in lost:
+            process.stdout.put(f"\n⚠️ {reason}: {worker['name']}\n".encode('utf-8'))
+            process.finish(-1)
+        return True
+
+    def _reap(self):
+        while True:
+            time.sleep(self.timeout / 3)
+            now = time.time()
+            with self._cond:
+                stale = [wid for wid, w in self._workers.items() if now - w['last_seen'] > self.timeout]
+            for worker_id in stale: self.remove(worker_id)
+
+    def status(self):
+        slots = EXECUTOR.slot_status()
+        with self._cond:
+            workers = [{k: v for k, v in w.items() if k != 'mailbox'} for w in self._workers.values()]
+        for worker in workers:
+            mine = [slot for slot in slots if slot['worker'] == worker['id']]
+            worker['slots'] = len(mine)
+            worker['busy'] = sum(1 for slot in mine if slot['job_id'])
+            worker['jobs'] = [slot['job_id'] for slot in mine if slot['job_id']]
+        return workers
+
+
+WORKERS = WorkerRegistry()
+
+
+def worker_auth_error():
+    if not WORKER_TOKEN: return jsonify(
+        {"status": "error", "message": "Remote workers disabled: set MUSUBI_WORKER_TOKEN"}), 403
+    if not hmac.compare_digest(request.headers.get('X-Worker-Token', '').encode(), WORKER_TOKEN.encode()):
+        return jsonify({"status": "error", "message": "Unauthorized"}), 403
+    return None
+
+
+def worker_not_found():
+    return jsonify({"status": "error", "message": "Unknown worker"}), 404
+
+
+@app.route('/worker/register', methods=['POST'])
+def worker_register():
+    error = worker_auth_error()
+    if error: return error
+    data = request.get_json(silent=True) or {}
+    devices = data.get('devices')
+    if devices is None: devices = [None]
+    if not isinstance(devices, list) or not devices: return jsonify(
+        {"status": "error", "message": "devices must be a non-empty list"}), 400
+    devices = [None if d is None else str(d) for d in devices]
+    name = str(data.get('name') or request.remote_addr)
+    worker_id = WORKERS.register(name, devices, request.remote_addr)
+    return jsonify({"status": "success", "worker_id": worker_id, "poll_seconds": WORKER_POLL_SECONDS,
+                    "timeout": WORKERS.timeout})
+
+
+@app.route('/worker/poll')
+def worker_poll():
+    error = worker_auth_error()
+    if error: return error
+    messages = WORKERS.poll(request.args.get('worker', ''))
+    if messages is None: return worker_not_found()
+    return jsonify({"status": "success", "messages": messages})
+
+
+@app.route('/worker/log', methods=['POST'])
+def worker_log():
+    error = worker_auth_error()
+    if error: return error
+    worker_id = request.args.get('worker', '')
+    if not WORKERS.touch(worker_id): return worker_not_found()
+    process = WORKERS.process(worker_id, request.args.get('id', ''))
+    # 404 告诉节点这个步骤已不存在（已结束或节点曾掉线），节点应结束对应进程
+    if process is None: return jsonify({"status": "error", "message": "Unknown process"}), 404
+    data = request.get_data()
+    if data: process.stdout.put(data)
+    return jsonify({"status": "success"})
+
+
+@app.route('/worker/exit', methods=['POST'])
+def worker_exit():
+    error = worker_auth_error()
+    if error: return error
+    data = request.get_json(silent=True) or {}
+    worker_id = data.get('worker', '')
+    if not WORKERS.touch(worker_id): return worker_not_found()
+    try:
+        rc = int(data.get('rc'))
+    except (TypeError, ValueError):
+        return jsonify({"status": "error", "message": "rc must be an integer"}), 400
+    if not WORKERS.finish(worker_id, data.get('id', ''), rc): return jsonify(
+        {"status": "error", "message": "Unknown process"}), 404
+    return jsonify({"status": "success"})
+
+
+@app.route('/worker/unregister', methods=['POST'])
+def worker_unregister():
+    error = worker_auth_error()
+    if error: return error
+    worker_id = (request.get_json(silent=True) or {}).get('worker', '')
+    if not WORKERS.remove(worker_id, "WORKER SHUT DOWN"): return worker_not_found()
+    return jsonify({"status": "success"})
+
+
+@app.route('/workers')
+def workers():
+    return jsonify({"status": "success", "workers": WORKERS.status(),
+                    "local_slots": sum(1 for slot in EXECUTOR.slot_status() if slot['worker'] is None)})
+
+
+# --- 失败分类与重试 ---
+# 从失败步骤的输出中识别已知错误；可重试的错误按策略逐级调整参数后在同一槽位重新运行，每次尝试都记录在任务中。
+# 策略可在 config.yaml 的 qwen.retry 中覆盖，例如：
+#   retry:
+#     max_retries: 3
+#     rules:
+#       oom:
+#         train: [{blocks_to_swap: '+8'}, {gradient_checkpointing_cpu_offload: true}]
+# 调整值支持 '+N'、'-N'、'*N'、'/N'（基于当前生效值）或直接给出新值
+FAILURE_SIGNATURES = (
+    ('oom', re.compile(r'CUDA out of memory|OutOfMemoryError|CUBLAS_STATUS_ALLOC_FAILED|cudaErrorMemoryAllocation'
+                       r'|HIP out of memory', re.I)),
+    ('host_oom', re.compile(r'\bMemoryError\b|Cannot allocate memory|DefaultCPUAllocator: not enough memory')),
+    ('missing_file', re.compile(r'FileNotFoundError|No such file or directory')),
+    ('missing_module', re.compile(r'ModuleNotFoundError|ImportError')),
+    ('nan', re.compile(r'\bloss is nan\b|NaN detected|nan loss', re.I)),
+    ('network', re.compile(r'ConnectionError|ReadTimeout|Temporary failure in name resolution|Connection reset')),
+)
+FAILURE_SCAN_LINES = 500
+KILLED_EXIT_CODES = (-9, 137)
+BLOCKS_TO_SWAP_LIMIT = 58
+DEFAULT_RETRY_POLICY = {
+    'max_retries': 3,
+    'rules': {
+        # 显存不足：训练先加大换出再开启 CPU offload；缓存减小批量与 VAE 分块
+        'oom': {
+            'train': [{'blocks_to_swap': '+8'}, {'gradient_checkpointing': True,
+                                                 'gradient_checkpointing_cpu_offload': True}, {'blocks_to_swap': '+8'}],
+            'latents': [{'vae_tiling': True, 'vae_chunk_size': '/2'}, {'vae_spatial_tile_sample_min_size': '/2'},
+                        {'vae_chunk_size': '/2'}],
+            'text_encoder': [{'batch_size': '/2'}, {'fp8_vl': True}, {'batch_size': '/2'}],
+        },
+        # 进程被系统杀死（通常是内存不足）：训练关闭 pinned memory，缓存减小批量/分块
+        'killed': {
+            'train': [{'use_pinned_memory_for_block_swap': False}],
+            'latents': [{'vae_chunk_size': '/2'}],
+            'text_encoder': [{'batch_size': '/2'}],
+        },
+        'host_oom': {
+            'train': [{'use_pinned_memory_for_block_swap': False}],
+            'latents': [{'vae_chunk_size': '/2'}],
+            'text_encoder': [{'batch_size': '/2'}],
+        },
+        # 网络抖动：原样重试一次
+        'network': {'*': [{}]},
+    },
+}
+# 缓存步骤的参数写在 cache 段，训练参数写在任务段
+CACHE_OVERRIDE_KINDS = tuple(CACHE_STEPS)
+
+
+def classify_failure(lines, rc):
+    # 从后往前找第一条匹配的错误行（最接近崩溃位置）
+    for line in reversed(lines):
+        for kind, pattern in FAILURE_SIGNATURES:
+            if pattern.search(line): return {"kind": kind, "line": line.strip()[:500]}
+    if rc in KILLED_EXIT_CODES: return {"kind": "killed", "line": None}
+    return {"kind": "unknown", "line": None}
+
+
+def retry_policy(qwen_root):
+    policy = copy.deepcopy(DEFAULT_RETRY_POLICY)
+    custom = qwen_root.get('retry') or {}
+    if 'max_retries' in custom: policy['max_retries'] = int_or(custom['max_retries'], policy['max_retries'])
+    for kind, rules in (custom.get('rules') or {}).items():
+        policy['rules'][kind] = {step: [dict(rung or {}) for rung in ladder] for step, ladder in (rules or {}).items()}
+    return policy
+
+
+def adjust_value(current, change):
+    if not isinstance(change, str) or not change[:1] in '+-*/' or len(change) < 2: return change
+    base = int_or(current, None)
+    amount = int_or(change[1:], None)
+    if base is None or amount is None: return current
+    if change[0] == '+': return base + amount
+    if change[0] == '-': return max(0, base - amount)
+    if change[0] == '*': return base * amount
+    return max(1, base // amount) if amount else base
+
+
+def effective_args(qwen_root, job, step_kind):
+    # 当前尝试生效的参数（含此前的调整），用于计算下一级调整
+    overrides = job.get('overrides') or {}
+    if step_kind in CACHE_OVERRIDE_KINDS:
+        return {**cache_settings(qwen_root, qwen_root.get(job['task'])), **overrides.get('cache', {})}
+    global_config = qwen_root.get('global_config', qwen_root.get('golbal_config', {}))
+    return {**global_config, **qwen_root.get(job['task'], {}), **overrides.get('task', {})}
+
+
+def next_overrides(qwen_root, job, failure, step_kind):
+    # 返回下一次尝试的 overrides；不可重试或已用尽时返回 None。不产生任何变化的调整级会被跳过
+    policy = retry_policy(qwen_root)
+    retries = len(job.get('attempts', [])) - 1
+    if retries >= policy['max_retries']: return None
+    rules = policy['rules'].get(failure['kind']) or {}
+    ladder = rules.get(step_kind) or rules.get('*') or []
+    section = 'cache' if step_kind in CACHE_OVERRIDE_KINDS else 'task'
+    # 每种 (错误, 步骤) 组合各自沿调整阶梯前进
+    rungs = job.setdefault('retry_rungs', {})
+    ladder_key = f"{failure['kind']}:{step_kind}"
+    while rungs.get(ladder_key, 0) < len(ladder):
+        rung = ladder[rungs.get(ladder_key, 0)]
+        rungs[ladder_key] = rungs.get(ladder_key, 0) + 1
+        current = effective_args(qwen_root, job, step_kind)
+        changes = {key: adjust_value(current.get(key), change) for key, change in rung.items()}
+        if 'blocks_to_swap' in changes:
+            changes['blocks_to_swap'] = min(int_or(changes['blocks_to_swap'], 0), BLOCKS_TO_SWAP_LIMIT)
+        changes = {k: v for k, v in changes.items() if current.get(k) != v}
+        if changes or not rung:
+            overrides = copy.deepcopy(job.get('overrides') or {})
+            overrides.setdefault(section, {}).update(changes)
+            return overrides
+    return None
+
+
+def job_config(config, job):
+    # 把任务上的参数调整叠加到配置副本上，不修改 config.yaml
+    overrides = job.get('overrides')
+    if not overrides: return config
+    config = copy.deepcopy(config)
+    qwen_root = config.setdefault('qwen', {})
+    if overrides.get('cache'):
+        qwen_root.setdefault('cache', {}).update(overrides['cache'])
+        task_data = qwen_root.get(job['task'])
+        if isinstance(task_data, dict) and task_data.get('cache_overrides'):
+            task_data['cache_overrides'].update(overrides['cache'])
+    if overrides.get('task') and job['task'] in qwen_root: qwen_root[job['task']].update(overrides['task'])
+    return config
+
+
+# --- 资源采样与指标 ---
+# 后台线程按固定间隔读取 /proc，统计每个运行中任务的子进程树与 webui 自身的资源占用；
+# /metrics 以 Prometheus 文本格式输出这些数据以及路由延迟直方图、日志行数、订阅者数量与 YAML 解析耗时。
+# 没有 /proc 的平台（Windows）上只输出 webui 内部计数
+SAMPLE_INTERVAL = float(os.environ.get('MUSUBI_SAMPLE_INTERVAL', 2))
+PROC_ROOT = '/proc'
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+try:
+    CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+    PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+except (AttributeError, ValueError, OSError):
+    CLOCK_TICKS, PAGE_SIZE = 100, 4096
+
+
+def read_proc_stat(pid):
+    # 返回 (ppid, cpu_ticks, threads, rss_bytes)；comm 中可能有空格，从最后一个 ')' 之后开始切分
+    with open(f"{PROC_ROOT}/{pid}/stat", 'rb') as f: data = f.read()
+    fields = data[data.rindex(b')') + 2:].split()
+    return int(fields[1]), int(fields[11]) + int(fields[12]), int(fields[17]), int(fields[21]) * PAGE_SIZE
+
+
+def read_proc_io(pid):
+    try:
+        with open(f"{PROC_ROOT}/{pid}/io", 'r') as f:
+            io = dict(line.split(':', 1) for line in f if ':' in line)
+        return int(io.get('read_bytes', 0)), int(io.get('write_bytes', 0))
+    except (OSError, ValueError):
+        return 0, 0
+
+
+def process_table():
+    # 一次扫描 /proc：{pid: (ppid, cpu_ticks, threads, rss)}
+    table = {}
+    for name in os.listdir(PROC_ROOT):
+        if not name.isdigit(): continue
+        try:
+            table[int(name)] = read_proc_stat(name)
+        except (OSError, ValueError, IndexError):
+            continue
+    return table
+
+
+def process_tree(table, root):
+    children = collections.defaultdict(list)
+    for pid, info in table.items(): children[info[0]].append(pid)
+    pids, stack = [], [root]
+    while stack:
+        pid = stack.pop()
+        if pid not in table: continue
+        pids.append(pid)
+        stack.extend(children[pid])
+    return pids
+
+
+class ResourceSampler:
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.enabled = os.path.isdir(PROC_ROOT)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._prev = {}
+        self.webui = {}
+        self.log_rate = 0.0
+        self._log_prev = (CONSOLE_LOGS.last_seq, time.time())
+
+    def start(self):
+        with self._lock:
+            if self._thread and self._thread.is_alive(): return
+            self._thread = threading.Thread(target=self._loop, name='resource-sampler', daemon=True)
+            self._thread.start()
+
+    def _loop(self):
+        while True:
+            try:
+                self.sample()
+            except Exception as e:
+                print(f"Resource Sampler Error: {e}")
+            time.sleep(self.interval)
+
+    def _usage(self, key, pids, table, now):
+        # CPU% 按两次采样间的 tick 差计算；新出现的进程计入其全部 tick
+        ticks = {pid: table[pid][1] for pid in pids}
+        prev_ticks, prev_time = self._prev.get(key, ({}, None))
+        cpu = None
+        if prev_time is not None and now > prev_time:
+            used = sum(t - prev_ticks.get(pid, 0) for pid, t in ticks.items() if t >= prev_ticks.get(pid, 0))
+            cpu = round(used / CLOCK_TICKS / (now - prev_time) * 100, 1)
+        self._prev[key] = (ticks, now)
+        io = [read_proc_io(pid) for pid in pids]
+        return {"rss": sum(table[pid][3] for pid in pids), "cpu_percent": cpu,
+                "threads": sum(table[pid][2] for pid in pids), "read_bytes": sum(r for r, _ in io),
+                "write_bytes": sum(w for _, w in io), "pids": len(pids)}
+
+    def sample(self):
+        now = time.time()
+        seq, last = self._log_prev
+        self.log_rate = (CONSOLE_LOGS.last_seq - seq) / (now - last) if now > last else 0.0
+        self._log_prev = (CONSOLE_LOGS.last_seq, now)
+        if not self.enabled: return
+        table = process_table()
+        self.webui = self._usage('webui', [os.getpid()] if os.getpid() in table else [], table, now)
+        live = set()
+        for run in EXECUTOR.active():
+            process = run.process
+            if not process or process.pid is None: continue
+            live.add(run.job_id)
+            usage = self._usage(run.job_id, process_tree(table, process.pid), table, now)
+            usage['peak_rss'] = max(usage['rss'], run.resources.get('peak_rss', 0))
+            run.resources = usage
+        for key in [k for k in self._prev if k != 'webui' and k not in live]: del self._prev[key]
+
+
+RESOURCE_SAMPLER = ResourceSampler()
+
+
+class RouteStats:
+    # 每个路由一份累积直方图
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self.routes = {}
+
+    def observe(self, route, method, status, seconds):
+        with self._lock:
+            stats = self.routes.setdefault((route, method), {"buckets": [0] * len(self.buckets), "sum": 0.0,
+                                                             "count": 0, "errors": 0})
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound: stats['buckets'][i] += 1
+            stats['sum'] += seconds
+            stats['count'] += 1
+            if status >= 500: stats['errors'] += 1
+
+    def snapshot(self):
+        with self._lock: return copy.deepcopy(self.routes)
+
+
+ROUTE_STATS = RouteStats()
+
+
+@app.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_latency(response):
+    # 流式响应只统计到响应对象返回为止
+    started = g.pop('request_started', None)
+    if started is not None and request.url_rule is not None:
+        ROUTE_STATS.observe(request.url_rule.rule, request.method, response.status_code,
+                            time.perf_counter() - started)
+    return response
+
+
+def metric_labels(**labels):
+    escape = lambda v: str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    text = ','.join(f'{k}="{escape(v)}"' for k, v in labels.items())
+    return '{' + text + '}' if text else ''
+
+
+@app.route('/metrics')
+def metrics():
+    RESOURCE_SAMPLER.start()
+    out = []
+
+    def metric(name, kind, help_text, samples):
+        out.append(f"# HELP {name} {help_text}")
+        out.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            if value is not None: out.append(f"{name}{metric_labels(**labels)} {value}")
+
+    routes = ROUTE_STATS.snapshot()
+    out.append("# HELP musubi_webui_request_duration_seconds Request latency per route")
+    out.append("# TYPE musubi_webui_request_duration_seconds histogram")
+    for (route, method), stats in sorted(routes.items()):
+        for bound, count in zip(ROUTE_STATS.buckets, stats['buckets']):
+            out.append(f"musubi_webui_request_duration_seconds_bucket"
+                       f"{metric_labels(route=route, method=method, le=bound)} {count}")
+        out.append(f"musubi_webui_request_duration_seconds_bucket"
+                   f"{metric_labels(route=route, method=method, le='+Inf')} {stats['count']}")
+        out.append(f"musubi_webui_request_duration_seconds_sum{metric_labels(route=route, method=method)} "
+                   f"{stats['sum']:.6f}")
+        out.append(f"musubi_webui_request_duration_seconds_count{metric_labels(route=route, method=method)} "
+                   f"{stats['count']}")
+    metric("musubi_webui_request_errors_total", "counter", "Responses with status >= 500",
+           [({"route": r, "method": m}, st['errors']) for (r, m), st in sorted(routes.items())])
+
+    runs = EXECUTOR.active()
+    metric("musubi_webui_log_lines_total", "counter", "Lines appended to the console log", [({}, CONSOLE_LOGS.last_seq)])
+    metric("musubi_webui_log_lines_per_second", "gauge", "Console log lines per second over the last sample",
+           [({}, round(RESOURCE_SAMPLER.log_rate, 3))])
+    metric("musubi_webui_log_subscribers", "gauge", "Connected log stream clients",
+           [({}, CONSOLE_LOGS.subscribers + sum(r.logs.subscribers for r in runs))])
+    metric("musubi_webui_yaml_load_seconds_total", "counter", "Time spent parsing config.yaml",
+           [({}, f"{CONFIG_STORE.load_seconds:.6f}")])
+    metric("musubi_webui_yaml_loads_total", "counter", "config.yaml parses", [({}, CONFIG_STORE.load_count)])
+    metric("musubi_webui_yaml_last_load_seconds", "gauge", "Duration of the last config.yaml parse",
+           [({}, f"{CONFIG_STORE.last_load_seconds:.6f}")])
+    jobs = JOB_QUEUE.list()
+    metric("musubi_webui_jobs", "gauge", "Jobs by state",
+           [({"state": state}, sum(1 for j in jobs if j['state'] == state)) for state in JOB_STATES])
+
+    resources = [({"process": "webui"}, RESOURCE_SAMPLER.webui)]
+    resources += [({"process": "job", "job_id": r.job_id, "task": r.task, "action": r.action}, r.resources)
+                  for r in runs if r.resources]
+    for name, key, kind, help_text in (
+            ("musubi_process_resident_memory_bytes", "rss", "gauge", "Resident memory of the process tree"),
+            ("musubi_process_peak_resident_memory_bytes", "peak_rss", "gauge", "Peak resident memory of the run"),
+            ("musubi_process_cpu_percent", "cpu_percent", "gauge", "CPU usage of the process tree"),
+            ("musubi_process_threads", "threads", "gauge", "Threads in the process tree"),
+            ("musubi_process_read_bytes_total", "read_bytes", "counter", "Storage bytes read by live processes"),
+            ("musubi_process_write_bytes_total", "write_bytes", "counter", "Storage bytes written by live processes"),
+            ("musubi_process_count", "pids", "gauge", "Processes in the tree")):
+        metric(name, kind, help_text, [(labels, usage.get(key)) for labels, usage in resources if usage])
+    return Response('\n'.join(out) + '\n', mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
+# --- 任务队列 ---
+QUEUE_FILE = os.path.join(STATE_DIR, 'queue.json')
+QUEUE_HISTORY_LIMIT = 200
+JOB_STATES = ('queued', 'running', 'succeeded', 'failed', 'cancelled')
+JOB_ACTIONS = ('cache', 'train')
+
+
+def write_json_atomic(path, data):
+    folder = os.path.dirname(os.path.abspath(path))
+    os.makedirs(folder, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix='.tmp.', dir=folder)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+class JobQueue:
+    # 持久化到磁盘的任务队列：按 priority 降序、order 升序调度，重启后排队中/被中断的任务继续执行
+    def __init__(self, path):
+        self.path = path
+        self._cond = threading.Condition(threading.RLock())
+        self._jobs = {}
+        self._order = 0
+        self._thread = None
+        self._stop_requested = set()
+        self.version = 0
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path): return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f: data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Queue Load Error: {e}")
+            return
+        for job in data.get('jobs', []):
+            if job.get('state') == 'running':
+                # 上次退出时正在运行：重新排队，训练任务从最新保存的状态续训
+                job['state'] = 'queued'
+                job['interrupted'] = True
+                job['started_at'] = None
+                if job.get('action') == 'train' and job.get('resume') in RESUME_OFF: job['resume'] = 'auto'
+            self._jobs[job['id']] = job
+            self._order = max(self._order, job.get('order', 0))
+
+    def _save(self):
+        finished = [j for j in self._jobs.values() if j['state'] not in ('queued', 'running')]
+        finished.sort(key=lambda j: j.get('finished_at') or 0)
+        for job in finished[:-QUEUE_HISTORY_LIMIT] if len(finished) > QUEUE_HISTORY_LIMIT else []:
+            del self._jobs[job['id']]
+        write_json_atomic(self.path, {"jobs": list(self._jobs.values())})
+        self.version += 1
+
+    def _queued(self):
+        jobs = [j for j in self._jobs.values() if j['state'] == 'queued']
+        jobs.sort(key=lambda j: (-j['priority'], j['order']))
+        return jobs
+
+    def list(self):
+        with self._cond:
+            running = [j for j in self._jobs.values() if j['state'] == 'running']
+            finished = [j for j in self._jobs.values() if j['state'] not in ('queued', 'running')]
+            finished.sort(key=lambda j: j.get('finished_at') or 0, reverse=True)
+            return copy.deepcopy(running + self._queued() + finished)
+
+    def get(self, job_id):
+        with self._cond:
+            job = self._jobs.get(job_id)
+            return copy.deepcopy(job) if job else None
+
+    def enqueue(self, task, action, priority=0, **extra):
+        with self._cond:
+            self._order += 1
+            job = {
+                "id": uuid.uuid4().hex[:12], "task": task, "action": action, "priority": int(priority),
+                "order": self._order, "state": "queued", "created_at": time.time(),
+                "started_at": None, "finished_at": None, "exit_code": None, **extra
+            }
+            self._jobs[job['id']] = job
+            self._save()
+            self._cond.notify_all()
+            return copy.deepcopy(job)
+
+    def cancel(self, job_id):
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if not job or job['state'] not in ('queued', 'running'): return False
+            if job['state'] == 'queued':
+                job['state'] = 'cancelled'
+                job['finished_at'] = time.time()
+                self._save()
+                return True
+            self._stop_requested.add(job_id)
+        run = EXECUTOR.get(job_id)
+        if run and run.stop(): return True
+        # 已经结束，停止请求不再生效
+        with self._cond: self._stop_requested.discard(job_id)
+        return False
+
+    def reorder(self, job_id, index):
+        # 将排队中的任务移动到同优先级队列中的 index 位置
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if not job or job['state'] != 'queued': return False
+            peers = [j for j in self._queued() if j['priority'] == job['priority'] and j is not job]
+            index = max(0, min(int(index), len(peers)))
+            peers.insert(index, job)
+            orders = sorted(j['order'] for j in peers)
+            for j, order in zip(peers, orders): j['order'] = order
+            self._save()
+            return True
+
+    def set_priority(self, job_id, priority):
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if not job or job['state'] != 'queued': return False
+            job['priority'] = int(priority)
+            self._save()
+            return True
+
+    def wait_dispatched(self, job_id, timeout=5):
+        # 等到调度线程处理完该任务（已开始或不可能立即开始）；返回是否已离开排队状态
+        def settled():
+            job = self._jobs.get(job_id)
+            if not job or job['state'] != 'queued': return True
+            queued = self._queued()
+            return not (queued and queued[0] is job and EXECUTOR.has_free_slot())
+
+        with self._cond:
+            self._cond.wait_for(settled, timeout)
+            job = self._jobs.get(job_id)
+            return bool(job) and job['state'] != 'queued'
+
+    def pending_count(self):
+        with self._cond: return len(self._queued())
+
+    def busy(self):
+        with self._cond: return any(j['state'] in ('queued', 'running') for j in self._jobs.values())
+
+    def wake(self):
+        # 槽位变化（任务结束、工作节点加入）后唤醒调度线程
+        with self._cond: self._cond.notify_all()
+
+    def start(self):
+        with self._cond:
+            if self._thread and self._thread.is_alive(): return
+            self._thread = threading.Thread(target=self._dispatch_loop, name='job-dispatcher', daemon=True)
+            self._thread.start()
+
+    def _dispatch_loop(self):
+        while True:
+            with self._cond:
+                while not (self._queued() and EXECUTOR.has_free_slot()): self._cond.wait()
+                job = self._queued()[0]
+                run = EXECUTOR.claim(job)
+                # 槽位可能在检查后随远程节点掉线而消失
+                if run is None: continue
+                job['state'] = 'running'
+                job['started_at'] = time.time()
+                job['device'] = run.device
+                if run.slot['worker']: job['worker'] = WORKERS.name(run.slot['worker'])
+                self._save()
+                self._cond.notify_all()
+            threading.Thread(target=self._run_job, args=(job, run), name=f"job-{job['id']}", daemon=True).start()
+
+    def _run_job(self, job, run):
+        while True:
+            seq = run.logs.last_seq
+            attempt = {"attempt": len(job.get('attempts', [])) + 1, "started_at": time.time(),
+                       "overrides": copy.deepcopy(job.get('overrides'))}
+            with self._cond: job.setdefault('attempts', []).append(attempt)
+            run.failed_step = None
+            try:
+                rc = self._execute(job, run)
+            except Exception as e:
+                run.log(f"\n❌ SYSTEM ERROR: {str(e)}\n")
+                rc = -1
+            attempt.update(finished_at=time.time(), exit_code=rc)
+            if rc == 0 or job['id'] in self._stop_requested or not run.failed_step or not job.get('retry', True):
+                break
+            lines = [line for _, line in run.logs.since(max(seq, run.logs.last_seq - FAILURE_SCAN_LINES))]
+            failure = classify_failure(lines, rc)
+            failure['step'] = run.failed_step
+            attempt['failure'] = failure
+            qwen_root = CONFIG_STORE.snapshot().get('qwen', {})
+            with self._cond:
+                overrides = next_overrides(qwen_root, job, failure, run.failed_step)
+                if overrides is None:
+                    self._save()
+                    break
+                job['overrides'] = overrides
+                if job['action'] == 'train': job['resume'] = 'auto'
+                self._save()
+            changes = ', '.join(f"{k}={v}" for section in overrides.values() for k, v in section.items())
+            run.log(f"\n🔁 {failure['kind'].upper()} IN {run.failed_step}, RETRY {attempt['attempt']}"
+                    f"{': ' + changes if changes else ''}\n")
+            if job['id'] in self._stop_requested: break
+        run.is_running = False
+        EXECUTOR.release(run)
+        with self._cond:
+            stopped = job['id'] in self._stop_requested
+            self._stop_requested.discard(job['id'])
+            # 停止请求到达时所有步骤已经正常完成，按成功记录
+            if stopped and rc != 0:
+                job['state'] = 'cancelled'
+            else:
+                job['state'] = 'succeeded' if rc == 0 else 'failed'
+            job['exit_code'] = rc
+            job['finished_at'] = time.time()
+            job['metrics'] = dict(run.metrics.progress)
+            if run.resources.get('peak_rss'): job['peak_rss'] = run.resources['peak_rss']
+            if job['action'] == 'train': job['epochs'] = self._epochs(job, run)
+            self._save()
+            self._cond.notify_all()
+
+    def _epochs(self, job, run):
+        task_data = CONFIG_STORE.snapshot().get('qwen', {}).get(job['task'])
+        if not isinstance(task_data, dict): return None
+        try:
+            return epoch_progress(task_data, run)
+        except OSError:
+            return None
+
+    def _execute(self, job, run):
+        config = job_config(CONFIG_STORE.snapshot(), job)
+        if len(job.get('attempts', [])) <= 1:
+            # 没有其他任务在跑时才清空全局控制台
+            if all(r is run for r in EXECUTOR.active()): CONSOLE_LOGS.clear()
+            log_dir = run_log_dir(config.get('qwen', {}), job['task'], job['id'])
+            try:
+                run.archive = RunLogArchive(log_dir)
+                with self._cond:
+                    job['log_dir'] = log_dir
+                    self._save()
+            except OSError as e:
+                run.log(f"\n⚠️ LOG ARCHIVE DISABLED: {str(e)}\n")
+        if job['action'] == 'autotune':
+            rc, result = run_autotune(job, run, config)
+            with self._cond:
+                job['autotune'] = result
+                self._save()
+            return rc
+        try:
+            steps, _ = plan_steps(config, job, run.device)
+        except (KeyError, OSError, ValueError) as e:
+            run.log(f"\n❌ {e.args[0] if e.args else e}\n")
+            return -1
+        if job['action'] == 'cache_group':
+            run.log(f"\n📦 CACHE GROUP {job['group']}: {', '.join(job['tasks'])}\n")
+        force = job.get('force', False)
+        # 远程节点上的模型路径由节点自己负责，只在本机槽位上做启动前检查
+        if job['action'] == 'train' and not force and not run.slot.get('worker'):
+            check = preflight(config, job['task'], PREFLIGHT_VRAM_GB)
+            for warning in check['warnings']: run.log(f"\n⚠️ PREFLIGHT: {warning}\n")
+            if check['errors']:
+                for error in check['errors']: run.log(f"\n❌ PREFLIGHT: {error}\n")
+                return -1
+        resume_state = steps[-1].get('resume_from') if steps else None
+        if resume_state:
+            run.log(f"\n⏯️ RESUMING FROM {resume_state['name']} (EPOCH {resume_state['epoch']})\n")
+            with self._cond:
+                job['resumed_from'] = resume_state['name']
+                self._save()
+        elif job.get('resume') not in RESUME_OFF:
+            run.log("\n⏯️ NO SAVED STATE, STARTING FROM SCRATCH\n")
+        steps = skip_memoized_steps(run, steps, force)
+        return run_background_process(run, steps, lambda idx: STEP_MEMO.record(steps[idx], job['id']))
+
+
+JOB_QUEUE = JobQueue(QUEUE_FILE)
+
+
+def find_run(job_id=None):
+    # 未指定 job_id 时取最近一个正在运行的任务
+    return EXECUTOR.get(job_id) if job_id else EXECUTOR.latest(running_only=True)
+
+
+@app.route('/execute_task')
+def execute_task():
+    task_name = request.args.get('task');
+    action = request.args.get('action')
+    if not task_name: return "Error", 400
+    if action not in JOB_ACTIONS: return jsonify({"status": "error", "message": "Unknown action"}), 400
+    if task_name not in CONFIG_STORE.snapshot().get('qwen', {}): return "Error", 404
+    try:
+        job = JOB_QUEUE.enqueue(task_name, action, request.args.get('priority', 0),
+                                force=request.args.get('force') in ('1', 'true'), resume=request.args.get('resume'),
+                                retry=request.args.get('retry') not in ('0', 'false'))
+    except (TypeError, ValueError):
+        return jsonify({"status": "error", "message": "Bad priority"}), 400
+    JOB_QUEUE.start()
+    started = JOB_QUEUE.wait_dispatched(job['id'])
+    return jsonify({"status": "success", "message": "Started" if started else "Queued", "job_id": job['id']})
+
+
+@app.route('/resume_info')
+def resume_info():
+    task_name = request.args.get('task')
+    qwen_root = CONFIG_STORE.snapshot().get('qwen', {})
+    if not task_name or task_name in IGNORED_SECTIONS or task_name not in qwen_root: return jsonify(
+        {"status": "error", "message": "Not found"}), 404
+    task_data = qwen_root[task_name]
+    global_config = qwen_root.get('global_config', qwen_root.get('golbal_config', {}))
+    states = find_resume_states(task_data)
+    return jsonify({"status": "success", "task": task_name, "states": states, "latest": states[0] if states else None,
+                    "epochs": epoch_progress(task_data),
+                    "save_state": bool({**global_config, **task_data}.get('save_state'))})
+
+
+@app.route('/stop_task', methods=['POST'])
+def stop_task():
+    # 指定 job_id 时停止（或取消排队中的）该任务，否则停止最近一个正在运行的任务
+    job_id = (request.get_json(silent=True) or {}).get('job_id') or request.args.get('job')
+    if not job_id:
+        run = find_run()
+        job_id = run.job_id if run and run.is_running else None
+    if job_id and JOB_QUEUE.cancel(job_id): return jsonify({"status": "success"})
+    return jsonify({"status": "error", "message": "Not running"}), 400
+
+
+@app.route('/get_queue')
+def get_queue():
+    return jsonify({"status": "success", "jobs": JOB_QUEUE.list()})
+
+
+@app.route('/enqueue_job', methods=['POST'])
+def enqueue_job():
+    data = request.json or {}
+    task_name = data.get('task');
+    action = data.get('action')
+    if action not in JOB_ACTIONS: return jsonify({"status": "error", "message": "Unknown action"}), 400
+    if task_name not in CONFIG_STORE.snapshot().get('qwen', {}): return jsonify(
+        {"status": "error", "message": "Not found"}), 404
+    try:
+        job = JOB_QUEUE.enqueue(task_name, action, data.get('priority', 0), force=bool(data.get('force')),
+                                resume=data.get('resume'), retry=data.get('retry', True) is not False)
+    except (TypeError, ValueError):
+        return jsonify({"status": "error", "message": "Bad priority"}), 400
+    JOB_QUEUE.start()
+    return jsonify({"status": "success", "job": job})
+
+
+@app.route('/cancel_job', methods=['POST'])
+def cancel_job():
+    if JOB_QUEUE.cancel((request.json or {}).get('job_id')): return jsonify({"status": "success"})
+    return jsonify({"status": "error", "message": "Not cancellable"}), 400
+
+
+@app.route('/reorder_job', methods=['POST'])
+def reorder_job():
+    data = request.json or {}
+    try:
+        ok = JOB_QUEUE.reorder(data.get('job_id'), data.get('index', 0))
+    except (TypeError, ValueError):
+        ok = False
+    if ok: return jsonify({"status": "success"})
+    return jsonify({"status": "error", "message": "Not queued"}), 400
+
+
+@app.route('/set_job_priority', methods=['POST'])
+def set_job_priority():
+    data = request.json or {}
+    try:
+        ok = JOB_QUEUE.set_priority(data.get('job_id'), data.get('priority', 0))
+    except (TypeError, ValueError):
+        ok = False
+    if ok: return jsonify({"status": "success"})
+    return jsonify({"status": "error", "message": "Not queued"}), 400
+
+
+def parse_log_cursor():
+    # 优先使用 EventSource 自动重连时带上的 Last-Event-ID，其次是 ?since=
+    raw = request.headers.get('Last-Event-ID') or request.args.get('since')
+    try:
+        return int(raw) if raw else 0
+    except ValueError:
+        return 0
+
+
+@app.route('/stream_logs')
+def stream_logs():
+    cursor = parse_log_cursor()
+    sse = request.args.get('format') == 'sse'
+    job_id = request.args.get('job')
+    run = EXECUTOR.get(job_id) if job_id else None
+    if job_id and not run: return jsonify({"status": "error", "message": "Not found"}), 404
+    logs = run.logs if run else CONSOLE_LOGS
+    is_running = (lambda: run.is_running) if run else (lambda: bool(EXECUTOR.active()))
+
+    def generate():
+        curr = cursor
+        live_seen = -1
+        logs.subscribe()
+        try:
+            while True:
+                # 纯文本流在任务结束且已追平时退出；SSE 空闲时发送心跳，客户端断开后 yield 抛出 GeneratorExit 回收
+                if not sse and not is_running() and not logs.pending(curr): return
+                if not logs.wait_for(curr, LOG_HEARTBEAT_INTERVAL, live_seen if sse else None):
+                    if sse: yield ": ping\n\n"
+                    continue
+                deadline = time.monotonic() + LOG_FLUSH_INTERVAL
+                while logs.pending(curr) < LOG_FLUSH_LINES:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0: break
+                    logs.wait_for(logs.last_seq, remaining)
+                entries = logs.since(curr)
+                if entries:
+                    curr = entries[-1][0]
+                    chunk = ''.join(line for _, line in entries)
+                    yield f"id: {curr}\ndata: {json.dumps(chunk, ensure_ascii=False)}\n\n" if sse else chunk
+                if sse and logs.live_version != live_seen:
+                    # 进度行单独作为 progress 事件推送，不带 id，不影响断点续传
+                    live_seen = logs.live_version
+                    yield f"event: progress\ndata: {json.dumps(logs.live, ensure_ascii=False)}\n\n"
+        finally:
+            logs.unsubscribe()
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream' if sse else 'text/plain',
+                    headers={"X-Log-Seq": str(logs.last_seq), "Cache-Control": "no-cache"})
+
+
+@app.route('/cache_status')
+def cache_status():
+    task_name = request.args.get('task')
+    qwen_root = CONFIG_STORE.snapshot().get('qwen', {})
+    if not task_name or task_name not in qwen_root or task_name in IGNORED_SECTIONS: return jsonify(
+        {"status": "error", "message": "Not found"}), 404
+    task_data = qwen_root[task_name]
+    try:
+        steps = [public_cache_report(check_cache_step(task_data, cache_settings(qwen_root, task_data), step))
+                 for step in CACHE_STEP_ORDER]
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+    return jsonify({"status": "success", "steps": steps})
+
+
+@app.route('/dataset_stats')
+def dataset_stats_api():
+    task_name = request.args.get('task')
+    qwen_root = CONFIG_STORE.snapshot().get('qwen', {})
+    if not task_name or task_name not in qwen_root or task_name in IGNORED_SECTIONS: return jsonify(
+        {"status": "error", "message": "Not found"}), 404
+    task_data = qwen_root[task_name]
+    try:
+        dataset = load_dataset_json(task_data.get('dataset_config'))
+        if dataset is None: return jsonify({"status": "error", "message": "dataset_config not found"}), 404
+        return jsonify({"status": "success", **dataset_stats(dataset, task_data.get('max_train_epochs'))})
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+
+@app.route('/run_metrics')
+def run_metrics():
+    job_id = request.args.get('job')
+    run = EXECUTOR.get(job_id) if job_id else EXECUTOR.latest()
+    if not run: return jsonify({"status": "error", "message": "Not found"}), 404
+    try:
+        points = max(3, min(int(request.args.get('points', METRICS_DEFAULT_POINTS)), METRICS_MAX_POINTS))
+    except ValueError:
+        points = METRICS_DEFAULT_POINTS
+    return jsonify({"status": "success", "job_id": run.job_id, "task": run.task, **run.metrics.snapshot(points)})
+
+
+@app.route('/run_logs')
+def run_logs():
+    job_id = request.args.get('run')
+    job = JOB_QUEUE.get(job_id) if job_id else None
+    if not job or not job.get('log_dir'): return jsonify({"status": "error", "message": "Not found"}), 404
+    try:
+        data, offset, total = read_run_log(job['log_dir'], request.args.get('offset', 0),
+                                           request.args.get('length', RUN_LOG_MAX_READ), request.args.get('tail'))
+    except FileNotFoundError:
+        return jsonify({"status": "error", "message": "Archive missing"}), 404
+    except ValueError:
+        return jsonify({"status": "error", "message": "Bad range"}), 400
+    return Response(data, mimetype='text/plain; charset=utf-8',
+                    headers={"X-Log-Offset": str(offset), "X-Log-Next": str(offset + len(data)),
+                             "X-Log-Total": str(total)})
+
+
+@app.route('/plan')
+def plan():
+    task_name = request.args.get('task')
+    action = request.args.get('action')
+    if action not in JOB_ACTIONS: return jsonify({"status": "error", "message": "Unknown action"}), 400
+    try:
+        steps, _ = plan_steps(CONFIG_STORE.snapshot(),
+                              {"task": task_name, "action": action, "resume": request.args.get('resume')},
+                              request.args.get('device'))
+    except KeyError:
+        return jsonify({"status": "error", "message": "Not found"}), 404
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+    for step in steps:
+        step['memoized'] = STEP_MEMO.hit(step)
+        if 'cache_report' in step: step['cache_report'] = public_cache_report(step['cache_report'])
+    return jsonify({"status": "success", "task": task_name, "action": action, "steps": steps})
+
+
+@app.route('/task_status')
+def task_status():
+    job_id = request.args.get('job')
+    if job_id:
+        run = EXECUTOR.get(job_id)
+        if run: return jsonify({"status": "success", **run.status()})
+        job = JOB_QUEUE.get(job_id)
+        if not job: return jsonify({"status": "error", "message": "Not found"}), 404
+        return jsonify({"status": "success", "job_id": job_id, "task": job['task'], "action": job['action'],
+                        "is_running": False, "state": job['state'], "exit_code": job['exit_code']})
+    latest = EXECUTOR.latest(running_only=True) or EXECUTOR.latest()
+    active = EXECUTOR.active()
+    return jsonify(
+        {"is_running": bool(active), "task": latest.task if latest else None,
+         "action": latest.action if latest else None, "job_id": latest.job_id if latest else None,
+         "runs": [r.status() for r in active], "slots": EXECUTOR.slot_status(), "queued": JOB_QUEUE.pending_count()})
+
+
+@app.route('/console_input', methods=['POST'])
+def console_input():
+    cmd = request.json.get('cmd')
+    if not cmd: return jsonify({"status": "error"}), 400
+    job_id = request.json.get('job_id')
+    run = find_run(job_id)
+    if job_id and not (run and run.is_running): return jsonify({"status": "error", "message": "Not running"}), 400
+    if run and run.is_running:
+        try:
+            if run.send_input(cmd): return jsonify({"status": "success"})
+        except:
+            return jsonify({"status": "error"}), 500
+    else:
+        CONSOLE_LOGS.append(f"\n> {cmd}\n")
+        try:
+            out = subprocess.check_output(cmd, shell=True, stderr=subprocess.STDOUT, text=True, encoding='utf-8',
+                                          errors='replace')
+            CONSOLE_LOGS.append(out)
+        except subprocess.CalledProcessError as e:
+            CONSOLE_LOGS.append(e.output)
+        except Exception as e:
+            CONSOLE_LOGS.append(str(e) + "\n")
+    return jsonify({"status": "success"})
+
+
+# --- 合并缓存 ---
+# 使用相同 VAE / 文本编码器 / 模型版本 / 缓存参数的任务合并为一组：生成一份合并后的数据集配置，每个脚本每组只加载一次模型
+CACHE_GROUP_DIR = os.path.join(STATE_DIR, 'cache_groups')
+
+
+def cache_group_key(qwen_root, task_data):
+    cache_data = cache_settings(qwen_root, task_data)
+    key = {k: task_data.get(k) for k in ('vae', 'text_encoder', 'model_version')}
+    key['cache'] = {k: cache_data[k] for k in sorted(cache_data)}
+    return hashlib.sha1(json.dumps(key, sort_keys=True, default=str).encode()).hexdigest()[:12]
+
+
+def group_cache_tasks(qwen_root, task_names):
+    groups = collections.OrderedDict()
+    for name in task_names:
+        groups.setdefault(cache_group_key(qwen_root, qwen_root[name]), []).append(name)
+    return groups
+
+
+def merge_dataset_configs(qwen_root, task_names):
+    # general 中的全部参数下放到每个数据集条目（条目自身的值优先），完全相同的条目只保留一份
+    merged, seen = [], set()
+    for name in task_names:
+        dataset = load_dataset_json(qwen_root[name].get('dataset_config'))
+        if dataset is None: raise FileNotFoundError(f"dataset_config not found for {name}")
+        general = dataset.get('general', {})
+        for ds in dataset.get('datasets', []):
+            entry = dict(general)
+            entry.update(ds)
+            fingerprint = json.dumps(entry, sort_keys=True)
+            if fingerprint in seen: continue
+            seen.add(fingerprint)
+            merged.append(entry)
+    return {"general": {}, "datasets": merged}
+
+
+def prepare_group_cache(qwen_root, job):
+    # 返回合并后的伪任务配置，可直接交给 build_cache_commands / plan_steps
+    names = job['tasks']
+    missing = [n for n in names if n not in qwen_root]
+    if missing: raise KeyError(f"TASK NOT FOUND: {', '.join(missing)}")
+    path = os.path.join(CACHE_GROUP_DIR, f"{job['group']}.json")
+    write_json_atomic(path, merge_dataset_configs(qwen_root, names))
+    first = qwen_root[names[0]]
+    task_data = {k: first.get(k) for k in ('vae', 'text_encoder', 'model_version', 'cache_overrides')}
+    task_data['dataset_config'] = path
+    return task_data
+
+
+@app.route('/cache_tasks', methods=['POST'])
+def cache_tasks():
+    data = request.json or {}
+    qwen_root = CONFIG_STORE.snapshot().get('qwen', {})
+    all_tasks = [k for k in qwen_root if k not in IGNORED_SECTIONS]
+    names = all_tasks if data.get('all') else data.get('tasks') or []
+    missing = [n for n in names if n not in all_tasks]
+    if not names or missing: return jsonify({"status": "error", "message": f"Not found: {', '.join(missing)}"}), 400
+    try:
+        priority = int(data.get('priority', 0))
+    except (TypeError, ValueError):
+        return jsonify({"status": "error", "message": "Bad priority"}), 400
+    groups = []
+    for key, members in group_cache_tasks(qwen_root, names).items():
+        job = JOB_QUEUE.enqueue(f"cache-group-{key}", 'cache_group', priority, tasks=members,
+                                group=key, force=bool(data.get('force')))
+        groups.append({"group": key, "tasks": members, "job_id": job['id']})
+    JOB_QUEUE.start()
+    return jsonify({"status": "success", "groups": groups})
+
+
+# --- 缓存参数自动调优 ---
+# 从任务数据集中抽样，在候选网格上逐个短时运行缓存脚本，按输出中的 tqdm 速率（换算为每秒图片数）和是否失败选出参数，
+# 写回 cache 段或任务的 cache_overrides。探测结果按 (主机/显卡、模型文件、脚本、样本、参数) 缓存，环境不变时不重复探测。
+# 网格与样本数可在 config.yaml 的 qwen.autotune 中覆盖，例如：
+#   autotune:
+#     sample_images: 16
+#     grid:
+#       text_encoder: {batch_size: [1, 4, 16]}
+AUTOTUNE_DIR = os.path.join(STATE_DIR, 'autotune')
+AUTOTUNE_CACHE_FILE = os.path.join(STATE_DIR, 'autotune.json')
+AUTOTUNE_CACHE_LIMIT = 1000
+AUTOTUNE_TARGETS = ('cache', 'task')
+# 在最快速率的该比例范围内时选显存占用更低的参数，给完整数据集（更大的分桶）留余量
+AUTOTUNE_TOLERANCE = 0.05
+# 轻量参数都因这些错误失败时，更重的参数直接跳过
+MEMORY_FAILURES = ('oom', 'host_oom', 'killed')
+# 网格中每个参数的取值按显存占用从低到高排列
+DEFAULT_AUTOTUNE = {
+    'sample_images': 32,
+    'probe_timeout': 900,
+    'grid': {
+        'latents': {'vae_tiling': [True, False], 'vae_chunk_size': [16, 32, 64],
+                    'vae_spatial_tile_sample_min_size': [256, 512]},
+        'text_encoder': {'batch_size': [1, 2, 4, 8, 16]},
+    },
+}
+GPU_QUERY = ['nvidia-smi', '--query-gpu=index,name,memory.total', '--format=csv,noheader']
+GPU_INVENTORY = {}
+
+
+def autotune_settings(qwen_root):
+    settings = copy.deepcopy(DEFAULT_AUTOTUNE)
+    custom = qwen_root.get('autotune') or {}
+    for key in ('sample_images', 'probe_timeout'):
+        if key in custom: settings[key] = max(1, int_or(custom[key], settings[key]))
+    for kind, space in (custom.get('grid') or {}).items():
+        if kind not in settings['grid'] or not space: continue
+        settings['grid'][kind] = {k: list(v) if isinstance(v, (list, tuple)) else [v] for k, v in space.items()}
+    return settings
+
+
+def gpu_identity(device):
+    # nvidia-smi 报告的显卡型号与显存，查询结果在进程内缓存；没有 nvidia-smi 时为 None
+    if 'gpus' not in GPU_INVENTORY:
+        try:
+            out = subprocess.run(GPU_QUERY, capture_output=True, text=True, timeout=10).stdout
+            GPU_INVENTORY['gpus'] = [line.strip() for line in out.splitlines() if line.strip()]
+        except (OSError, subprocess.SubprocessError):
+            GPU_INVENTORY['gpus'] = []
+    gpus = GPU_INVENTORY['gpus']
+    if device is None: return gpus or None
+    return [gpu for gpu in gpus if gpu.split(',')[0].strip() == str(device)] or None
+
+
+def candidate_grid(space):
+    # 不开启 VAE 分块时分块尺寸无意义，合并为一个候选
+    grid = []
+    keys = list(space)
+    for values in itertools.product(*(space[k] for k in keys)):
+        params = dict(zip(keys, values))
+        if params.get('vae_tiling') is False and 'vae_spatial_tile_sample_min_size' in params:
+            params['vae_spatial_tile_sample_min_size'] = None
+        if params not in grid: grid.append(params)
+    return grid
+
+
+def heavier_value(a, b):
+    # a 的显存占用不低于 b：数值越大越重，不分块（False / None）比分块重
+    if isinstance(a, bool) or isinstance(b, bool): return (not a) >= (not b)
+    if a is None: return True
+    if b is None: return False
+    return float(a) >= float(b)
+
+
+def heavier(params, other):
+    return all(heavier_value(params.get(k), other.get(k)) for k in other)
+
+
+def probe_label(params):
+    return ', '.join(f"{k}={v}" for k, v in params.items() if v is not None)
+
+
+def make_probe_dataset(task_data, folder, count):
+    # 从第一个有图片的数据集均匀抽取 count 张图片（及标注、同名控制图）组成探测数据集，缓存目录放在 folder 下
+    dataset = load_dataset_json(task_data.get('dataset_config'))
+    if not dataset: raise ValueError(f"DATASET CONFIG NOT FOUND: {task_data.get('dataset_config')}")
+    general = dataset.get('general', {})
+    for ds in dataset.get('datasets', []):
+        names = list_images(ds.get('image_directory'))
+        if names: break
+    else:
+        raise ValueError("DATASET HAS NO IMAGES")
+    picked = names[::max(1, len(names) // count)][:count]
+    caption_ext = ds.get('caption_extension', general.get('caption_extension', '.txt'))
+    shutil.rmtree(folder, ignore_errors=True)
+    image_dir, control_dir = os.path.join(folder, 'image'), os.path.join(folder, 'control')
+    os.makedirs(image_dir)
+
+    def place(src, dst_dir):
+        dst = os.path.join(dst_dir, os.path.basename(src))
+        try:
+            os.link(src, dst)
+        except OSError:
+            shutil.copy2(src, dst)
+
+    stems = set()
+    for name in picked:
+        stem = os.path.splitext(name)[0]
+        stems.add(stem)
+        place(os.path.join(ds['image_directory'], name), image_dir)
+        caption = os.path.join(ds['image_directory'], stem + caption_ext)
+        if os.path.exists(caption): place(caption, image_dir)
+    probe_ds = {**ds, 'image_directory': image_dir, 'cache_directory': os.path.join(folder, 'cache')}
+    if ds.get('control_directory'):
+        os.makedirs(control_dir)
+        for name in list_images(ds['control_directory']):
+            stem = os.path.splitext(name)[0]
+            if stem in stems or any(stem.startswith(s + '_') for s in stems):
+                place(os.path.join(ds['control_directory'], name), control_dir)
+        probe_ds['control_directory'] = control_dir
+    path = os.path.join(folder, 'dataset.json')
+    write_json_atomic(path, {'general': {**general, 'num_repeats': 1}, 'datasets': [probe_ds]})
+    signature = digest({"general": general, "dataset": {k: v for k, v in ds.items() if not k.endswith('_directory')},
+                        "images": len(picked)})
+    return {"path": path, "images": len(picked), "cache_dir": probe_ds['cache_directory'], "signature": signature}
+
+
+def probe_key(kind, params, task_data, base, sample, device):
+    # 模型文件、脚本、显卡、样本与其余缓存参数都不变时，同一组参数的探测结果可以复用
+    models = ('vae',) if kind == 'latents' else ('text_encoder',)
+    script = LATENTS_SCRIPT if kind == 'latents' else TEXT_ENC_SCRIPT
+    relevant = [k for k in CACHE_STEPS[kind][1] if k not in models and k != 'model_version']
+    if kind == 'text_encoder': relevant.append('batch_size')
+    return digest({"kind": kind, "params": params, "fixed": {k: base.get(k) for k in relevant if k not in params},
+                   "models": {k: [task_data.get(k), path_fingerprint(task_data.get(k) or '')] for k in models},
+                   "model_version": task_data.get('model_version'), "script": [script, path_fingerprint(script)],
+                   "host": platform.node(), "device": device, "gpu": gpu_identity(device),
+                   "sample": sample['signature']})
+
+
+def probe_rate(lines, images, elapsed):
+    # 优先用最后一个 tqdm 进度条的速率（不含模型加载时间），按 图片数/迭代数 换算成每秒图片数；没有进度条时按总耗时估算
+    for line in reversed(lines):
+        bar = TQDM_RE.search(line)
+        if not bar or not bar.group(5): continue
+        rate = float(bar.group(5))
+        if bar.group(6) == 's/it': rate = 1.0 / rate if rate else 0.0
+        total = int(bar.group(2))
+        return (round(rate * images / total, 3) if total else round(rate, 3)), 'tqdm'
+    return (round(images / elapsed, 3) if elapsed > 0 else 0.0), 'wall'
+
+
+class AutotuneCache:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = None
+
+    def _load(self):
+        if self._entries is None:
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f: self._entries = json.load(f)
+            except (OSError, ValueError):
+                self._entries = {}
+        return self._entries
+
+    def get(self, key):
+        with self._lock:
+            entry = self._load().get(key)
+            return copy.deepcopy(entry) if entry else None
+
+    def put(self, key, probe):
+        with self._lock:
+            entries = self._load()
+            entries[key] = probe
+            if len(entries) > AUTOTUNE_CACHE_LIMIT:
+                for k in sorted(entries, key=lambda k: entries[k]['measured_at'])[:len(entries) - AUTOTUNE_CACHE_LIMIT]:
+                    del entries[k]
+            write_json_atomic(self.path, entries)
+
+
+AUTOTUNE_CACHE = AutotuneCache(AUTOTUNE_CACHE_FILE)
+
+
+def run_probe(run, kind, params, task_data, base, sample, timeout):
+    cache_data = {**base, **params}
+    probe_task = {**task_data, 'dataset_config': sample['path']}
+    argv = dict(zip(CACHE_STEP_ORDER, (argv for _, argv in build_cache_commands(probe_task, cache_data))))[kind]
+    env = {"PYTHONUNBUFFERED": "1"}
+    if run.device is not None: env["CUDA_VISIBLE_DEVICES"] = str(run.device)
+    shutil.rmtree(sample['cache_dir'], ignore_errors=True)
+    os.makedirs(sample['cache_dir'], exist_ok=True)
+    timed_out = threading.Event()
+
+    def expire():
+        timed_out.set()
+        if run.process: kill_process_tree(run.process)
+
+    timer = threading.Timer(timeout, expire)
+    timer.daemon = True
+    seq = run.logs.last_seq
+    started = time.time()
+    timer.start()
+    try:
+        rc = run_step(run, {"argv": argv, "env": env}, f"PROBE {kind.upper()}: {probe_label(params)}")
+    except OSError as e:
+        run.log(f"\n❌ SYSTEM ERROR: {str(e)}\n")
+        rc = -1
+    finally:
+        timer.cancel()
+    elapsed = time.time() - started
+    lines = [line for _, line in run.logs.since(seq)]
+    probe = {"kind": kind, "params": params, "exit_code": rc, "seconds": round(elapsed, 2),
+             "images": sample['images'], "measured_at": time.time()}
+    if timed_out.is_set():
+        probe['failure'] = 'timeout'
+    elif rc != 0:
+        probe['failure'] = classify_failure(lines[-FAILURE_SCAN_LINES:], rc)['kind']
+    else:
+        probe['items_per_sec'], probe['rate_source'] = probe_rate(lines, sample['images'], elapsed)
+    probe['ok'] = 'failure' not in probe
+    return probe
+
+
+def describe_probe(probe):
+    if probe['ok']: return f"{probe['items_per_sec']} IMG/S ({probe['rate_source']})"
+    return f"FAILED: {probe['failure']}"
+
+
+def tune_cache_step(run, job, kind, task_data, base, sample, settings):
+    grid = candidate_grid(settings['grid'][kind])
+    if kind == 'text_encoder':
+        # 批量超过样本图片数时测不出差别
+        fits = [p for p in grid if int_or(p.get('batch_size'), 1) <= sample['images']]
+        grid = fits or grid[:1]
+    probes, failed = [], []
+    for params in grid:
+        if not run.is_running: break
+        label = f"{kind.upper()} [{probe_label(params)}]"
+        key = probe_key(kind, params, task_data, base, sample, run.device)
+        probe = None if job.get('force') else AUTOTUNE_CACHE.get(key)
+        if probe:
+            probe['cached'] = True
+            run.log(f"\n📋 PROBE {label}: CACHED, {describe_probe(probe)}\n")
+        elif any(heavier(params, f) for f in failed):
+            probe = {"kind": kind, "params": params, "ok": False, "failure": "skipped"}
+            run.log(f"\n⏭️ PROBE {label}: SKIPPED, A LIGHTER SETTING RAN OUT OF MEMORY\n")
+        else:
+            probe = run_probe(run, kind, params, task_data, base, sample, settings['probe_timeout'])
+            # 被用户停止的探测不可信，不缓存
+            if not run.is_running: break
+            AUTOTUNE_CACHE.put(key, probe)
+            run.log(f"\n📏 PROBE {label}: {describe_probe(probe)}\n")
+        if probe.get('failure') in MEMORY_FAILURES: failed.append(params)
+        probes.append(probe)
+    stable = [p for p in probes if p.get('ok')]
+    best = None
+    if stable:
+        fastest = max(p['items_per_sec'] for p in stable)
+        best = next(p for p in stable if p['items_per_sec'] >= fastest * (1 - AUTOTUNE_TOLERANCE))
+    return {"best": best, "probes": probes}
+
+
+def apply_autotune(task_name, target, chosen):
+    # target 为 'cache' 时写回全局 cache 段，为 'task' 时写入任务的 cache_overrides
+    with CONFIG_STORE.lock:
+        qwen_root = CONFIG_STORE.snapshot().get('qwen', {})
+        if target == 'task':
+            task_data = plain_value(qwen_root.get(task_name))
+            if not isinstance(task_data, dict): raise KeyError(f"TASK NOT FOUND: {task_name}")
+            task_data['cache_overrides'] = {**(task_data.get('cache_overrides') or {}), **chosen}
+            CONFIG_STORE.commit({task_name: task_data}, note='autotune')
+        else:
+            CONFIG_STORE.commit({'cache': {**(plain_value(qwen_root.get('cache')) or {}), **chosen}}, note='autotune')
+
+
+def run_autotune(job, run, config):
+    # 返回 (退出码, 结果)；0 表示每个缓存步骤都找到了可用参数
+    qwen_root = config.get('qwen', {})
+    task_name = job['task']
+    target = job.get('autotune_target', 'cache')
+    result = {"target": target, "apply": job.get('autotune_apply', True), "steps": {}, "chosen": None,
+              "applied": False}
+    rc = -1
+    if task_name not in qwen_root or task_name in IGNORED_SECTIONS:
+        run.log(f"\n❌ TASK NOT FOUND: {task_name}\n")
+        return rc, result
+    if run.slot.get('worker'):
+        # 探测数据集与结果缓存都在本机
+        run.log("\n❌ AUTOTUNE RUNS ON LOCAL SLOTS ONLY\n")
+        return rc, result
+    task_data = qwen_root[task_name]
+    settings = autotune_settings(qwen_root)
+    base = cache_settings(qwen_root, task_data)
+    folder = os.path.join(AUTOTUNE_DIR, job['id'])
+    try:
+        sample = make_probe_dataset(task_data, folder, settings['sample_images'])
+        run.log(f"\n🔬 AUTOTUNE [{task_name}]: {sample['images']} SAMPLE IMAGES, TARGET {target.upper()}\n")
+        for kind in CACHE_STEP_ORDER:
+            result['steps'][kind] = tune_cache_step(run, job, kind, task_data, base, sample, settings)
+            if not run.is_running: break
+        if run.is_running:
+            chosen = {}
+            for kind, step in result['steps'].items():
+                if step['best']:
+                    chosen.update({k: v for k, v in step['best']['params'].items() if v is not None})
+                    run.log(f"\n🏁 {kind.upper()}: {probe_label(step['best']['params'])}, "
+                            f"{describe_probe(step['best'])}\n")
+                else:
+                    run.log(f"\n⚠️ {kind.upper()}: NO STABLE SETTING FOUND, KEEPING CURRENT VALUES\n")
+            result['chosen'] = chosen
+            if chosen and result['apply']:
+                apply_autotune(task_name, target, chosen)
+                result['applied'] = True
+                where = 'CACHE SECTION' if target == 'cache' else f"{task_name}.cache_overrides"
+                run.log(f"\n💾 WROTE {probe_label(chosen)} TO {where}\n")
+            rc = 0 if all(step['best'] for step in result['steps'].values()) else 1
+        else:
+            run.log(f"\n🛑 STOPPED BY USER.\n")
+    except (OSError, ValueError, KeyError) as e:
+        run.log(f"\n❌ AUTOTUNE: {e.args[0] if e.args else e}\n")
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+    run.log("\n✨ ALL TASKS FINISHED.\n")
+    run.exit_code = rc
+    run.process = None
+    return rc, result
+
+
+@app.route('/autotune', methods=['POST'])
+def autotune():
+    data = request.get_json(silent=True) or {}
+    task_name = data.get('task')
+    qwen_root = CONFIG_STORE.snapshot().get('qwen', {})
+    if not task_name or task_name in IGNORED_SECTIONS or task_name not in qwen_root: return jsonify(
+        {"status": "error", "message": "Not found"}), 404
+    target = data.get('target', 'cache')
+    if target not in AUTOTUNE_TARGETS: return jsonify({"status": "error", "message": "Unknown target"}), 400
+    try:
+        job = JOB_QUEUE.enqueue(task_name, 'autotune', data.get('priority', 0), force=bool(data.get('force')),
+                                autotune_target=target, autotune_apply=data.get('apply', True) is not False)
+    except (TypeError, ValueError):
+        return jsonify({"status": "error", "message": "Bad priority"}), 400
+    JOB_QUEUE.start()
+    return jsonify({"status": "success", "job": job})
+
+
+@app.route('/autotune_results')
+def autotune_results():
+    # 任务最近一次调优的结果
+    task_name = request.args.get('task')
+    jobs = [j for j in JOB_QUEUE.list() if j['action'] == 'autotune' and j['task'] == task_name]
+    if not jobs: return jsonify({"status": "error", "message": "Not found"}), 404
+    job = max(jobs, key=lambda j: j['created_at'])
+    return jsonify({"status": "success", "job_id": job['id'], "state": job['state'],
+                    "finished_at": job['finished_at'], "result": job.get('autotune')})
+
+
+# --- 超参数扫描 ---
+# 基于一个任务按网格/随机组合派生多个任务：一次写入 YAML，共用基础任务的数据集 JSON，并依次排入队列
+SWEEP_FILE = os.path.join(STATE_DIR, 'sweeps.json')
+SWEEP_MAX_TASKS = 100
+SWEEP_FIXED_KEYS = {'output_name', 'output_dir', 'dataset_config', 'sample_prompts'}
+SWEEP_LOCK = threading.Lock()
+
+
+def load_sweeps():
+    if not os.path.exists(SWEEP_FILE): return {}
+    with open(SWEEP_FILE, 'r', encoding='utf-8') as f: return json.load(f)
+
+
+def sample_param(rng, spec):
+    # 列表：随机取一个；{"min","max","log","int"}：在区间内采样
+    if isinstance(spec, list): return rng.choice(spec)
+    lo, hi = float(spec['min']), float(spec['max'])
+    value = math.exp(rng.uniform(math.log(lo), math.log(hi))) if spec.get('log') else rng.uniform(lo, hi)
+    return int(round(value)) if spec.get('int') else float(f"{value:.6g}")
+
+
+def expand_sweep(grid=None, random_spec=None):
+    combos = []
+    if grid:
+        keys = sorted(grid)
+        combos.extend(dict(zip(keys, values)) for values in itertools.product(*(grid[k] for k in keys)))
+    if random_spec:
+        rng = random.Random(random_spec.get('seed'))
+        params = random_spec.get('params', {})
+        for _ in range(int(random_spec.get('count', 0))):
+            combos.append({k: sample_param(rng, params[k]) for k in sorted(params)})
+    return combos
+
+
+@app.route('/create_sweep', methods=['POST'])
+def create_sweep():
+    try:
+        data = request.json or {}
+        base_name = data.get('base_task')
+        grid = data.get('grid') or {}
+        random_spec = data.get('random') or {}
+        keys = set(grid) | set(random_spec.get('params', {}))
+        bad = sorted(k for k in keys if k not in VISIBLE_TASK_KEYS or k in SWEEP_FIXED_KEYS)
+        if bad: return jsonify({"status": "error", "message": f"Unsupported keys: {', '.join(bad)}"}), 400
+        if data.get('name') is not None and not valid_task_name(data['name']): return jsonify(
+            {"status": "error", "message": "Invalid name"}), 400
+        combos = expand_sweep(grid, random_spec)
+        if not combos: return jsonify({"status": "error", "message": "Empty sweep"}), 400
+        if len(combos) > SWEEP_MAX_TASKS: return jsonify(
+            {"status": "error", "message": f"Too many tasks ({len(combos)} > {SWEEP_MAX_TASKS})"}), 400
+
+        with SWEEP_LOCK, CONFIG_STORE.lock:
+            qwen = CONFIG_STORE.snapshot().get('qwen', {})
+            if not base_name or base_name not in qwen or base_name in IGNORED_SECTIONS: return jsonify(
+                {"status": "error", "message": "Source missing"}), 400
+            sweeps = load_sweeps()
+            counter = 1
+            prefix = data.get('name') or f"{base_name}_sweep{counter}"
+            while not data.get('name') and (prefix in sweeps or any(k.startswith(prefix + '_') for k in qwen)):
+                counter += 1
+                prefix = f"{base_name}_sweep{counter}"
+            names = [f"{prefix}_{i + 1:02d}" for i in range(len(combos))]
+            if prefix in sweeps or any(n in qwen for n in names): return jsonify(
+                {"status": "error", "message": "Exists"}), 400
+
+            base = qwen[base_name]
+            changes = {}
+            for name, params in zip(names, combos):
+                task_data = copy.deepcopy(base)
+                for key, value in params.items(): task_data[key] = value
+                task_data['output_name'] = name
+                task_data['output_dir'] = f"./output/{name}"
+                changes[name] = task_data
+            CONFIG_STORE.commit(changes, expect={name: None for name in names}, note='sweep')
+
+            sweep = {"id": prefix, "base_task": base_name, "created_at": time.time(), "tasks": []}
+            action = data.get('action', 'train')
+            for name, params in zip(names, combos):
+                item = {"task": name, "params": params, "job_id": None}
+                if data.get('queue', True) and action in JOB_ACTIONS:
+                    item['job_id'] = JOB_QUEUE.enqueue(name, action, data.get('priority', 0), sweep=prefix)['id']
+                sweep['tasks'].append(item)
+            sweeps[prefix] = sweep
+            write_json_atomic(SWEEP_FILE, sweeps)
+        JOB_QUEUE.start()
+        return jsonify({"status": "success", "sweep": sweep})
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+
+@app.route('/sweep_summary')
+def sweep_summary():
+    sweep_id = request.args.get('sweep')
+    try:
+        sweeps = load_sweeps()
+    except (OSError, ValueError) as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+    if not sweep_id: return jsonify({"status": "success", "sweeps": [
+        {"id": s['id'], "base_task": s['base_task'], "created_at": s['created_at'], "count": len(s['tasks'])}
+        for s in sweeps.values()]})
+    sweep = sweeps.get(sweep_id)
+    if not sweep: return jsonify({"status": "error", "message": "Not found"}), 404
+
+    rows = []
+    for item in sweep['tasks']:
+        job = JOB_QUEUE.get(item['job_id']) if item.get('job_id') else None
+        run = EXECUTOR.get(item['job_id']) if item.get('job_id') else None
+        metrics = dict(run.metrics.progress) if run else (job or {}).get('metrics') or {}
+        started, finished = (job or {}).get('started_at'), (job or {}).get('finished_at')
+        rows.append({**item, "state": job['state'] if job else None, "exit_code": (job or {}).get('exit_code'),
+                     "duration": (finished or time.time()) - started if started else None,
+                     "final_loss": metrics.get('loss'), "step": metrics.get('step'), "total": metrics.get('total')})
+    ranked = sorted((r for r in rows if r['final_loss'] is not None), key=lambda r: r['final_loss'])
+    return jsonify({"status": "success", "sweep": {k: v for k, v in sweep.items() if k != 'tasks'},
+                    "tasks": rows, "best": ranked[0]['task'] if ranked else None})
+
+
+# --- 输出画廊 ---
+# 按任务索引 output_dir 中的检查点与 sample 目录中的样图：目录 mtime 未变时复用索引，检查点元数据只读 JSON 头，
+# 样图缩略图在进程池中生成并缓存到磁盘；后台线程轮询输出目录，为新样图预先生成缩略图
+OUTPUT_POLL_INTERVAL = 10
+SAMPLE_SUBDIR = 'sample'
+THUMB_DIR = os.path.join(STATE_DIR, 'thumbs')
+THUMB_SIZE = 256
+THUMB_WORKERS = max(1, min(4, (os.cpu_count() or 2) // 2))
+GALLERY_PAGE_SIZE = 50
+GALLERY_MAX_PAGE_SIZE = 500
+SAFETENSORS_MAX_HEADER = 100 * 1024 * 1024
+SAMPLE_EPOCH_RE = re.compile(r'_e(\d+)')
+CHECKPOINT_EPOCH_RE = re.compile(r'-(\d+)\.safetensors$')
+# safetensors __metadata__ 键 -> 返回字段
+CHECKPOINT_META_KEYS = {'ss_epoch': 'epoch', 'ss_steps': 'steps', 'ss_network_dim': 'dim',
+                        'ss_network_alpha': 'alpha', 'ss_training_comment': 'comment',
+                        'ss_network_module': 'network_module', 'ss_learning_rate': 'learning_rate'}
+
+
+def read_safetensors_header(path):
+    # 前 8 字节为小端 u64 头长度，随后是 JSON 头；通过 mmap 只触及头部所在的页，不读取张量数据
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size < 8: raise ValueError("Not a safetensors file")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            (length,) = struct.unpack_from('<Q', mm, 0)
+            if length > SAFETENSORS_MAX_HEADER: raise ValueError("Header too large")
+            if 8 + length > len(mm): raise ValueError("Truncated header")
+            return json.loads(mm[8:8 + length])
+
+
+def make_thumbnail(src, dst, size=THUMB_SIZE):
+    # 在进程池中执行
+    with Image.open(src) as im:
+        im.thumbnail((size, size))
+        im = im.convert('RGB')
+        tmp = f"{dst}.{os.getpid()}.tmp"
+        im.save(tmp, 'JPEG', quality=85)
+    os.replace(tmp, dst)
+    return dst
+
+
+class OutputIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._dirs = {}
+        self._meta = {}
+
+    def scan(self, folder, extensions):
+        # 返回 {文件名: (size, mtime)}，按目录 mtime 失效
+        folder = os.path.abspath(folder)
+        try:
+            dir_mtime = os.stat(folder).st_mtime_ns
+        except OSError:
+            return {}
+        key = (folder, extensions)
+        with self._lock: cached = self._dirs.get(key)
+        if cached and cached[0] == dir_mtime: return cached[1]
+        entries = {}
+        with os.scandir(folder) as it:
+            for e in it:
+                if not e.is_file() or os.path.splitext(e.name)[1].lower() not in extensions: continue
+                st = e.stat()
+                entries[e.name] = (st.st_size, st.st_mtime_ns)
+        with self._lock: self._dirs[key] = (dir_mtime, entries)
+        return entries
+
+    def checkpoints(self, task_data):
+        output_dir, output_name = task_data.get('output_dir'), task_data.get('output_name')
+        if not output_dir or not output_name: return {}
+        return {name: st for name, st in self.scan(output_dir, ('.safetensors',)).items()
+                if name.startswith(output_name)}
+
+    def samples(self, task_data):
+        output_dir = task_data.get('output_dir')
+        if not output_dir: return {}
+        return self.scan(os.path.join(output_dir, SAMPLE_SUBDIR), tuple(IMAGE_EXTENSIONS))
+
+    def metadata(self, path, stat):
+        # 按 (路径, size, mtime) 缓存，文件被覆盖后重新读取
+        key = (os.path.abspath(path), stat)
+        with self._lock:
+            if key in self._meta: return self._meta[key]
+        try:
+            meta = read_safetensors_header(path).get('__metadata__') or {}
+            result = {field: meta[k] for k, field in CHECKPOINT_META_KEYS.items() if k in meta}
+        except (OSError, ValueError) as e:
+            result = {"error": str(e)}
+        with self._lock: self._meta[key] = result
+        return result
+
+
+OUTPUT_INDEX = OutputIndex()
+
+
+def thumbnail_path(path, stat):
+    key = hashlib.sha1(f"{os.path.abspath(path)}|{stat[0]}|{stat[1]}".encode()).hexdigest()
+    return os.path.join(THUMB_DIR, f"{key}.jpg")
+
+
+class ThumbnailWorker:
+    # 进程池懒创建；同一缩略图只提交一次
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pending = {}
+
+    def submit(self, src, dst):
+        with self._lock:
+            future = self._pending.get(dst)
+            if future: return future
+            if self._pool is None:
+                os.makedirs(THUMB_DIR, exist_ok=True)
+                self._pool = ProcessPoolExecutor(max_workers=THUMB_WORKERS)
+            future = self._pool.submit(make_thumbnail, src, dst)
+            self._pending[dst] = future
+        future.add_done_callback(lambda _: self._forget(dst))
+        return future
+
+    def _forget(self, dst):
+        with self._lock: self._pending.pop(dst, None)
+
+
+THUMBNAILS = ThumbnailWorker()
+
+
+class OutputWatcher:
+    # 轮询所有任务的输出目录；由第一次画廊请求启动
+    def __init__(self, interval=OUTPUT_POLL_INTERVAL):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self._thread and self._thread.is_alive(): return
+            self._thread = threading.Thread(target=self._loop, name='output-watcher', daemon=True)
+            self._thread.start()
+
+    def _loop(self):
+        while True:
+            try:
+                self.poll()
+            except Exception as e:
+                print(f"Output Watcher Error: {e}")
+            time.sleep(self.interval)
+
+    def poll(self):
+        qwen_root = CONFIG_STORE.snapshot().get('qwen', {})
+        for name, task_data in list(qwen_root.items()):
+            if name in IGNORED_SECTIONS or not isinstance(task_data, dict): continue
+            OUTPUT_INDEX.checkpoints(task_data)
+            if Image is None: continue
+            folder = os.path.join(task_data.get('output_dir') or '', SAMPLE_SUBDIR)
+            for sample, stat in OUTPUT_INDEX.samples(task_data).items():
+                src = os.path.join(folder, sample)
+                dst = thumbnail_path(src, stat)
+                if not os.path.exists(dst): THUMBNAILS.submit(src, dst)
+
+
+OUTPUT_WATCHER = OutputWatcher()
+
+
+def gallery_task(task_name):
+    qwen_root = CONFIG_STORE.snapshot().get('qwen', {})
+    if not task_name or task_name in IGNORED_SECTIONS or task_name not in qwen_root: return None
+    return qwen_root[task_name]
+
+
+def parse_epoch(regex, name):
+    match = regex.search(name)
+    return int(match.group(1)) if match else None
+
+
+@app.route('/outputs')
+def outputs():
+    task_name = request.args.get('task')
+    task_data = gallery_task(task_name)
+    if task_data is None: return jsonify({"status": "error", "message": "Not found"}), 404
+    kind = request.args.get('kind', 'checkpoints')
+    if kind not in ('checkpoints', 'samples'): return jsonify({"status": "error", "message": "Unknown kind"}), 400
+    try:
+        page = max(1, int(request.args.get('page', 1)))
+        per_page = max(1, min(int(request.args.get('per_page', GALLERY_PAGE_SIZE)), GALLERY_MAX_PAGE_SIZE))
+    except ValueError:
+        return jsonify({"status": "error", "message": "Bad page"}), 400
+    OUTPUT_WATCHER.start()
+
+    entries = OUTPUT_INDEX.checkpoints(task_data) if kind == 'checkpoints' else OUTPUT_INDEX.samples(task_data)
+    names = sorted(entries, key=lambda n: (entries[n][1], n), reverse=True)
+    items = []
+    for name in names[(page - 1) * per_page:page * per_page]:
+        size, mtime = entries[name]
+        item = {"name": name, "size": size, "mtime": mtime / 1e9}
+        if kind == 'checkpoints':
+            item["epoch"] = parse_epoch(CHECKPOINT_EPOCH_RE, name)
+            item.update(OUTPUT_INDEX.metadata(os.path.join(task_data['output_dir'], name), entries[name]))
+        else:
+            item["epoch"] = parse_epoch(SAMPLE_EPOCH_RE, name)
+            # 带上 mtime，样图被覆盖后浏览器缓存随之失效
+            item["thumb"] = url_for('output_thumb', task=task_name, name=name, v=mtime)
+        items.append(item)
+    return jsonify({"status": "success", "task": task_name, "kind": kind, "page": page, "per_page": per_page,
+                    "total": len(entries), "thumbnails": Image is not None, "items": items})
+
+
+@app.route('/output_file')
+def output_file():
+    task_data = gallery_task(request.args.get('task'))
+    name = request.args.get('name', '')
+    if task_data is None: return jsonify({"status": "error", "message": "Not found"}), 404
+    kind = request.args.get('kind', 'samples')
+    entries = OUTPUT_INDEX.checkpoints(task_data) if kind == 'checkpoints' else OUTPUT_INDEX.samples(task_data)
+    if name not in entries: return jsonify({"status": "error", "message": "Not found"}), 404
+    folder = task_data['output_dir'] if kind == 'checkpoints' else os.path.join(task_data['output_dir'], SAMPLE_SUBDIR)
+    return send_from_directory(os.path.abspath(folder), name, as_attachment=(kind == 'checkpoints'))
+
+
+@app.route('/output_thumb')
+def output_thumb():
+    task_data = gallery_task(request.args.get('task'))
+    name = request.args.get('name', '')
+    if task_data is None: return jsonify({"status": "error", "message": "Not found"}), 404
+    entries = OUTPUT_INDEX.samples(task_data)
+    if name not in entries: return jsonify({"status": "error", "message": "Not found"}), 404
+    folder = os.path.abspath(os.path.join(task_data['output_dir'], SAMPLE_SUBDIR))
+    if Image is None: return send_from_directory(folder, name)
+    src = os.path.join(folder, name)
+    dst = thumbnail_path(src, entries[name])
+    if not os.path.exists(dst):
+        try:
+            THUMBNAILS.submit(src, dst).result(timeout=30)
+        except Exception as e:
+            return jsonify({"status": "error", "message": str(e)}), 500
+    response = send_from_directory(os.path.abspath(THUMB_DIR), os.path.basename(dst))
+    response.headers['Cache-Control'] = 'max-age=86400'
+    return response
+
+
+# --- 启动前检查 ---
+# 训练前只读模型文件的 safetensors 头：校验路径与模型类型是否匹配，按 global_config 的精度参数估算 DiT 常驻显存，
+# 并给出满足显存预算的 blocks_to_swap；解析结果按文件 (size, mtime) 缓存
+SAFETENSORS_DTYPE_BYTES = {'F64': 8, 'I64': 8, 'U64': 8, 'F32': 4, 'I32': 4, 'U32': 4, 'F16': 2, 'BF16': 2,
+                           'I16': 2, 'U16': 2, 'F8_E4M3': 1, 'F8_E5M2': 1, 'I8': 1, 'U8': 1, 'BOOL': 1}
+PRECISION_BYTES = {'bf16': 2, 'fp16': 2, 'no': 4, 'fp32': 4}
+BLOCK_RE = re.compile(r'^(?:model\.diffusion_model\.)?transformer_blocks\.(\d+)\.')
+# 激活、LoRA 参数与 CUDA 上下文的粗略余量（开启 gradient_checkpointing 时）
+PREFLIGHT_OVERHEAD_GB = float(os.environ.get('MUSUBI_PREFLIGHT_OVERHEAD_GB', 6))
+PREFLIGHT_VRAM_GB = os.environ.get('MUSUBI_VRAM_GB')
+# 模型角色 -> 用于识别的键前缀
+MODEL_ROLES = {
+    'dit': ('transformer_blocks.', 'model.diffusion_model.transformer_blocks.'),
+    'vae': ('encoder.', 'decoder.', 'first_stage_model.'),
+    'text_encoder': ('model.layers.', 'model.language_model.', 'language_model.'),
+}
+VISUAL_PREFIXES = ('visual.', 'model.visual.')
+GIB = 1024 ** 3
+
+
+def summarize_safetensors(path):
+    header = read_safetensors_header(path)
+    tensors = {k: v for k, v in header.items() if k != '__metadata__'}
+    by_dtype, blocks = {}, {}
+    other = [0, 0]
+    total_bytes = total_params = 0
+    for name, info in tensors.items():
+        shape = info.get('shape') or []
+        numel = math.prod(shape)
+        start, end = info.get('data_offsets', (0, 0))
+        by_dtype[info.get('dtype')] = by_dtype.get(info.get('dtype'), 0) + end - start
+        total_bytes += end - start
+        total_params += numel
+        match = BLOCK_RE.match(name)
+        bucket = blocks.setdefault(int(match.group(1)), [0, 0]) if match else other
+        bucket[0 if len(shape) >= 2 else 1] += numel
+    return {
+        "tensors": len(tensors), "params": total_params, "bytes": total_bytes, "bytes_by_dtype": by_dtype,
+        # 每个 block 的 (矩阵参数量, 其余参数量)；fp8 只作用于矩阵权重
+        "blocks": [blocks[i] for i in sorted(blocks)],
+        "other": other,
+        "roles": [role for role, prefixes in MODEL_ROLES.items() if any(k.startswith(prefixes) for k in tensors)],
+        "has_visual": any(k.startswith(VISUAL_PREFIXES) for k in tensors),
+        "metadata": header.get('__metadata__') or {},
+    }
+
+
+class HeaderCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def get(self, path):
+        fp = path_fingerprint(path)
+        if fp is None: raise FileNotFoundError(path)
+        key = os.path.abspath(path)
+        with self._lock: cached = self._entries.get(key)
+        if cached and cached[0] == fp: return cached[1]
+        summary = summarize_safetensors(path)
+        with self._lock: self._entries[key] = (fp, summary)
+        return summary
+
+
+HEADER_CACHE = HeaderCache()
+
+
+def dit_memory(summary, args, blocks_to_swap):
+    # 返回 DiT 常驻字节数：fp8_base 时矩阵权重按 1 字节计，其余按 mixed_precision 计；被换出的 block 不计入
+    weight_bytes = 1 if args.get('fp8_base') else PRECISION_BYTES.get(str(args.get('mixed_precision', 'bf16')), 2)
+    other_bytes = PRECISION_BYTES.get(str(args.get('mixed_precision', 'bf16')), 2)
+    blocks = summary['blocks']
+    resident = blocks[:len(blocks) - max(0, min(blocks_to_swap, len(blocks)))]
+    total = summary['other'][0] * weight_bytes + summary['other'][1] * other_bytes
+    total += sum(m * weight_bytes + o * other_bytes for m, o in resident)
+    if blocks_to_swap and blocks:
+        # 换入换出需要在显存中保留一个 block 的缓冲
+        total += max(m * weight_bytes + o * other_bytes for m, o in blocks)
+    return total
+
+
+def int_or(value, default):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def preflight(config, task_name, vram_gb=None):
+    # 返回 {"errors", "warnings", "models", "memory"}；errors 非空时训练一定会失败
+    qwen_root = config.get('qwen', {})
+    if task_name not in qwen_root or task_name in IGNORED_SECTIONS: raise KeyError(f"TASK NOT FOUND: {task_name}")
+    global_config = qwen_root.get('global_config', qwen_root.get('golbal_config', {}))
+    args = {**global_config, **qwen_root[task_name]}
+    model_version = str(args.get('model_version') or '')
+    errors, warnings, models, summaries = [], [], {}, {}
+
+    for role in ('dit', 'vae', 'text_encoder'):
+        path = args.get(role)
+        if not path:
+            errors.append(f"{role}: not set")
+            continue
+        try:
+            summary = HEADER_CACHE.get(path)
+        except FileNotFoundError:
+            errors.append(f"{role}: file not found: {path}")
+            continue
+        except (OSError, ValueError) as e:
+            errors.append(f"{role}: unreadable safetensors header: {e}")
+            continue
+        summaries[role] = summary
+        models[role] = {k: summary[k] for k in ('tensors', 'params', 'bytes', 'bytes_by_dtype', 'roles', 'has_visual')}
+        models[role]["path"] = path
+        models[role]["blocks"] = len(summary['blocks'])
+        if summary['roles'] and role not in summary['roles']:
+            warnings.append(f"{role}: looks like a {'/'.join(summary['roles'])} checkpoint")
+        if role == 'text_encoder' and model_version.startswith('edit') and not summary['has_visual']:
+            errors.append("text_encoder: edit models need Qwen2.5-VL vision weights (visual.*), none found")
+
+    if args.get('fp8_scaled') and not args.get('fp8_base'): warnings.append("fp8_scaled has no effect without fp8_base")
+    memory = None
+    dit = summaries.get('dit')
+    if dit and dit['blocks']:
+        swap = int_or(args.get('blocks_to_swap'), 0)
+        max_swap = len(dit['blocks']) - 2
+        overhead = PREFLIGHT_OVERHEAD_GB * GIB
+        memory = {"blocks_to_swap": swap, "max_blocks_to_swap": max_swap, "overhead_bytes": int(overhead),
+                  "dit_bytes": dit_memory(dit, args, swap), "suggested_blocks_to_swap": None}
+        memory["estimated_bytes"] = memory["dit_bytes"] + int(overhead)
+        if swap > max_swap: errors.append(f"blocks_to_swap={swap} exceeds the maximum {max_swap}")
+        if vram_gb:
+            budget = float(vram_gb) * GIB
+            memory["budget_bytes"] = int(budget)
+            fits = [n for n in range(0, max_swap + 1) if dit_memory(dit, args, n) + overhead <= budget]
+            memory["suggested_blocks_to_swap"] = fits[0] if fits else None
+            if not fits:
+                warnings.append(f"DiT does not fit in {vram_gb} GB even with blocks_to_swap={max_swap}")
+            elif swap < fits[0]:
+                warnings.append(f"blocks_to_swap={swap} likely runs out of memory; try {fits[0]}")
+    return {"errors": errors, "warnings": warnings, "models": models, "memory": memory}
+
+
+@app.route('/preflight')
+def preflight_api():
+    task_name = request.args.get('task')
+    try:
+        vram_gb = float(request.args.get('vram_gb') or PREFLIGHT_VRAM_GB or 0) or None
+    except ValueError:
+        return jsonify({"status": "error", "message": "Bad vram_gb"}), 400
+    try:
+        result = preflight(CONFIG_STORE.snapshot(), task_name, vram_gb)
+    except KeyError:
+        return jsonify({"status": "error", "message": "Not found"}), 404
+    return jsonify({"status": "success", "task": task_name, "ok": not result['errors'], **result})
+
+
+# --- 任务概览 ---
+# 一次返回所有任务的关键参数、数据集路径、最近一次运行与检查点数量；ETag 由 config.yaml、各数据集 JSON、
+# 输出目录的 mtime 与队列版本组成，内容未变化时轮询请求直接得到 304
+SUMMARY_KEYS = ('model_version', 'lora', 'learning_rate', 'optimizer_type', 'network_dim', 'network_alpha',
+                'max_train_epochs', 'blocks_to_swap', 'timestep_sampling', 'output_dir', 'output_name')
+SUMMARY_CACHE = {"etag": None, "body": None}
+SUMMARY_LOCK = threading.Lock()
+
+
+def task_summary_etag(qwen_root, tasks):
+    stamps = [CONFIG_STORE.version_stamp(), JOB_QUEUE.version]
+    for name in tasks:
+        task_data = qwen_root[name]
+        stamps.append([name, path_fingerprint(task_data.get('dataset_config')),
+                       path_fingerprint(task_data.get('output_dir'))])
+    return digest(stamps)
+
+
+def build_task_summaries(qwen_root, tasks):
+    last_jobs = {}
+    for job in JOB_QUEUE.list():
+        if job['action'] in JOB_ACTIONS and job['task'] not in last_jobs: last_jobs[job['task']] = job
+    summaries = []
+    for name in tasks:
+        task_data = qwen_root[name]
+        try:
+            dataset = load_dataset_json(task_data.get('dataset_config')) or {}
+        except ValueError:
+            dataset = {}
+        job = last_jobs.get(name)
+        last_run = None
+        if job:
+            started, finished = job.get('started_at'), job.get('finished_at')
+            last_run = {"job_id": job['id'], "action": job['action'], "state": job['state'],
+                        "exit_code": job.get('exit_code'), "started_at": started, "finished_at": finished,
+                        "duration": finished - started if started and finished else None}
+        summaries.append({
+            "task": name,
+            "params": {k: task_data.get(k) for k in SUMMARY_KEYS if k in task_data},
+            "dataset_config": task_data.get('dataset_config'),
+            "datasets": [{k: ds.get(k) for k in ('image_directory', 'control_directory', 'cache_directory')
+                          if ds.get(k)} for ds in dataset.get('datasets', [])],
+            "last_run": last_run,
+            "checkpoints": len(OUTPUT_INDEX.checkpoints(task_data)),
+        })
+    return summaries
+
+
+@app.route('/task_summaries')
+def task_summaries():
+    # 运行中任务的进度不计入 ETag，实时状态请使用 /task_status
+    qwen_root = CONFIG_STORE.snapshot().get('qwen', {})
+    tasks = [k for k in qwen_root.keys() if k not in IGNORED_SECTIONS]
+    etag = task_summary_etag(qwen_root, tasks)
+    if etag in request.if_none_match:
+        response = app.response_class(status=304)
+    else:
+        with SUMMARY_LOCK:
+            if SUMMARY_CACHE['etag'] != etag:
+                SUMMARY_CACHE['body'] = json.dumps({"status": "success", "tasks": build_task_summaries(qwen_root, tasks)},
+                                                   ensure_ascii=False, default=str)
+                SUMMARY_CACHE['etag'] = etag
+            body = SUMMARY_CACHE['body']
+        response = app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+# --- JSON 读写 ---
+@app.route('/get_json_config')
+def get_json_config():
+    task_name = request.args.get('task')
+    if not task_name: return jsonify({"status": "error"}), 400
+    json_path = f"./src/{task_name}.json"
+    if not os.path.exists(json_path): return jsonify({"status": "error", "message": "Not found"}), 404
+    try:
+        with open(json_path, 'r', encoding='utf-8') as f:
+            return jsonify({"status": "success", "data": json.load(f)})
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+
+@app.route('/save', methods=['POST'])
+def save():
+    with CONFIG_STORE.lock:
+        try:
+            data = request.json
+            current_task_id = data.get('task_name')
+            full_config = load_full_yaml()
+
+            if current_task_id == '__NEW__':
+                task_config = {}
+            else:
+                if 'qwen' not in full_config or current_task_id not in full_config['qwen']: return jsonify(
+                    {"status": "error"}), 404
+                task_config = full_config['qwen'][current_task_id]
+            # 携带版本号时拒绝基于过期内容的保存（旧客户端不带版本，不做检查）
+            expect = {current_task_id: data['version']} if data.get('version') and current_task_id != '__NEW__' else {}
+            CONFIG_STORE.check(expect)
+
+            new_output_name = None
+
+            # 1. 更新 YAML
+            for flat_key, value in data.get('yaml_updates', {}).items():
+                key = flat_key.split('.')[-1]
+                if key not in VISIBLE_TASK_KEYS: continue
+                if key == 'output_name': new_output_name = value
+                orig_val = task_config.get(key)
+                if value == "" and orig_val is None: continue
+                if isinstance(orig_val, bool) or (current_task_id == '__NEW__' and value in [True, False]):
+                    task_config[key] = bool(value)
+                elif (isinstance(orig_val, int) and not isinstance(orig_val, bool)) or (
+                        current_task_id == '__NEW__' and isinstance(value, int)):
+                    try:
+                        task_config[key] = int(value)
+                    except:
+                        task_config[key] = value
+                elif isinstance(orig_val, float):
+                    try:
+                        task_config[key] = float(value)
+                    except:
+                        task_config[key] = value
+                else:
+                    if isinstance(value, str): value = value.replace('\\', '/')
+                    task_config[key] = value
+
+            if not new_output_name: return jsonify({"status": "error"}), 400
+            if new_output_name != current_task_id and not valid_task_name(new_output_name): return jsonify(
+                {"status": "error", "message": "Invalid name"}), 400
+
+            if current_task_id == '__NEW__': task_config['output_dir'] = f"./output/{new_output_name}"
+
+            # 2. 保存 JSON 文件
+            if not os.path.exists("./src"): os.makedirs("./src")
+            json_path = f"./src/{new_output_name}.json"
+
+            json_data = data.get('json_data', {})
+            with open(json_path, 'w', encoding='utf-8') as f:
+                json.dump(json_data, f, indent=2, ensure_ascii=False)
+
+            task_config['dataset_config'] = json_path
+            task_config['sample_prompts'] = json_path
+
+            # 3. 更新 Task ID
+            final_task_id = current_task_id
+            changes = {current_task_id: task_config}
+            if current_task_id == '__NEW__':
+                if new_output_name in full_config['qwen']: return jsonify({"status": "error", "message": "Exists"}), 400
+                changes = {new_output_name: task_config}
+                expect[new_output_name] = None
+                final_task_id = new_output_name
+            elif new_output_name != current_task_id:
+                if new_output_name not in full_config['qwen']:
+                    changes = {current_task_id: None, new_output_name: task_config}
+                    expect[new_output_name] = None
+                    final_task_id = new_output_name
+
+            versions = CONFIG_STORE.commit(changes, expect, note='save')
+            return jsonify({"status": "success", "message": "SAVED", "new_task_id": final_task_id,
+                            "version": versions[final_task_id]})
+        except StaleVersion as e:
+            return stale_response(e)
+        except Exception as e:
+            return jsonify({"status": "error", "message": str(e)}), 500
+
+
+# --- 配置历史 ---
+def diff_task(before, after):
+    before, after = before or {}, after or {}
+    return {"set": {k: v for k, v in after.items() if k not in before or not same_value(before[k], v)},
+            "unset": [k for k in before if k not in after]}
+
+
+@app.route('/config_history')
+def config_history():
+    task_name = request.args.get('task')
+    if not task_name: return jsonify({"status": "error", "message": "Missing task"}), 400
+    with CONFIG_STORE.lock:
+        current = CONFIG_STORE.versions([task_name])[task_name]
+        entries = CONFIG_STORE.journal.entries(task_name)
+        pending = {e['seq'] for e in CONFIG_STORE.journal.pending}
+    history = [{"seq": e['seq'], "ts": e['ts'], "txn": e.get('txn'), "note": e.get('note'),
+                "version": task_version(e['after']), "deleted": e['after'] is None, "created": e['before'] is None,
+                "compacted": e['seq'] not in pending, "conflict": bool(e.get('conflict')),
+                **diff_task(e['before'], e['after'])} for e in reversed(entries)]
+    return jsonify({"status": "success", "task": task_name, "version": current, "history": history})
+
+
+@app.route('/config_rollback', methods=['POST'])
+def config_rollback():
+    # 把任务恢复到某条历史记录之后（to=after，默认）或之前（to=before）的内容，本身也作为一条新记录写入
+    data = request.json or {}
+    task_name = data.get('task')
+    try:
+        seq = int(data.get('seq'))
+    except (TypeError, ValueError):
+        return jsonify({"status": "error", "message": "Bad seq"}), 400
+    with CONFIG_STORE.lock:
+        entry = next((e for e in CONFIG_STORE.journal.entries(task_name) if e['seq'] == seq), None)
+        if not entry: return jsonify({"status": "error", "message": "Not found"}), 404
+        target = entry['before'] if data.get('to') == 'before' else entry['after']
+        expect = {task_name: data['version']} if data.get('version') else None
+        try:
+            versions = CONFIG_STORE.commit({task_name: target}, expect, note=f"rollback:{seq}")
+        except StaleVersion as e:
+            return stale_response(e)
+    return jsonify({"status": "success", "task": task_name, "version": versions[task_name]})
+
+
+@app.route('/config_compact', methods=['POST'])
+def config_compact():
+    return jsonify({"status": "success", "compacted": CONFIG_STORE.compact()})
 
 
 if __name__ == '__main__':
+    # debug 模式下 reloader 的父进程不处理请求，只在实际服务的子进程中启动调度线程
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true': JOB_QUEUE.start()
     app.run(debug=True, port=5000)
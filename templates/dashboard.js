@@ -14,12 +14,14 @@ document.addEventListener('DOMContentLoaded', () => {
     });
 });
 
-let currentStreamId = 0;
+// STOP 按钮对应的任务：本页启动的任务，或页面加载时最近一个正在运行的任务
+let currentJobId = null;
 
 async function checkTaskStatus() {
     try {
         const res = await fetch('/task_status');
         const json = await res.json();
+        currentJobId = json.is_running ? json.job_id : null;
         const stopBtn = document.getElementById('stop-btn');
         if (stopBtn) {
             if (json.is_running) stopBtn.style.display = 'inline-block';
@@ -28,83 +30,25 @@ async function checkTaskStatus() {
     } catch (e) {}
 }
 
-async function stopTask() {
-    if(!confirm("FORCE STOP?")) return;
-    try {
-        const res = await fetch('/stop_task', { method: 'POST' });
-        const json = await res.json();
-        if(json.status === 'success') {
-            const stopBtn = document.getElementById('stop-btn');
-            if(stopBtn) stopBtn.style.display = 'none';
-        } else {
-            alert(json.message);
-        }
-    } catch (e) { alert("Error: " + e); }
-}
-
-async function connectLogStream() {
-    currentStreamId++;
-    const myStreamId = currentStreamId;
-    
-    const contentPre = document.getElementById('console-content');
-    const decoder = new TextDecoder();
-
-    while (myStreamId === currentStreamId) {
-        try {
-            const response = await fetch('/stream_logs');
-            const reader = response.body.getReader();
-            
-            while (true) {
-                const { done, value } = await reader.read();
-                if (done) break;
-                if (myStreamId !== currentStreamId) { reader.cancel(); return; }
-                
-                // 直接追加文本，不处理 \r (浏览器会自动换行，进度条可能会刷屏，但绝对不会丢数据)
-                contentPre.innerText += decoder.decode(value);
-                contentPre.scrollTop = contentPre.scrollHeight;
-            }
-            await new Promise(r => setTimeout(r, 2000));
-        } catch (e) {
-            console.log("Stream lost, reconnecting...");
-            if (myStreamId !== currentStreamId) return;
-            await new Promise(r => setTimeout(r, 1000));
-        }
-    }
-}
-
-
-async function checkTaskStatus() {
-    try {
-        const res = await fetch('/task_status');
-        const json = await res.json();
-        const stopBtn = document.getElementById('stop-btn');
-        if (json.is_running) stopBtn.style.display = 'inline-block';
-        else stopBtn.style.display = 'none';
-    } catch (e) {}
-}
+// 记录已收到的最后一条日志序号，重连时只拉取新增部分
+let lastLogSeq = 0;
+let logSource = null;
 
-async function connectLogStream() {
-    currentStreamId++;
-    const myStreamId = currentStreamId;
+function connectLogStream() {
+    if (logSource) logSource.close();
     const contentPre = document.getElementById('console-content');
-    const decoder = new TextDecoder();
-    while (myStreamId === currentStreamId) {
-        try {
-            const response = await fetch('/stream_logs');
-            const reader = response.body.getReader();
-            while (true) {
-                const { done, value } = await reader.read();
-                if (done) break;
-                if (myStreamId !== currentStreamId) { reader.cancel(); return; }
-                contentPre.innerText += decoder.decode(value);
-                contentPre.scrollTop = contentPre.scrollHeight;
-            }
-            await new Promise(r => setTimeout(r, 2000));
-        } catch (e) {
-            if (myStreamId !== currentStreamId) return;
-            await new Promise(r => setTimeout(r, 1000));
-        }
-    }
+    // EventSource 断线后会自动重连，并通过 Last-Event-ID 从断点续传
+    logSource = new EventSource(`/stream_logs?format=sse&since=${lastLogSeq}`);
+    logSource.onmessage = (e) => {
+        const seq = parseInt(e.lastEventId);
+        if (!isNaN(seq)) lastLogSeq = seq;
+        contentPre.innerText += JSON.parse(e.data);
+        contentPre.scrollTop = contentPre.scrollHeight;
+    };
+    // tqdm 进度条的 \r 刷新只覆盖这一行，不追加到日志
+    logSource.addEventListener('progress', (e) => {
+        document.getElementById('console-progress').innerText = JSON.parse(e.data);
+    });
 }
 
 async function sendConsoleCmd() {
@@ -124,10 +68,14 @@ async function sendConsoleCmd() {
 }
 
 async function stopTask() {
-    if(!confirm("STOP TASK?")) return;
+    if (!currentJobId || !confirm(`STOP JOB ${currentJobId}?`)) return;
     try {
-        const res = await fetch('/stop_task', { method: 'POST' });
-        if((await res.json()).status === 'success') document.getElementById('stop-btn').style.display = 'none';
+        const res = await fetch('/stop_task', {
+            method: 'POST', headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({ job_id: currentJobId })
+        });
+        // 其他任务仍在运行时按钮切换到最近的那个
+        if((await res.json()).status === 'success') checkTaskStatus();
     } catch (e) {}
 }
 
@@ -136,9 +84,19 @@ async function runTask(action, taskName) {
     contentPre.innerText += `\n> INITIALIZING ${action.toUpperCase()} FOR [${taskName}]...\n`;
     contentPre.scrollTop = contentPre.scrollHeight;
     try {
-        const res = await fetch(`/execute_task?task=${taskName}&action=${action}`);
+        let resume = '';
+        if (action === 'train') {
+            const info = await (await fetch(`/resume_info?task=${taskName}`)).json();
+            if (info.status === 'success' && info.latest
+                && confirm(`RESUME [${taskName}] FROM ${info.latest.name} (EPOCH ${info.latest.epoch ?? '?'} / ${info.epochs.total ?? '?'})?`)) {
+                resume = `&resume=${encodeURIComponent(info.latest.name)}`;
+            }
+        }
+        const res = await fetch(`/execute_task?task=${taskName}&action=${action}${resume}`);
         const json = await res.json();
         if (json.status === 'success') {
+            currentJobId = json.job_id;
+            if (json.message === 'Queued') contentPre.innerText += `\n> QUEUED AS JOB ${json.job_id}\n`;
             document.getElementById('stop-btn').style.display = 'inline-block';
             connectLogStream(); 
         } else {
@@ -147,6 +105,26 @@ async function runTask(action, taskName) {
     } catch (e) { contentPre.innerText += `\n❌ NET ERROR: ${e}\n`; }
 }
 
+async function tuneCache(taskName) {
+    if (!confirm(`AUTOTUNE CACHE SETTINGS FOR [${taskName}]?\nRuns short probes of both caching scripts on a sample of the dataset.`)) return;
+    const target = confirm(`WRITE RESULT AS AN OVERRIDE FOR [${taskName}] ONLY?\n(Cancel = shared CACHE section)`) ? 'task' : 'cache';
+    const contentPre = document.getElementById('console-content');
+    try {
+        const res = await fetch('/autotune', {
+            method: 'POST', headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({task: taskName, target})
+        });
+        const json = await res.json();
+        if (json.status === 'success') {
+            contentPre.innerText += `\n> AUTOTUNE QUEUED AS JOB ${json.job.id}\n`;
+            document.getElementById('stop-btn').style.display = 'inline-block';
+            connectLogStream();
+        } else {
+            contentPre.innerText += `\n❌ START FAILED: ${json.message}\n`;
+        }
+    } catch (e) { contentPre.innerText += `\n❌ NET ERROR: ${e}\n`; }
+}
+
 async function loadMissions() {
     const list = document.getElementById('mission-list');
     list.innerHTML = '<div class="loading-text">SCANNING PROTOCOLS...</div>';
@@ -177,6 +155,7 @@ async function loadMissions() {
                     </div>
                     <div class="v-sep"></div>
                     <div class="action-group-right">
+                        <button class="btn-exec" onclick="tuneCache('${task}')">TUNE</button>
                         <button class="btn-exec" onclick="runTask('cache', '${task}')">CACHE</button>
                         <button class="btn-exec primary" onclick="runTask('train', '${task}')">TRAIN</button>
                     </div>
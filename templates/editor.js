@@ -1,4 +1,6 @@
 const taskId = document.getElementById('current-task-id').value;
+// 加载时的任务版本，保存时回传以检测其他页面的并发修改
+let taskVersion = null;
 
 // --- 模板定义 ---
 const TEMPLATE_DATA = {
@@ -21,29 +23,111 @@ document.addEventListener('DOMContentLoaded', () => {
 });
 
 // --- 路径选择 ---
-async function selectPath(inputId, type, extensions=[]) {
+// 服务端目录浏览器：点击目录进入，点击文件（或"SELECT FOLDER"）选中
+const browser = { inputId: null, type: 'file', extensions: [], path: './', page: 1 };
+
+function selectPath(inputId, type, extensions=[]) {
+    Object.assign(browser, { inputId, type, extensions, page: 1 });
+    const current = document.getElementById(inputId).value;
+    let start = current ? current.replace(/\\/g, '/') : './';
+    if (current && type === 'file') start = start.substring(0, start.lastIndexOf('/') + 1) || './';
+    getBrowserModal().style.display = 'flex';
+    browsePath(start);
+}
+
+function getBrowserModal() {
+    let modal = document.getElementById('path-browser');
+    if (modal) return modal;
+    modal = document.createElement('div');
+    modal.id = 'path-browser';
+    modal.className = 'browser-overlay';
+    modal.innerHTML = `
+        <div class="browser-panel">
+            <div class="browser-header">
+                <button type="button" class="btn-exec" onclick="browseUp()">..</button>
+                <input type="text" id="browser-path" onkeydown="if(event.key==='Enter') browsePath(this.value)">
+                <button type="button" class="btn-exec" onclick="closeBrowser()">X</button>
+            </div>
+            <div class="browser-roots" id="browser-roots"></div>
+            <div class="browser-list" id="browser-list"></div>
+            <div class="browser-footer">
+                <button type="button" class="btn-exec" id="browser-more" onclick="browseMore()">LOAD MORE</button>
+                <button type="button" class="btn-exec primary" id="browser-pick-folder" onclick="pickPath(browser.path)">SELECT FOLDER</button>
+            </div>
+        </div>`;
+    modal.addEventListener('click', (e) => { if (e.target === modal) closeBrowser(); });
+    document.body.appendChild(modal);
+    return modal;
+}
+
+function closeBrowser() { getBrowserModal().style.display = 'none'; }
+
+function browseUp() { if (browser.parent) browsePath(browser.parent); }
+
+function browseMore() { browsePath(browser.path, browser.page + 1); }
+
+async function browsePath(path, page=1) {
+    const params = new URLSearchParams({ path, page, type: browser.type, images: browser.type === 'folder' ? 1 : 0 });
+    if (browser.extensions.length) params.set('ext', browser.extensions.join(','));
+    const list = document.getElementById('browser-list');
     try {
-        const res = await fetch('/select_path', {
-            method: 'POST',
-            headers: {'Content-Type': 'application/json'},
-            body: JSON.stringify({ type, extensions })
-        });
+        const res = await fetch(`/browse?${params}`);
         const json = await res.json();
-        
-        if (json.path) {
-            const input = document.getElementById(inputId);
-            input.value = json.path;
-            if (input.name === 'qwen.output_dir') {
-                const nameInput = document.querySelector('input[name="qwen.output_name"]');
-                if (nameInput && nameInput.value) {
-                    if (!input.value.endsWith('/')) input.value += '/';
-                    input.value += nameInput.value;
-                }
-            }
+        if (json.status !== 'success') {
+            // 路径不存在（例如尚未创建的输出目录）时回到工作目录
+            if (page === 1 && path !== './') return browsePath('./');
+            const message = document.createElement('div');
+            message.className = 'loading-text';
+            message.textContent = json.message;
+            list.replaceChildren(message);
+            return;
+        }
+        Object.assign(browser, { path: json.path, parent: json.parent, page: json.page });
+        document.getElementById('browser-path').value = json.path;
+        if (json.roots) {
+            // 文件名与路径来自磁盘，一律作为文本插入
+            document.getElementById('browser-roots').replaceChildren(...json.roots.map(r => {
+                const button = document.createElement('button');
+                button.type = 'button';
+                button.className = 'btn-card';
+                button.textContent = r.name;
+                button.onclick = () => browsePath(r.path);
+                return button;
+            }));
         }
+        if (page === 1) list.replaceChildren();
+        json.entries.forEach(entry => {
+            const row = document.createElement('div');
+            row.className = `browser-entry ${entry.type}`;
+            const label = document.createElement('span');
+            label.textContent = `${entry.type === 'dir' ? '📁' : '📄'} ${entry.name}`;
+            const info = document.createElement('span');
+            info.className = 'browser-info';
+            info.textContent = entry.type === 'dir'
+                ? (entry.images ? `${entry.images} IMG` : '')
+                : `${(entry.size / 1048576).toFixed(1)} MB`;
+            row.append(label, info);
+            row.onclick = () => entry.type === 'dir' ? browsePath(entry.path) : pickPath(entry.path);
+            list.appendChild(row);
+        });
+        document.getElementById('browser-more').style.display = json.page * json.per_page < json.total ? '' : 'none';
+        document.getElementById('browser-pick-folder').style.display = browser.type === 'folder' ? '' : 'none';
     } catch(e) { console.error(e); }
 }
 
+function pickPath(path) {
+    closeBrowser();
+    const input = document.getElementById(browser.inputId);
+    input.value = path;
+    if (input.name === 'qwen.output_dir') {
+        const nameInput = document.querySelector('input[name="qwen.output_name"]');
+        if (nameInput && nameInput.value) {
+            if (!input.value.endsWith('/')) input.value += '/';
+            input.value += nameInput.value;
+        }
+    }
+}
+
 function getPathInputHtml(id, name, value, type, exts=[]) {
     const extJson = JSON.stringify(exts);
     return `<div class="input-group">
@@ -58,6 +142,7 @@ async function loadTaskConfig(task) {
         const res = await fetch(`/load_task?task=${task}`);
         const json = await res.json();
         if (json.status === 'success') {
+            taskVersion = json.version;
             const config = json.config; 
             for (const [key, value] of Object.entries(config)) {
                 if (key === 'qwen.lora') { document.getElementById('master-profile-select').value = value; continue; }
@@ -284,12 +369,16 @@ async function submitConfig() {
         jsonData.samples.push(sampleObj);
     });
 
-    const payload = { task_name: taskId, yaml_updates: yamlUpdates, json_data: jsonData };
+    const payload = { task_name: taskId, yaml_updates: yamlUpdates, json_data: jsonData, version: taskVersion };
 
     try {
         const res = await fetch('/save', {method:'POST', headers:{'Content-Type':'application/json'}, body:JSON.stringify(payload)});
         const json = await res.json();
-        if(json.status==='success') {
+        if (res.status === 409) {
+            alert("CONFLICT: this mission was modified in another window. Reload to see the latest version.");
+            btn.innerText = "CONFLICT";
+        } else if(json.status==='success') {
+            taskVersion = json.version;
             btn.innerText = "SAVED";
             if (json.new_task_id && json.new_task_id !== taskId) window.location.href = `/editor?task=${json.new_task_id}`;
             else setTimeout(()=>btn.innerText = originalText, 1500);
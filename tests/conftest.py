@@ -0,0 +1,97 @@
+# t.py 在导入时按当前目录定位 src/config.yaml 与 .webui，因此先切换到临时工作目录再导入。
+# 缓存 / 训练脚本替换为 tests/stub_script.py，与 bench/bench_server.py 的做法相同
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import pytest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(TESTS_DIR)
+STUB_SCRIPT = os.path.join(TESTS_DIR, 'stub_script.py')
+WORKSPACE = tempfile.mkdtemp(prefix='musubi-webui-test-')
+
+os.makedirs(os.path.join(WORKSPACE, 'src'))
+with open(os.path.join(WORKSPACE, 'src', 'config.yaml'), 'w', encoding='utf-8') as f:
+    f.write("qwen:\n  global_config:\n    mixed_precision: bf16\n  cache:\n    batch_size: 16\n")
+os.chdir(WORKSPACE)
+os.environ.pop('MUSUBI_DEVICES', None)
+os.environ.pop('MUSUBI_WORKER_TOKEN', None)
+sys.path.insert(0, ROOT)
+
+import t  # noqa: E402
+
+t.LATENTS_SCRIPT = STUB_SCRIPT
+t.TEXT_ENC_SCRIPT = STUB_SCRIPT
+t.TRAIN_SCRIPT = STUB_SCRIPT
+_build_commands = t.build_commands
+
+
+def stub_build_commands(config, task_name, action, resume_path=None):
+    # 训练命令是 accelerate launch <脚本> 参数...，换成直接用当前解释器运行
+    commands = _build_commands(config, task_name, action, resume_path)
+    return [(name, [sys.executable, '-u', *argv[argv.index(STUB_SCRIPT):]] if argv[0] == 'accelerate' else argv)
+            for name, argv in commands]
+
+
+t.build_commands = stub_build_commands
+
+
+@pytest.fixture(scope='session', autouse=True)
+def dispatcher():
+    t.JOB_QUEUE.start()
+    yield
+    os.chdir(ROOT)
+    shutil.rmtree(WORKSPACE, ignore_errors=True)
+
+
+@pytest.fixture
+def make_task(request):
+    # 写入一个训练任务并在测试结束后删除，返回任务名
+    created = []
+
+    def make(**values):
+        name = f"{request.node.name.replace('[', '_').replace(']', '')}_{len(created)}"
+        task_data = {"output_name": name, "output_dir": f"./output/{name}", "max_train_epochs": 2,
+                     "blocks_to_swap": 16, "learning_rate": "0.0001", **values}
+        t.CONFIG_STORE.commit({name: task_data}, note='test')
+        created.append(name)
+        return name
+
+    yield make
+    t.CONFIG_STORE.commit({name: None for name in created}, note='test')
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    # stub(sleep=1, exit=0, ...)：设置 stub_script.py 的行为，子进程继承 webui 的环境变量
+    def configure(**config):
+        monkeypatch.setenv('STUB', json.dumps(config))
+
+    configure()
+    return configure
+
+
+def wait_job(job_id, timeout=20):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = t.JOB_QUEUE.get(job_id)
+        if job['state'] not in ('queued', 'running'): return job
+        time.sleep(0.05)
+    raise AssertionError(f"job {job_id} still {t.JOB_QUEUE.get(job_id)['state']}")
+
+
+def wait_state(job_id, state, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if t.JOB_QUEUE.get(job_id)['state'] == state: return
+        time.sleep(0.02)
+    raise AssertionError(f"job {job_id} never reached {state}")
+
+
+def run_output(job_id):
+    run = t.EXECUTOR.get(job_id)
+    return ''.join(line for _, line in run.logs.since(0)) if run else ''
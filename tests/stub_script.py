@@ -0,0 +1,46 @@
+# 测试用的缓存 / 训练脚本：接受任意命令行参数，行为由环境变量 STUB（JSON）控制：
+#   lines       输出的普通行数（每行之前带一次 \r 进度刷新）
+#   sleep       输出之后等待的秒数
+#   exit        退出码
+#   oom_below   --blocks_to_swap 小于该值时输出 CUDA OOM 并以 1 退出
+#   oom_above   {参数名: 上限}，参数值超过上限时输出 CUDA OOM 并以 1 退出
+#   rate_arg    输出一个 8 步的 tqdm 进度条，速率（it/s）等于该参数的值，参数不存在时为 1
+#   echo_stdin  读取一行 stdin 并原样输出
+import json
+import os
+import sys
+import time
+
+
+def arg_value(name):
+    prefix = f"--{name}="
+    return next((arg[len(prefix):] for arg in sys.argv[1:] if arg.startswith(prefix)), None)
+
+
+def main():
+    config = json.loads(os.environ.get('STUB') or '{}')
+    print(f"stub start {os.path.basename(sys.argv[0])} device={os.environ.get('CUDA_VISIBLE_DEVICES')}", flush=True)
+    swap = arg_value('blocks_to_swap')
+    if config.get('oom_below') is not None and int(swap or 0) < int(config['oom_below']):
+        print(f"torch.OutOfMemoryError: CUDA out of memory (blocks_to_swap={swap})", flush=True)
+        sys.exit(1)
+    for name, limit in (config.get('oom_above') or {}).items():
+        if arg_value(name) is not None and float(arg_value(name)) > limit:
+            print(f"torch.OutOfMemoryError: CUDA out of memory ({name}={arg_value(name)})", flush=True)
+            sys.exit(1)
+    if config.get('rate_arg'):
+        print(f"\r8/8 [00:01<00:00, {float(arg_value(config['rate_arg']) or 1):.2f}it/s]", flush=True)
+    for i in range(1, int(config.get('lines', 0)) + 1):
+        sys.stdout.write(f"\r{i}/{config['lines']} [00:00<00:00, 9.00it/s, avr_loss=0.{i}]")
+        sys.stdout.flush()
+        time.sleep(0.05)
+        sys.stdout.write(f"\rstub line {i}\n")
+        sys.stdout.flush()
+    if config.get('echo_stdin'): print(f"stub got {sys.stdin.readline().strip()}", flush=True)
+    time.sleep(float(config.get('sleep', 0)))
+    print(f"stub done blocks_to_swap={swap}", flush=True)
+    sys.exit(int(config.get('exit', 0)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+import os
+
+import t
+
+
+def test_task_summaries_answers_304_while_nothing_changed(make_task):
+    client = t.app.test_client()
+    name = make_task()
+    first = client.get('/task_summaries')
+    assert first.status_code == 200 and first.headers['ETag']
+    assert name in [task['task'] for task in first.get_json()['tasks']]
+    again = client.get('/task_summaries', headers={'If-None-Match': first.headers['ETag']})
+    assert again.status_code == 304 and again.data == b''
+    assert again.headers['ETag'] == first.headers['ETag']
+
+    task_data = t.plain_value(t.CONFIG_STORE.snapshot()['qwen'][name])
+    t.CONFIG_STORE.commit({name: {**task_data, 'learning_rate': '0.0002'}})
+    changed = client.get('/task_summaries', headers={'If-None-Match': first.headers['ETag']})
+    assert changed.status_code == 200 and changed.headers['ETag'] != first.headers['ETag']
+    [summary] = [task for task in changed.get_json()['tasks'] if task['task'] == name]
+    assert summary['params']['learning_rate'] == '0.0002'
+
+
+def browse(path, **args):
+    return t.app.test_client().get('/browse', query_string={'path': path, **args})
+
+
+def test_browse_lists_directories_inside_roots(tmp_path):
+    os.makedirs('dataset/cats', exist_ok=True)
+    response = browse('dataset')
+    assert response.status_code == 200
+    body = response.get_json()
+    assert [e['name'] for e in body['entries']] == ['cats']
+    assert body['parent'] is not None
+    assert all('abs_path' not in root for root in body['roots'])
+    assert browse('.').get_json()['parent'] is None
+
+
+def test_browse_refuses_paths_outside_roots(tmp_path, monkeypatch):
+    outside = tmp_path / 'outside'
+    outside.mkdir()
+    os.symlink(outside, 'link_out')
+    try:
+        assert browse(str(outside)).status_code == 403
+        assert browse('/').status_code == 403
+        assert browse('dataset/../..').status_code == 403
+        assert browse('link_out').status_code == 403
+        monkeypatch.setattr(t, 'BROWSE_EXTRA_ROOTS', [str(tmp_path)])
+        assert browse(str(outside)).status_code == 200
+    finally:
+        os.remove('link_out')
+
+
+def test_task_paths_become_browse_roots(tmp_path, make_task):
+    output = tmp_path / 'out'
+    output.mkdir()
+    assert browse(str(output)).status_code == 403
+    make_task(output_dir=str(output))
+    assert browse(str(output)).status_code == 200
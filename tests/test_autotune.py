@@ -0,0 +1,52 @@
+import pytest
+
+import t
+from conftest import run_output, wait_job
+
+
+@pytest.fixture
+def autotune_task(tmp_path, make_task, monkeypatch):
+    # 16 张图片的数据集；网格缩小到每个步骤几个候选，使探测在几秒内跑完
+    monkeypatch.setitem(t.DEFAULT_AUTOTUNE, 'grid', {'latents': {'vae_chunk_size': [16, 32]},
+                                                     'text_encoder': {'batch_size': [1, 2, 4, 8, 16]}})
+    monkeypatch.setitem(t.DEFAULT_AUTOTUNE, 'sample_images', 16)
+    image_dir = tmp_path / 'img'
+    image_dir.mkdir()
+    for i in range(16):
+        (image_dir / f'{i}.png').write_bytes(b'png')
+        (image_dir / f'{i}.txt').write_text('a cat', encoding='utf-8')
+    config = tmp_path / 'dataset.json'
+    config.write_text('{"general": {"resolution": [64, 64]}, "datasets": [{"image_directory": "%s"}]}'
+                      % image_dir.as_posix(), encoding='utf-8')
+    return make_task(dataset_config=str(config), vae='vae.safetensors', text_encoder='te.safetensors')
+
+
+def autotune(name, **data):
+    response = t.app.test_client().post('/autotune', json={'task': name, 'target': 'task', **data})
+    assert response.status_code == 200
+    return wait_job(response.get_json()['job']['id'])
+
+
+def test_autotune_picks_largest_batch_that_fits(autotune_task, stub):
+    # 进度条速率等于批量（8 步跑完 16 张图片），批量 8 起显存不足：应选 4，16 不再探测
+    stub(rate_arg='batch_size', oom_above={'batch_size': 4})
+    job = autotune(autotune_task, force=True)
+    assert (job['state'], job['exit_code']) == ('succeeded', 0)
+    result = job['autotune']
+    assert result['chosen'] == {'vae_chunk_size': 16, 'batch_size': 4} and result['applied']
+    probes = {p['params']['batch_size']: p for p in result['steps']['text_encoder']['probes']}
+    assert [probes[b]['items_per_sec'] for b in (1, 2, 4)] == [2.0, 4.0, 8.0]
+    assert (probes[8]['failure'], probes[16]['failure']) == ('oom', 'skipped')
+    assert 'SKIPPED, A LIGHTER SETTING RAN OUT OF MEMORY' in run_output(job['id'])
+    task_data = t.CONFIG_STORE.snapshot()['qwen'][autotune_task]
+    assert t.plain_value(task_data['cache_overrides']) == {'vae_chunk_size': 16, 'batch_size': 4}
+
+
+def test_autotune_reuses_cached_probes(autotune_task, stub):
+    stub(rate_arg='batch_size', oom_above={'batch_size': 4})
+    autotune(autotune_task, force=True, apply=False)
+    job = autotune(autotune_task, apply=False)
+    assert job['autotune']['chosen'] == {'vae_chunk_size': 16, 'batch_size': 4}
+    assert not job['autotune']['applied']
+    assert 'stub start' not in run_output(job['id'])
+    assert 'cache_overrides' not in t.CONFIG_STORE.snapshot()['qwen'][autotune_task]
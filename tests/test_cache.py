@@ -0,0 +1,129 @@
+import json
+
+import pytest
+
+import t
+from conftest import run_output, wait_job
+
+
+def write_dataset(path, dataset):
+    path.write_text(json.dumps(dataset), encoding='utf-8')
+    return str(path)
+
+
+def test_merged_group_config_keeps_every_general_setting(tmp_path):
+    general = {"resolution": [960, 544], "caption_extension": ".txt", "num_frames": 1, "qwen_image_edit": True}
+    qwen_root = {
+        'a': {'dataset_config': write_dataset(tmp_path / 'a.json', {
+            "general": general, "datasets": [{"image_directory": "img/a"}, {"image_directory": "img/shared"}]})},
+        'b': {'dataset_config': write_dataset(tmp_path / 'b.json', {
+            "general": general, "datasets": [{"image_directory": "img/shared"},
+                                             {"image_directory": "img/b", "num_frames": 4}]})},
+    }
+    merged = t.merge_dataset_configs(qwen_root, ['a', 'b'])
+    assert merged['general'] == {}
+    assert [ds['image_directory'] for ds in merged['datasets']] == ['img/a', 'img/shared', 'img/b']
+    assert all(ds['qwen_image_edit'] is True for ds in merged['datasets'])
+    assert [ds['num_frames'] for ds in merged['datasets']] == [1, 1, 4]
+
+
+@pytest.fixture
+def cache_task(tmp_path, make_task):
+    # 一个图片 + 标注的数据集；缓存文件由测试按 musubi 的命名格式手动创建
+    image_dir, cache_dir = tmp_path / 'img', tmp_path / 'cache'
+    image_dir.mkdir()
+    cache_dir.mkdir()
+    (image_dir / 'a.png').write_bytes(b'png')
+    (image_dir / 'a.txt').write_text('a cat', encoding='utf-8')
+    config = write_dataset(tmp_path / 'dataset.json', {
+        "general": {"resolution": [64, 64]},
+        "datasets": [{"image_directory": str(image_dir), "cache_directory": str(cache_dir)}]})
+    name = make_task(dataset_config=config, vae='vae.safetensors', text_encoder='te.safetensors')
+    return name, image_dir, cache_dir
+
+
+def plan(name):
+    steps, _ = t.plan_steps(t.CONFIG_STORE.snapshot(), {"task": name, "action": "cache"})
+    return {step['kind']: step for step in steps}
+
+
+def write_cache(cache_dir):
+    (cache_dir / 'a_0064x0064_qi.safetensors').write_bytes(b'latents')
+    (cache_dir / 'a_qi_te.safetensors').write_bytes(b'te')
+
+
+def test_cache_steps_are_memoized_by_the_manifest_only(cache_task):
+    name, _, cache_dir = cache_task
+    steps = plan(name)
+    assert not any(t.STEP_MEMO.hit(step) for step in steps.values())
+    write_cache(cache_dir)
+    for step in steps.values(): t.STEP_MEMO.record(step, 'job')
+    manifest = json.loads((cache_dir / t.CACHE_MANIFEST_NAME).read_text(encoding='utf-8'))
+    assert set(manifest) == {'latents', 'text_encoder'}
+    assert not any(step['key'] in t.STEP_MEMO._load() for step in steps.values())
+    assert all(t.STEP_MEMO.hit(step) for step in plan(name).values())
+
+
+def test_plan_reports_manifest_state(cache_task):
+    name, _, _ = cache_task
+    response = t.app.test_client().get('/plan', query_string={'task': name, 'action': 'cache'})
+    steps = response.get_json()['steps']
+    assert [step['kind'] for step in steps] == ['latents', 'text_encoder']
+    assert [step['memoized'] for step in steps] == [False, False]
+    [dataset] = steps[0]['cache_report']['datasets']
+    assert dataset['reason'] == 'no manifest' and '_manifest' not in dataset
+
+
+def test_cache_job_records_manifest_and_skips_next_time(cache_task, stub):
+    name, _, cache_dir = cache_task
+    job = wait_job(t.JOB_QUEUE.enqueue(name, 'cache')['id'])
+    assert job['state'] == 'succeeded'
+    assert 'CACHE LATENTS / dataset 0: no manifest' in run_output(job['id'])
+    assert (cache_dir / t.CACHE_MANIFEST_NAME).exists()
+    write_cache(cache_dir)
+    job = wait_job(t.JOB_QUEUE.enqueue(name, 'cache')['id'])
+    output = run_output(job['id'])
+    assert 'SKIP STEP 1: CACHE LATENTS: inputs unchanged' in output
+    assert 'SKIP STEP 2: CACHE TEXT ENCODER: inputs unchanged' in output
+    assert 'stub start' not in output
+
+
+class Run:
+    def __init__(self):
+        self.lines = []
+
+    def log(self, text):
+        self.lines.append(text)
+
+
+def kept_steps(name):
+    run = Run()
+    steps = t.skip_memoized_steps(run, list(plan(name).values()))
+    return [step['kind'] for step in steps], ''.join(run.lines)
+
+
+def test_fresh_manifest_skips_and_stale_manifest_reruns(cache_task):
+    name, image_dir, cache_dir = cache_task
+    write_cache(cache_dir)
+    for step in plan(name).values(): t.STEP_MEMO.record(step, 'job')
+    assert kept_steps(name)[0] == []
+
+    (image_dir / 'a.txt').write_text('a black cat', encoding='utf-8')
+    kinds, log = kept_steps(name)
+    assert kinds == ['text_encoder']
+    assert 'inputs changed (stale 1, removed 0, missing cache 0)' in log
+
+    for step in plan(name).values(): t.STEP_MEMO.record(step, 'job')
+    (cache_dir / 'a_0064x0064_qi.safetensors').unlink()
+    kinds, log = kept_steps(name)
+    assert kinds == ['latents'] and 'missing cache 1' in log
+
+
+def test_cache_setting_change_invalidates_manifest(cache_task):
+    name, _, cache_dir = cache_task
+    write_cache(cache_dir)
+    for step in plan(name).values(): t.STEP_MEMO.record(step, 'job')
+    task_data = t.plain_value(t.CONFIG_STORE.snapshot()['qwen'][name])
+    t.CONFIG_STORE.commit({name: {**task_data, 'cache_overrides': {'vae_chunk_size': 16}}})
+    kinds, log = kept_steps(name)
+    assert kinds == ['latents'] and 'settings changed' in log
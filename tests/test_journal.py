@@ -0,0 +1,130 @@
+import os
+
+import pytest
+
+import t
+
+
+@pytest.fixture
+def store(tmp_path):
+    path = tmp_path / 'config.yaml'
+    path.write_text("qwen:\n  cache:\n    batch_size: 16\n  demo:\n    learning_rate: '0.0001'\n"
+                    "    blocks_to_swap: 16\n", encoding='utf-8')
+
+    def open_store():
+        journal = t.ConfigJournal(str(tmp_path / 'journal.jsonl'), str(tmp_path / 'history.jsonl'))
+        return t.ConfigStore(str(path), journal)
+
+    return open_store
+
+
+def task(store):
+    return t.plain_value(store.snapshot()['qwen']['demo'])
+
+
+def disk(config):
+    return open(config.path, encoding='utf-8').read()
+
+
+def test_commit_only_appends_to_journal(store):
+    config = store()
+    before = config.versions(['demo'])['demo']
+    original = disk(config)
+    value = {**task(config), 'learning_rate': '0.0005'}
+    versions = config.commit({'demo': value}, expect={'demo': before}, note='save')
+    assert versions['demo'] != before
+    assert disk(config) == original
+    assert [e['after'] for e in config.journal.pending] == [value]
+    assert task(config) == value
+    assert task(store()) == value
+    [entry] = config.journal.entries('demo')
+    assert entry['before']['learning_rate'] == '0.0001' and entry['after']['learning_rate'] == '0.0005'
+
+
+def test_compaction_writes_config_and_appends_history(store, monkeypatch):
+    monkeypatch.setattr(t, 'CONFIG_COMPACT_ENTRIES', 3)
+    config = store()
+    for rate in ('0.1', '0.2'): config.commit({'demo': {**task(config), 'learning_rate': rate}})
+    assert "0.0001" in disk(config) and len(config.journal.pending) == 2
+    config.commit({'demo': {**task(config), 'learning_rate': '0.3'}})
+    assert config.journal.pending == [] and os.path.getsize(config.journal.path) == 0
+    assert task(store())['learning_rate'] == '0.3' and "'0.3'" in disk(config)
+    assert config.journal.history_count == 3
+    config.commit({'demo': {**task(config), 'learning_rate': '0.4'}})
+    assert config.compact() == 1
+    assert [e['after']['learning_rate'] for e in config.journal.entries('demo')] == ['0.1', '0.2', '0.3', '0.4']
+
+
+def test_history_is_trimmed_only_past_twice_the_limit(store, monkeypatch):
+    monkeypatch.setattr(t, 'CONFIG_COMPACT_ENTRIES', 1)
+    monkeypatch.setattr(t, 'CONFIG_HISTORY_LIMIT', 2)
+    config = store()
+    for i in range(5): config.commit({'demo': {**task(config), 'learning_rate': str(i)}})
+    assert [e['after']['learning_rate'] for e in config.journal.entries('demo')] == ['3', '4']
+    assert config.journal.history_count == 2
+
+
+def test_torn_journal_tail_is_repaired(store):
+    config = store()
+    config.commit({'demo': {**task(config), 'learning_rate': '0.5'}})
+    with open(config.journal.path, 'a', encoding='utf-8') as f: f.write('{"seq": 2, "ta')
+    reopened = store()
+    reopened.commit({'demo': {**task(reopened), 'blocks_to_swap': 20}})
+    assert [e['seq'] for e in store().journal.entries('demo')] == [1, 2]
+    assert task(store()) == {'learning_rate': '0.5', 'blocks_to_swap': 20}
+
+
+def hand_edit(config, old, new):
+    text = disk(config).replace(old, new)
+    with open(config.path, 'w', encoding='utf-8') as f: f.write(text)
+    os.utime(config.path, ns=(1, 1))
+
+
+def test_hand_edit_of_other_key_is_merged(store):
+    config = store()
+    config.commit({'demo': {**task(config), 'learning_rate': '0.0005'}})
+    hand_edit(config, 'blocks_to_swap: 16', 'blocks_to_swap: 40')
+    assert task(config) == {'learning_rate': '0.0005', 'blocks_to_swap': 40}
+    assert config.journal.pending == []
+    assert task(store()) == {'learning_rate': '0.0005', 'blocks_to_swap': 40}
+
+
+def test_hand_edit_of_same_key_wins(store):
+    config = store()
+    config.commit({'demo': {**task(config), 'learning_rate': '0.0005'}})
+    hand_edit(config, "'0.0001'", "'0.002'")
+    assert task(config)['learning_rate'] == '0.002'
+    assert [e.get('conflict') for e in config.journal.entries('demo')] == [True]
+
+
+def test_replay_skips_entries_that_no_longer_match_disk(store):
+    config = store()
+    current = task(config)
+    # 追加日志后、写入 config.yaml 前中断
+    t.ConfigJournal._append(config.journal.path, [
+        {"seq": 10, "ts": 0, "txn": "a", "task": "demo", "note": None,
+         "before": current, "after": {**current, 'learning_rate': '0.3'}},
+        {"seq": 11, "ts": 0, "txn": "b", "task": "demo", "note": None,
+         "before": {'learning_rate': 'gone'}, "after": {'learning_rate': '0.9'}},
+    ])
+    reopened = store()
+    assert task(reopened)['learning_rate'] == '0.3'
+    assert reopened.journal.pending == []
+    conflicts = [e['seq'] for e in reopened.journal.entries('demo') if e.get('conflict')]
+    assert conflicts == [11]
+    assert task(store())['learning_rate'] == '0.3'
+
+
+def test_rollback_restores_previous_value(make_task):
+    client = t.app.test_client()
+    name = make_task(learning_rate='0.0001')
+    version = client.get('/load_task', query_string={'task': name}).get_json()['version']
+    value = {**t.plain_value(t.CONFIG_STORE.snapshot()['qwen'][name]), 'learning_rate': '0.5'}
+    saved = t.CONFIG_STORE.commit({name: value}, expect={name: version}, note='save')[name]
+    history = client.get('/config_history', query_string={'task': name}).get_json()['history']
+    assert history[0]['set'] == {'learning_rate': '0.5'}
+    result = client.post('/config_rollback', json={'task': name, 'seq': history[0]['seq'], 'to': 'before'})
+    assert result.status_code == 200
+    assert t.CONFIG_STORE.snapshot()['qwen'][name]['learning_rate'] == '0.0001'
+    stale = client.post('/config_rollback', json={'task': name, 'seq': history[0]['seq'], 'version': saved})
+    assert stale.status_code == 409
@@ -0,0 +1,52 @@
+import t
+
+
+def test_splitter_commits_lines_and_keeps_latest_progress():
+    splitter = t.StreamSplitter()
+    lines, progress = splitter.feed(b"start\n\r1/3 a\r2/3 b\r3/3 c")
+    assert lines == ["start\n"]
+    assert progress == "3/3 c"
+    lines, progress = splitter.feed(b"\rdone\n")
+    assert lines == ["done\n"]
+    assert progress == ""
+
+
+def test_splitter_handles_chunk_boundaries():
+    splitter = t.StreamSplitter()
+    data = "первый\r\nzweite ✓\r\n".encode('utf-8')
+    lines = []
+    for i in range(len(data)):
+        lines += splitter.feed(data[i:i + 1])[0]
+    assert lines == ["первый\n", "zweite ✓\n"]
+
+
+def test_splitter_flushes_unterminated_tail():
+    splitter = t.StreamSplitter()
+    assert splitter.feed(b"partial") == ([], None)
+    assert splitter.feed(b"", final=True) == (["partial\n"], "")
+
+
+def test_log_buffer_is_bounded_and_resumable():
+    logs = t.LogBuffer(max_lines=3)
+    for i in range(5): logs.append(f"{i}\n")
+    assert len(logs) == 3
+    assert [line for _, line in logs.since(0)] == ["2\n", "3\n", "4\n"]
+    assert [line for _, line in logs.since(4)] == ["4\n"]
+    logs.clear()
+    logs.append("5\n")
+    assert logs.since(5) == [(6, "5\n")]
+
+
+def test_console_keeps_one_progress_line_per_job():
+    logs = t.LogBuffer()
+    logs.set_live("[a] 1/10", key='a')
+    logs.set_live("[b] 5/10", key='b')
+    logs.set_live("[a] 2/10", key='a')
+    assert logs.live == "[a] 2/10\n[b] 5/10"
+    logs.set_live("", key='a')
+    assert logs.live == "[b] 5/10"
+
+
+def test_loss_regex_is_linear_on_long_lines():
+    line = "steps: 1/10 [00:01<00:02, avr_loss=0.25, val_loss=1e-3] " + "x" * 20000
+    assert dict(t.LOSS_RE.findall(line)) == {"avr_loss": "0.25", "val_loss": "1e-3"}
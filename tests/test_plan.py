@@ -0,0 +1,23 @@
+import t
+
+
+def train_step(key, output):
+    return {"name": "TRAINING SEQUENCE", "kind": "train", "key": key,
+            "outputs": [{"path": str(output), "match": "file"}]}
+
+
+def test_step_memo_hit_and_miss(tmp_path):
+    memo = t.StepMemo(str(tmp_path / 'memo.json'))
+    output = tmp_path / 'model.safetensors'
+    step = train_step('k1', output)
+    assert not memo.hit(step)
+    output.write_bytes(b'weights')
+    memo.record(step, 'job1')
+    assert memo.hit(step)
+    assert t.StepMemo(memo.path).hit(step)
+    assert not memo.hit(train_step('k2', output))
+    output.write_bytes(b'other weights')
+    assert not memo.hit(step)
+    output.unlink()
+    assert not memo.hit(step)
+
@@ -0,0 +1,55 @@
+import json
+import struct
+
+import pytest
+
+import t
+from conftest import run_output, wait_job
+
+
+def write_safetensors(path, tensors, truncate=0):
+    # 只写头部和对应长度的零数据；truncate 截掉头部末尾的字节
+    header, offset = {}, 0
+    for name, shape in tensors.items():
+        size = 2 * (shape[0] * (shape[1] if len(shape) > 1 else 1))
+        header[name] = {"dtype": "BF16", "shape": shape, "data_offsets": [offset, offset + size]}
+        offset += size
+    raw = json.dumps(header).encode()
+    data = struct.pack('<Q', len(raw)) + raw
+    path.write_bytes(data[:len(data) - truncate] if truncate else data + b'\0' * offset)
+    return str(path)
+
+
+@pytest.fixture
+def models(tmp_path):
+    dit = {f"transformer_blocks.{i}.attn.weight": [64, 64] for i in range(4)}
+    return {
+        "dit": write_safetensors(tmp_path / 'dit.safetensors', dit),
+        "vae": write_safetensors(tmp_path / 'vae.safetensors', {"encoder.conv.weight": [8, 8]}),
+        "text_encoder": write_safetensors(tmp_path / 'te.safetensors', {"model.layers.0.mlp.weight": [8, 8]}),
+    }
+
+
+def test_valid_headers_pass(make_task, models):
+    name = make_task(blocks_to_swap=1, **models)
+    result = t.preflight(t.CONFIG_STORE.snapshot(), name)
+    assert result['errors'] == []
+    assert result['models']['dit']['blocks'] == 4
+    assert result['memory']['max_blocks_to_swap'] == 2
+
+
+def test_truncated_header_is_rejected(tmp_path, make_task, models):
+    models['dit'] = write_safetensors(tmp_path / 'broken.safetensors', {"transformer_blocks.0.w": [64, 64]}, truncate=5)
+    name = make_task(**models)
+    response = t.app.test_client().get('/preflight', query_string={'task': name})
+    result = response.get_json()
+    assert result['ok'] is False
+    assert result['errors'] == ["dit: unreadable safetensors header: Truncated header"]
+
+
+def test_train_job_stops_before_launch_on_preflight_error(tmp_path, make_task, models, stub):
+    models['dit'] = write_safetensors(tmp_path / 'broken.safetensors', {"transformer_blocks.0.w": [64, 64]}, truncate=5)
+    job = wait_job(t.JOB_QUEUE.enqueue(make_task(**models), 'train', retry=False)['id'])
+    output = run_output(job['id'])
+    assert job['state'] == 'failed' and 'PREFLIGHT: dit: unreadable safetensors header' in output
+    assert 'stub start' not in output
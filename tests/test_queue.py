@@ -0,0 +1,111 @@
+import time
+
+import t
+from conftest import run_output, wait_job, wait_state
+
+
+def test_job_runs_stub_and_succeeds(make_task, stub):
+    stub(lines=3)
+    job = t.JOB_QUEUE.enqueue(make_task(), 'train', force=True)
+    job = wait_job(job['id'])
+    assert (job['state'], job['exit_code']) == ('succeeded', 0)
+    output = run_output(job['id'])
+    assert 'stub line 3' in output and '1/3 [' not in output
+    assert job['metrics']['loss'] == 0.3
+
+
+def test_failed_step_records_exit_code(make_task, stub):
+    stub(exit=3)
+    job = wait_job(t.JOB_QUEUE.enqueue(make_task(), 'train', force=True, retry=False)['id'])
+    assert (job['state'], job['exit_code']) == ('failed', 3)
+    assert 'FAILED (CODE 3)' in run_output(job['id'])
+
+
+def test_higher_priority_runs_first(make_task, stub):
+    stub(sleep=0.5)
+    blocker = t.JOB_QUEUE.enqueue(make_task(), 'train', force=True)
+    wait_state(blocker['id'], 'running')
+    low = t.JOB_QUEUE.enqueue(make_task(), 'train', force=True)
+    high = t.JOB_QUEUE.enqueue(make_task(), 'train', 5, force=True)
+    low, high = wait_job(low['id']), wait_job(high['id'])
+    assert high['started_at'] < low['started_at']
+
+
+def test_cancel_queued_job_never_starts(make_task, stub):
+    stub(sleep=0.5)
+    blocker = t.JOB_QUEUE.enqueue(make_task(), 'train', force=True)
+    wait_state(blocker['id'], 'running')
+    queued = t.JOB_QUEUE.enqueue(make_task(), 'train', force=True)
+    assert t.JOB_QUEUE.cancel(queued['id'])
+    wait_job(blocker['id'])
+    job = t.JOB_QUEUE.get(queued['id'])
+    assert job['state'] == 'cancelled' and job['started_at'] is None
+
+
+def test_cancel_running_job_kills_process(make_task, stub):
+    stub(sleep=30)
+    job = t.JOB_QUEUE.enqueue(make_task(), 'train', force=True)
+    wait_state(job['id'], 'running')
+    deadline = time.time() + 10
+    while 'stub start' not in run_output(job['id']) and time.time() < deadline: time.sleep(0.05)
+    start = time.time()
+    assert t.JOB_QUEUE.cancel(job['id'])
+    job = wait_job(job['id'])
+    assert time.time() - start < 10
+    assert job['state'] == 'cancelled' and job['exit_code'] != 0
+    assert len(job['attempts']) == 1
+
+
+def test_stop_while_planning_skips_all_steps(make_task, stub, monkeypatch):
+    plan_steps = t.plan_steps
+
+    def slow_plan(*args, **kwargs):
+        time.sleep(0.5)
+        return plan_steps(*args, **kwargs)
+
+    monkeypatch.setattr(t, 'plan_steps', slow_plan)
+    job = t.JOB_QUEUE.enqueue(make_task(), 'train', force=True)
+    wait_state(job['id'], 'running')
+    client = t.app.test_client()
+    assert client.post('/stop_task', json={'job_id': job['id']}).status_code == 200
+    job = wait_job(job['id'])
+    assert (job['state'], job['exit_code']) == ('cancelled', -1)
+    assert 'stub start' not in run_output(job['id'])
+
+
+def test_cancel_after_finish_is_rejected(make_task, stub):
+    job = wait_job(t.JOB_QUEUE.enqueue(make_task(), 'train', force=True)['id'])
+    assert not t.JOB_QUEUE.cancel(job['id'])
+    assert t.JOB_QUEUE.get(job['id'])['state'] == 'succeeded'
+    assert job['id'] not in t.JOB_QUEUE._stop_requested
+
+
+def test_execute_task_reports_whether_job_started(make_task, stub):
+    stub(sleep=0.5)
+    client = t.app.test_client()
+    name = make_task()
+    first = client.get('/execute_task', query_string={'task': name, 'action': 'train', 'force': '1'}).get_json()
+    second = client.get('/execute_task', query_string={'task': name, 'action': 'train', 'force': '1'}).get_json()
+    assert (first['message'], second['message']) == ('Started', 'Queued')
+    for result in (first, second): wait_job(result['job_id'])
+
+
+def test_console_input_reaches_process(make_task, stub):
+    stub(echo_stdin=True)
+    job = t.JOB_QUEUE.enqueue(make_task(), 'train', force=True)
+    wait_state(job['id'], 'running')
+    run = t.EXECUTOR.get(job['id'])
+    deadline = time.time() + 10
+    while not run.send_input('hello') and time.time() < deadline: time.sleep(0.05)
+    wait_job(job['id'])
+    assert 'stub got hello' in run_output(job['id'])
+
+
+def test_bad_priority_is_rejected(make_task):
+    client = t.app.test_client()
+    name = make_task()
+    before = len(t.JOB_QUEUE.list())
+    response = client.get('/execute_task', query_string={'task': name, 'action': 'train', 'priority': 'high'})
+    assert response.status_code == 400
+    assert client.post('/cache_tasks', json={'tasks': [name], 'priority': 'high'}).status_code == 400
+    assert len(t.JOB_QUEUE.list()) == before
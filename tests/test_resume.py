@@ -0,0 +1,57 @@
+import json
+import os
+
+import pytest
+
+import t
+
+
+@pytest.fixture
+def output(tmp_path):
+    folder = tmp_path / 'output'
+    folder.mkdir()
+
+    def state(name, mtime, epoch=None):
+        path = folder / name
+        path.mkdir()
+        if epoch is not None:
+            (path / t.TRAIN_STATE_FILE).write_text(json.dumps({"current_epoch": epoch, "current_step": epoch * 10}))
+        os.utime(path, (mtime, mtime))
+
+    return folder, state
+
+
+def test_latest_state_is_picked(output):
+    folder, state = output
+    state('demo-000002-state', 1000, epoch=2)
+    state('demo-000004-state', 3000, epoch=4)
+    state('demo-step300-state', 2000)
+    state('other-000009-state', 9000)
+    (folder / 'demo-000006-state').write_text('not a directory')
+    task_data = {"output_dir": str(folder), "output_name": "demo"}
+    states = t.find_resume_states(task_data)
+    assert [st['name'] for st in states] == ['demo-000004-state', 'demo-step300-state', 'demo-000002-state']
+    assert (states[0]['epoch'], states[0]['step']) == (4, 40)
+    assert states[1]['step'] == 300
+    assert t.resolve_resume(task_data, 'auto')['name'] == 'demo-000004-state'
+    assert t.resolve_resume(task_data, 'demo-000002-state')['epoch'] == 2
+    assert t.resolve_resume(task_data, 'false') is None
+    with pytest.raises(ValueError):
+        t.resolve_resume(task_data, 'demo-000009-state')
+    assert t.epoch_progress({**task_data, "max_train_epochs": 10})['completed'] == 4
+
+
+def test_no_states_starts_from_scratch(tmp_path):
+    task_data = {"output_dir": str(tmp_path / 'missing'), "output_name": "demo"}
+    assert t.find_resume_states(task_data) == []
+    assert t.resolve_resume(task_data, 'auto') is None
+
+
+def test_resume_job_passes_latest_state_to_trainer(make_task, output):
+    folder, state = output
+    state('demo-000001-state', 1000, epoch=1)
+    state('demo-000003-state', 2000, epoch=3)
+    name = make_task(output_dir=str(folder), output_name='demo')
+    steps, _ = t.plan_steps(t.CONFIG_STORE.snapshot(), {"task": name, "action": "train", "resume": "auto"})
+    assert f"--resume={folder / 'demo-000003-state'}" in steps[0]['argv']
+    assert steps[0]['resume_from']['epoch'] == 3
@@ -0,0 +1,57 @@
+import t
+from conftest import run_output, wait_job
+
+
+def test_classify_failure():
+    lines = ["epoch 1/10\n", "torch.OutOfMemoryError: CUDA out of memory. Tried to allocate 2.00 GiB\n", "exit\n"]
+    assert t.classify_failure(lines, 1)['kind'] == 'oom'
+    assert t.classify_failure(["ok\n"], -9)['kind'] == 'killed'
+    assert t.classify_failure(["ok\n"], 1)['kind'] == 'unknown'
+
+
+def test_oom_ladder_for_training():
+    qwen_root = {'demo': {'blocks_to_swap': 16, 'gradient_checkpointing': True}}
+    job = {'task': 'demo', 'attempts': [{}]}
+    oom = {'kind': 'oom'}
+    rungs = []
+    while True:
+        overrides = t.next_overrides(qwen_root, job, oom, 'train')
+        if overrides is None: break
+        rungs.append(overrides['task'])
+        job['overrides'] = overrides
+        job['attempts'].append({})
+    assert rungs == [{'blocks_to_swap': 24},
+                     {'blocks_to_swap': 24, 'gradient_checkpointing_cpu_offload': True},
+                     {'blocks_to_swap': 32, 'gradient_checkpointing_cpu_offload': True}]
+
+
+def test_ladder_caps_blocks_to_swap_and_skips_no_op_rungs():
+    qwen_root = {'demo': {'blocks_to_swap': 56, 'gradient_checkpointing': True,
+                          'gradient_checkpointing_cpu_offload': True}}
+    job = {'task': 'demo', 'attempts': [{}]}
+    overrides = t.next_overrides(qwen_root, job, {'kind': 'oom'}, 'train')
+    assert overrides == {'task': {'blocks_to_swap': t.BLOCKS_TO_SWAP_LIMIT}}
+    job['overrides'], job['attempts'] = overrides, [{}, {}]
+    assert t.next_overrides(qwen_root, job, {'kind': 'oom'}, 'train') is None
+
+
+def test_unknown_failure_is_not_retried():
+    assert t.next_overrides({'demo': {}}, {'task': 'demo', 'attempts': [{}]}, {'kind': 'unknown'}, 'train') is None
+
+
+def test_oom_job_retries_until_it_fits(make_task, stub):
+    stub(oom_below=32)
+    job = wait_job(t.JOB_QUEUE.enqueue(make_task(blocks_to_swap=16), 'train', force=True)['id'])
+    assert (job['state'], job['exit_code']) == ('succeeded', 0)
+    assert [a['exit_code'] for a in job['attempts']] == [1, 1, 1, 0]
+    assert [a['failure']['kind'] for a in job['attempts'][:3]] == ['oom'] * 3
+    assert job['overrides']['task']['blocks_to_swap'] == 32
+    assert 'stub done blocks_to_swap=32' in run_output(job['id'])
+    # 调整只作用于本次任务，不写回 config.yaml
+    assert t.CONFIG_STORE.snapshot()['qwen'][job['task']]['blocks_to_swap'] == 16
+
+
+def test_retry_disabled(make_task, stub):
+    stub(oom_below=32)
+    job = wait_job(t.JOB_QUEUE.enqueue(make_task(), 'train', force=True, retry=False)['id'])
+    assert job['state'] == 'failed' and len(job['attempts']) == 1
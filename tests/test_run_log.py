@@ -0,0 +1,57 @@
+import gzip
+import os
+
+import pytest
+
+import t
+
+
+@pytest.fixture
+def archive_dir(tmp_path, monkeypatch):
+    # 小段、小成员，使一次读取跨越多个压缩段和多个 gzip 成员
+    monkeypatch.setattr(t, 'RUN_LOG_GZIP_BLOCK', 64)
+    folder = str(tmp_path / 'run')
+    archive = t.RunLogArchive(folder, segment_bytes=500)
+    lines = [f"line {i:04d} {'x' * (i % 17)}\n" for i in range(200)]
+    for line in lines: archive.write(line)
+    archive.close()
+    return folder, ''.join(lines).encode()
+
+
+def test_rotated_segments_are_compressed_with_block_index(archive_dir):
+    folder, _ = archive_dir
+    names = sorted(os.listdir(folder))
+    assert not [n for n in names if n.endswith('.log')]
+    segments = [n for n in names if n.endswith('.log.gz')]
+    assert len(segments) > 5 and all(n + '.json' in names for n in segments)
+    with gzip.open(os.path.join(folder, segments[0]), 'rb') as f: assert f.read().startswith(b"line 0000")
+
+
+@pytest.mark.parametrize('offset,length', [(0, 100), (450, 120), (1234, 3000), (4000, 1), (0, 10 ** 9)])
+def test_range_reads_match_written_bytes(archive_dir, offset, length):
+    folder, expected = archive_dir
+    data, start, total = t.read_run_log(folder, offset, length)
+    assert (start, total) == (offset, len(expected))
+    assert data == expected[offset:offset + length]
+
+
+def test_tail_and_negative_offset(archive_dir):
+    folder, expected = archive_dir
+    assert t.read_run_log(folder, tail=250)[0] == expected[-250:]
+    data, start, _ = t.read_run_log(folder, -300, 100)
+    assert (data, start) == (expected[-300:-200], len(expected) - 300)
+
+
+def test_segments_without_block_index_still_read(archive_dir):
+    folder, expected = archive_dir
+    for name in os.listdir(folder):
+        if name.endswith('.gz.json'): os.remove(os.path.join(folder, name))
+    assert t.read_run_log(folder, 1234, 3000)[0] == expected[1234:4234]
+
+
+def test_unfinished_archive_reads_live_segment(tmp_path):
+    archive = t.RunLogArchive(str(tmp_path / 'run'))
+    archive.write("first\n")
+    archive.write("second\n")
+    assert t.read_run_log(archive.folder, 6)[0] == b"second\n"
+    archive.close()
@@ -0,0 +1,62 @@
+import os
+
+import pytest
+
+import t
+
+Image = pytest.importorskip('PIL.Image')
+
+FORMATS = [
+    ('png', 'RGB', {}),
+    ('jpg', 'RGB', {}),
+    ('jpg', 'RGB', {'progressive': True}),
+    ('bmp', 'RGB', {}),
+    ('webp', 'RGB', {}),
+    ('webp', 'RGB', {'lossless': True}),
+    # 带透明度的有损 WebP 使用扩展格式（VP8X + ALPH）
+    ('webp', 'RGBA', {}),
+]
+FILL = (255, 0, 0, 128)
+WEBP_CHUNKS = [b'VP8 ', b'VP8L', b'VP8X']
+
+
+@pytest.mark.parametrize('ext,mode,options', FORMATS)
+@pytest.mark.parametrize('size', [(300, 200), (17, 1031)])
+def test_image_size_matches_pil(tmp_path, ext, mode, options, size):
+    path = tmp_path / f'image.{ext}'
+    Image.new(mode, size, FILL[:len(mode)]).save(path, **options)
+    with Image.open(path) as image: expected = image.size
+    assert tuple(t.image_size(str(path))) == expected == size
+
+
+def test_webp_variants_cover_every_chunk_type(tmp_path):
+    chunks = []
+    for _, mode, options in FORMATS[4:]:
+        path = tmp_path / 'image.webp'
+        Image.new(mode, (300, 200), FILL[:len(mode)]).save(path, **options)
+        chunks.append(path.read_bytes()[12:16])
+    assert chunks == WEBP_CHUNKS
+
+
+def test_scan_picks_up_image_overwritten_in_place(tmp_path):
+    path = tmp_path / 'a.png'
+    Image.new('RGB', (64, 32)).save(path)
+    cache = t.DirectoryScanCache()
+    assert cache.scan(str(tmp_path))['a.png'][2:] == (64, 32)
+    dir_stat = os.stat(tmp_path)
+    Image.new('RGB', (128, 96)).save(path)
+    os.utime(tmp_path, ns=(dir_stat.st_atime_ns, dir_stat.st_mtime_ns))
+    assert cache.scan(str(tmp_path))['a.png'][2:] == (128, 96)
+
+
+def test_scan_reuses_unchanged_entries(tmp_path, monkeypatch):
+    for name in ('a.png', 'b.png'): Image.new('RGB', (8, 8)).save(tmp_path / name)
+    cache = t.DirectoryScanCache()
+    first = cache.scan(str(tmp_path))
+    parsed = []
+    image_size = t.image_size
+    monkeypatch.setattr(t, 'image_size', lambda path: parsed.append(path) or image_size(path))
+    assert cache.scan(str(tmp_path)) is first
+    Image.new('RGB', (16, 8)).save(tmp_path / 'c.png')
+    assert cache.scan(str(tmp_path))['c.png'][2:] == (16, 8)
+    assert [os.path.basename(p) for p in parsed] == ['c.png']
@@ -0,0 +1,96 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+from werkzeug.serving import make_server
+
+import t
+from conftest import ROOT, run_output, wait_job, wait_state
+
+TOKEN = 'test-token'
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setattr(t, 'WORKER_TOKEN', TOKEN)
+    httpd = make_server('127.0.0.1', 0, t.app, threaded=True)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_port}"
+    httpd.shutdown()
+
+
+@pytest.fixture
+def worker(server, stub):
+    # 启动 worker.py 子进程并等待注册完成；STUB 需在启动前设置，节点上的步骤继承节点进程的环境变量
+    processes = []
+
+    def start(name='test-node', **config):
+        stub(**config)
+        process = subprocess.Popen(
+            [sys.executable, '-u', os.path.join(ROOT, 'worker.py'), '--server', server, '--token', TOKEN,
+             '--name', name, '--workdir', os.getcwd()],
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        processes.append(process)
+        deadline = time.time() + 10
+        while not any(w['name'] == name for w in t.WORKERS.status()):
+            if process.poll() is not None or time.time() > deadline:
+                pytest.fail(f"worker did not register: {process.communicate()[0]}")
+            time.sleep(0.05)
+        return process
+
+    yield start
+    for process in processes:
+        process.terminate()
+        process.wait(10)
+    deadline = time.time() + 10
+    while t.WORKERS.status() and time.time() < deadline: time.sleep(0.05)
+
+
+def test_register_requires_configured_token(monkeypatch):
+    client = t.app.test_client()
+    monkeypatch.setattr(t, 'WORKER_TOKEN', None)
+    response = client.post('/worker/register', json={}, headers={'X-Worker-Token': ''})
+    assert response.status_code == 403 and 'MUSUBI_WORKER_TOKEN' in response.get_json()['message']
+    monkeypatch.setattr(t, 'WORKER_TOKEN', TOKEN)
+    assert client.post('/worker/register', json={}, headers={'X-Worker-Token': 'wrong'}).status_code == 403
+    assert client.get('/worker/poll', query_string={'worker': 'x'}).status_code == 403
+
+
+def test_worker_refuses_to_start_without_token(server):
+    env = {k: v for k, v in os.environ.items() if k != 'MUSUBI_WORKER_TOKEN'}
+    result = subprocess.run([sys.executable, os.path.join(ROOT, 'worker.py'), '--server', server],
+                            capture_output=True, text=True, env=env, timeout=10)
+    assert result.returncode != 0 and 'MUSUBI_WORKER_TOKEN' in result.stderr
+
+
+def test_job_runs_on_worker_when_local_slot_busy(make_task, worker):
+    process = worker(sleep=1)
+    local = t.JOB_QUEUE.enqueue(make_task(), 'train', force=True)
+    wait_state(local['id'], 'running')
+    remote = t.JOB_QUEUE.enqueue(make_task(), 'train', force=True)
+    remote, local = wait_job(remote['id']), wait_job(local['id'])
+    assert (remote['state'], remote.get('worker')) == ('succeeded', 'test-node')
+    assert local['state'] == 'succeeded' and not local.get('worker')
+    output = run_output(remote['id'])
+    assert 'WORKER: test-node' in output and 'stub done' in output
+    process.terminate()
+    assert process.wait(10) == 0
+    assert t.WORKERS.status() == []
+
+
+def test_cancel_remote_job(make_task, worker):
+    worker(sleep=30)
+    local = t.JOB_QUEUE.enqueue(make_task(), 'train', force=True)
+    wait_state(local['id'], 'running')
+    remote = t.JOB_QUEUE.enqueue(make_task(), 'train', force=True)
+    wait_state(remote['id'], 'running')
+    deadline = time.time() + 10
+    while 'stub start' not in run_output(remote['id']) and time.time() < deadline: time.sleep(0.05)
+    assert t.JOB_QUEUE.cancel(remote['id']) and t.JOB_QUEUE.cancel(local['id'])
+    remote = wait_job(remote['id'], timeout=10)
+    assert remote['state'] == 'cancelled' and remote['exit_code'] != 0
+    wait_job(local['id'], timeout=10)
@@ -0,0 +1,208 @@
+# 远程工作节点：把本机的 GPU 作为执行槽位注册到 webui，长轮询领取任务步骤在本机运行，输出与退出码回传给 webui
+# 用法：
+#   MUSUBI_WORKER_TOKEN=<令牌> python worker.py --server http://192.168.1.10:5000 --devices 0,1
+#   python worker.py --server http://127.0.0.1:5000 --token <令牌> --name local-test --workdir /tmp/node1
+# 令牌须与 webui 的 MUSUBI_WORKER_TOKEN 相同；webui 未设置令牌时不接受节点注册
+# 工作目录下需要有与 webui 相同的 src/musubi_tuner 脚本和模型路径；任务引用的 JSON 配置由 webui 随任务下发
+# 只依赖标准库
+import argparse
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+READ_CHUNK_SIZE = 64 * 1024
+RETRY_SECONDS = 5
+
+
+class Worker:
+    def __init__(self, server, name, devices, workdir, token=None, python=sys.executable):
+        self.server = server.rstrip('/')
+        self.name = name
+        self.devices = devices
+        self.workdir = os.path.abspath(workdir)
+        self.token = token
+        self.python = python
+        self.worker_id = None
+        self.poll_seconds = 20
+        self._lock = threading.Lock()
+        self._processes = {}
+
+    def call(self, method, path, body=None, data=None, timeout=30, **params):
+        url = self.server + path + ('?' + urllib.parse.urlencode(params) if params else '')
+        headers = {"X-Worker-Token": self.token} if self.token else {}
+        if body is not None:
+            data = json.dumps(body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        req = urllib.request.Request(url, data=data, headers=headers, method=method)
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            return json.loads(resp.read() or b'{}')
+
+    def register(self):
+        while True:
+            try:
+                result = self.call('POST', '/worker/register', {"name": self.name, "devices": self.devices})
+                self.worker_id = result['worker_id']
+                self.poll_seconds = result.get('poll_seconds', self.poll_seconds)
+                print(f"registered as {self.worker_id} ({self.name}, devices={self.devices})", flush=True)
+                return
+            except urllib.error.HTTPError as e:
+                # 令牌错误或 webui 未启用远程节点，重试没有意义
+                if e.code == 403: raise SystemExit(f"register refused: {e.read().decode('utf-8', 'replace').strip()}")
+                print(f"register failed: {e}", flush=True)
+                time.sleep(RETRY_SECONDS)
+            except (OSError, ValueError, KeyError) as e:
+                print(f"register failed: {e}", flush=True)
+                time.sleep(RETRY_SECONDS)
+
+    def serve(self):
+        self.register()
+        while True:
+            try:
+                result = self.call('GET', '/worker/poll', timeout=self.poll_seconds + 30, worker=self.worker_id)
+            except urllib.error.HTTPError as e:
+                if e.code == 404:
+                    # webui 重启或判定本节点掉线：手上的步骤已被判失败，结束它们后重新注册
+                    print("server forgot this worker, re-registering", flush=True)
+                    self.stop_all()
+                    self.register()
+                else:
+                    time.sleep(RETRY_SECONDS)
+                continue
+            except (OSError, ValueError) as e:
+                print(f"poll failed: {e}", flush=True)
+                time.sleep(RETRY_SECONDS)
+                continue
+            for message in result.get('messages', []):
+                try:
+                    self.handle(message)
+                except Exception as e:
+                    print(f"message {message.get('type')} failed: {e}", flush=True)
+
+    def handle(self, message):
+        kind = message.get('type')
+        if kind == 'run':
+            self.start(message)
+        elif kind == 'stop':
+            self.stop(message['id'])
+        elif kind == 'stdin':
+            with self._lock: process = self._processes.get(message['id'])
+            if process and process.stdin:
+                process.stdin.write(message.get('data', '').encode('utf-8'))
+                process.stdin.flush()
+
+    def write_files(self, files):
+        for rel, text in files.items():
+            path = os.path.normpath(os.path.join(self.workdir, rel))
+            if os.path.commonpath([path, self.workdir]) != self.workdir: raise ValueError(f"path outside workdir: {rel}")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w', encoding='utf-8') as f: f.write(text)
+
+    def start(self, spec):
+        process_id = spec['id']
+        print(f"run {process_id}: job {spec.get('job')} {spec.get('step')}", flush=True)
+        argv = [self.python if arg == '{python}' else arg for arg in spec['argv']]
+        env = os.environ.copy()
+        env.update(spec.get('env', {}))
+        try:
+            self.write_files(spec.get('files', {}))
+            process = subprocess.Popen(
+                argv, cwd=self.workdir, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, stdin=subprocess.PIPE,
+                bufsize=0, env=env, start_new_session=(os.name != 'nt')
+            )
+        except (OSError, ValueError) as e:
+            self.send_log(process_id, f"❌ WORKER {self.name}: {e}\n".encode('utf-8'))
+            self.send_exit(process_id, -1)
+            return
+        with self._lock: self._processes[process_id] = process
+        threading.Thread(target=self.pump, args=(process_id, process), daemon=True).start()
+
+    def pump(self, process_id, process):
+        while True:
+            data = process.stdout.read(READ_CHUNK_SIZE)
+            if not data: break
+            if not self.send_log(process_id, data): self.kill(process)
+        process.stdout.close()
+        rc = process.wait()
+        with self._lock: self._processes.pop(process_id, None)
+        self.send_exit(process_id, rc)
+        print(f"exit {process_id}: {rc}", flush=True)
+
+    def send_log(self, process_id, data):
+        # 返回 False 表示 webui 已不认识这个步骤
+        try:
+            self.call('POST', '/worker/log', data=data, worker=self.worker_id, id=process_id)
+        except urllib.error.HTTPError as e:
+            return e.code != 404
+        except OSError as e:
+            print(f"log upload failed: {e}", flush=True)
+        return True
+
+    def send_exit(self, process_id, rc):
+        for _ in range(5):
+            try:
+                self.call('POST', '/worker/exit', {"worker": self.worker_id, "id": process_id, "rc": rc})
+                return
+            except urllib.error.HTTPError:
+                return
+            except OSError:
+                time.sleep(RETRY_SECONDS)
+
+    @staticmethod
+    def kill(process):
+        if process.poll() is not None: return
+        if os.name == 'nt':
+            subprocess.call(['taskkill', '/F', '/T', '/PID', str(process.pid)])
+        else:
+            try:
+                os.killpg(os.getpgid(process.pid), signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def stop(self, process_id):
+        with self._lock: process = self._processes.get(process_id)
+        if process: self.kill(process)
+
+    def stop_all(self):
+        with self._lock: processes = list(self._processes.values())
+        for process in processes: self.kill(process)
+
+    def unregister(self):
+        try:
+            self.call('POST', '/worker/unregister', {"worker": self.worker_id}, timeout=5)
+        except OSError:
+            pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="musubi webui remote worker")
+    parser.add_argument('--server', required=True, help="webui 地址，例如 http://192.168.1.10:5000")
+    parser.add_argument('--name', default=socket.gethostname())
+    parser.add_argument('--devices', default='', help="逗号分隔的 GPU 编号，每个编号一个槽位；留空为单槽位且不绑定 GPU")
+    parser.add_argument('--workdir', default='.', help="运行训练脚本的目录（相当于 webui 的工作目录）")
+    parser.add_argument('--token', default=os.environ.get('MUSUBI_WORKER_TOKEN'))
+    parser.add_argument('--python', default=sys.executable, help="运行缓存脚本使用的解释器")
+    args = parser.parse_args()
+    if not args.token: parser.error("--token or MUSUBI_WORKER_TOKEN is required")
+
+    devices = [d.strip() for d in args.devices.split(',') if d.strip()] or [None]
+    worker = Worker(args.server, args.name, devices, args.workdir, args.token, args.python)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        worker.serve()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        worker.stop_all()
+        if worker.worker_id: worker.unregister()
+
+
+if __name__ == '__main__':
+    main()